@@ -1,96 +1,209 @@
-from flask import Flask, jsonify, request
+from flask import g, jsonify, request
 import requests
-import overpass
-import math
-import tenseal as ts
 import base64
-import time
-
-app = Flask(__name__)
-
-# Global variable to store geofence point coordinates
-geofence_coordinates = []
-
-def get_geofence_coordinates():
-    global geofence_coordinates
-    print("Fetching geofence coordinates...")
-    
-    # Use fallback coordinates first to prevent startup delays
-    geofence_coordinates = [
-        [math.radians(-9.724087), math.radians(51.573037)],
-        [math.radians(-9.724000), math.radians(51.573100)],
-        [math.radians(-9.723900), math.radians(51.572900)],
-        [math.radians(-9.723800), math.radians(51.572800)],
-        [math.radians(-9.723700), math.radians(51.572700)]
-    ]
-    
-    try:
-        api = overpass.API(timeout=5)  # Reduced timeout
-        query = """
-        node["amenity"="cafe"](50.0,-10.0,60.0,2.0);
-        out qt 100;
-        """
-        result = api.get(query)
-        # Clear fallback and use API data if successful
-        geofence_coordinates = []
-        numGeofenceBoundaries = 3  # Further reduced for performance
-        count = 0
-        for feature in result['features']:
-            if count >= numGeofenceBoundaries:
-                break
-            lon, lat = feature['geometry']['coordinates']
-            lon_rounded, lat_rounded = round(lon, 6), round(lat, 6)
-            geofence_coordinates.append([math.radians(lon_rounded), math.radians(lat_rounded)])
-            count += 1
-        print(f"Successfully loaded {len(geofence_coordinates)} geofence coordinates from API")
-    except Exception as e:
-        print(f"Failed to fetch geofence coordinates: {e}")
-        print(f"Using {len(geofence_coordinates)} fallback coordinates")
-        # Keep the fallback coordinates already set
+import os
+import threading
+from ckks_engine import CKKSEngine, ContextPool
+import geofencing_service
+from geofencing_service import (app, KEY_CACHE_TTL, KeyAuthorityRejected, KeyCache, backend_stats, check_key_authority_response,
+                                empty_decisions, key_authority_pool, scatter_gather, start_catalog)
+from service_common import (DEADLINE_CHECK_CHUNK, DeadlineExceeded, RESPONSE_FORMATS, admission_controlled, check_deadline,
+                            deadline_bounded, deadline_headers, remaining_budget)
+
+# The CKKS backend of the shared Geofencing service (shared/geofencing_service.py)
+
+# Reduced max request size for better performance
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
+
+FALLBACK_GEOFENCES = [
+    (-9.724087, 51.573037),
+    (-9.724000, 51.573100),
+    (-9.723900, 51.572900),
+    (-9.723800, 51.572800),
+    (-9.723700, 51.572700)
+]
+
+# Results only need the last modulus level for decryption, anything above it is dropped before transfer
+RESULT_MOD_SWITCH = os.environ.get("CKKS_RESULT_MOD_SWITCH", "1") == "1"
+
+# Most circles one request forwards to the key authority, whose request limit is sized for this many result ciphertexts
+CKKS_MAX_RESULTS = int(os.environ.get("CKKS_MAX_RESULTS", "1024"))
+
+ciphertext_bytes_lock = threading.Lock()
+ciphertext_bytes = {"requests": 0, "upload": 0, "evaluated": 0, "forwarded": 0}  # Serialized bytes per stage
+
+def result_level_drops(context):
+    # The evaluation consumes one level (the rescale after the scalar products)
+    if not RESULT_MOD_SWITCH:
+        return 0
+    return max(context.seal_context().data.first_context_data().chain_index() - 1, 0)
+
+def record_ciphertext_bytes(upload, evaluated, forwarded):
+    with ciphertext_bytes_lock:
+        ciphertext_bytes["requests"] += 1
+        ciphertext_bytes["upload"] += upload
+        ciphertext_bytes["evaluated"] += evaluated
+        ciphertext_bytes["forwarded"] += forwarded
+
+def get_ciphertext_bytes():
+    with ciphertext_bytes_lock:
+        return dict(ciphertext_bytes)
 
-get_geofence_coordinates()
+# TenSEAL threads per context, and parsed context instances kept per worker process (ckks_engine.ContextPool)
+TENSEAL_THREADS = int(os.environ.get("TENSEAL_THREADS", "1"))
+CONTEXT_POOL_SIZE = int(os.environ.get("CONTEXT_POOL_SIZE", "10"))  # Idle instances kept, match the threads per worker
 
-def deserialize_ckks_vector(serialized_vec, context):
-    return ts.ckks_vector_from(context, base64.b64decode(serialized_vec.encode("utf-8")))
+# Evaluation-only contexts (no secret or public key) fetched from the key authority once per context_id
+evaluation_pools = {}  # context_id -> ContextPool
+evaluation_context_lock = threading.Lock()
+
+def get_evaluation_pool(context_id, deadline):
+    with evaluation_context_lock:
+        if context_id in evaluation_pools:
+            return evaluation_pools[context_id]
+    check_deadline(deadline, "key_authority")
+    response = key_authority_pool.request("GET", "get-ckks-context?role=evaluation", timeout=remaining_budget(deadline))
+    response.raise_for_status()
+    data = response.json()
+    if data["context_id"] != context_id:
+        raise ValueError(f"Unknown context_id '{context_id}', the key authority uses '{data['context_id']}'")
+    pool = ContextPool(base64.b64decode(data["ckks_context"].encode("utf-8")), CONTEXT_POOL_SIZE, TENSEAL_THREADS)
+    with evaluation_context_lock:
+        return evaluation_pools.setdefault(context_id, pool)
+
+# Contexts the key authority still decrypts under, cached like the integer backends' current key. A context missing
+# from a refresh was retired: its evaluation context and cached results are dropped with it.
+retained_contexts = KeyCache(KEY_CACHE_TTL)
+
+def fetch_retained_contexts(timeout=None):
+    response = key_authority_pool.request("GET", "get-ckks-context-ids", timeout=timeout)
+    response.raise_for_status()
+    retained = frozenset(response.json()["retained"])
+    with evaluation_context_lock:
+        retired = [context_id for context_id in evaluation_pools if context_id not in retained]
+        for context_id in retired:
+            del evaluation_pools[context_id]
+    for context_id in retired:
+        geofencing_service.result_cache.drop_key(context_id)
+    return retained
+
+def context_retained(context_id, deadline):
+    # A context the cached list lacks may be newer than it (a rotation), so the list is refreshed once before refusing
+    for refresh in (False, True):
+        check_deadline(deadline, "key_authority")
+        if context_id in retained_contexts.get(fetch_retained_contexts, remaining_budget(deadline), refresh):
+            return True
+    return False
+
+def get_context_pools():
+    with evaluation_context_lock:
+        return {context_id: pool.snapshot() for context_id, pool in evaluation_pools.items()}
+
+backend_stats["ciphertext_bytes"] = get_ciphertext_bytes
+backend_stats["context_pools"] = get_context_pools
+backend_stats["retained_contexts"] = retained_contexts.summary
+
+def get_engine(context):
+    # The shared CKKS engine (ckks_engine.py)
+    return CKKSEngine(context, result_level_drops(context), DEADLINE_CHECK_CHUNK)
+
+def evaluate_ckks_request(user_terms, context, deadline, coefficients, scheme="prop"):
+    engine = get_engine(context)
+    terms = engine.deserialize_terms(user_terms, scheme)
+    upload_bytes = sum(len(user_terms[term]) for term in engine.term_fields(scheme))
+    batch, = engine.evaluate_many([terms], coefficients, lambda stage: check_deadline(deadline, stage), scheme)
+    return engine.serialize_batch(batch), upload_bytes, batch.evaluated_bytes
+
+# Scheme and key authority endpoint of each location route, both schemes yield 1 - cos(d/R) against the same thresholds
+LOCATION_ROUTES = {
+    "/submit-mobile-node-location-ckks": ("prop", "submit-geofence-result-prop-ckks"),
+    "/submit-mobile-node-location-ref-ckks": ("ref", "submit-geofence-result-ref-ckks")
+}
 
 @app.route("/submit-mobile-node-location-ckks", methods=['POST'])
+@app.route("/submit-mobile-node-location-ref-ckks", methods=['POST'])
+@deadline_bounded
+@admission_controlled
 def submit_mobile_node_location_ckks():
+    scheme, key_authority_endpoint = LOCATION_ROUTES[request.url_rule.rule]
     try:
         data = request.get_json()
-        if not data or 'user_encrypted_location' not in data or 'ckks_context' not in data:
+        if not data or 'user_encrypted_location' not in data or ('context_id' not in data and 'ckks_context' not in data):
             return jsonify({"status": "error", "message": "Missing required fields"}), 400
+        response_format = data.get('response_format', 'list')
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({"status": "error", "message": f"Unknown response_format '{response_format}', expected one of: {', '.join(RESPONSE_FORMATS)}"}), 400
+        request_catalog = geofencing_service.catalog  # Read once, a concurrent reload does not change this request's version
+        entries = request_catalog.select_entries(data.get('tags'))
+        circles, groups = request_catalog.plan_evaluation(entries, response_format)
+        ring_thresholds = request_catalog.get_ring_thresholds(data.get('radii'), circles) if response_format == "rings" else None
+        if geofencing_service.GEOFENCE_SHARD_URLS:
+            return scatter_gather(request.path, data, g.deadline)
+        if not circles:
+            return jsonify({**empty_decisions(response_format), **request_catalog.response_fields(entries)}), 200
+        if len(circles) > CKKS_MAX_RESULTS:
+            return jsonify({"status": "error", "message": f"The selected geofences expand to {len(circles)} circles, more than the {CKKS_MAX_RESULTS} "
+                                                          "the key authority accepts (CKKS_MAX_RESULTS), narrow them with tags"}), 413
+        if 'context_id' in data and not context_retained(data['context_id'], g.deadline):
+            return jsonify({"status": "error", "message": "Unknown or retired context_id"}), 400
+        # Entries are keyed by the context they were evaluated under, clients on different retained contexts share the cache
+        result_cache = geofencing_service.result_cache
+        cache_key, cached = result_cache.lookup(data.get('context_id') or data['ckks_context'], request_catalog.version, data)
+        if cached is not None:
+            return jsonify({**cached, "cached": True}), 200
 
-        context = ts.context_from(base64.b64decode(data['ckks_context'].encode("utf-8")))
-        user_terms = data['user_encrypted_location']
-        c1_enc = deserialize_ckks_vector(user_terms['c1_enc'], context)
-        c2_enc = deserialize_ckks_vector(user_terms['c2_enc'], context)
-        c3_enc = deserialize_ckks_vector(user_terms['c3_enc'], context)
-
-        intermediate_values = []
-        for idx, (center_longitude, center_latitude) in enumerate(geofence_coordinates):
-            # Optimize computation - use simpler operations
-            val = c1_enc * (-math.sin(center_latitude))
-            val += c2_enc * (-math.cos(center_latitude) * math.cos(center_longitude))
-            val += c3_enc * (-math.cos(center_latitude) * math.sin(center_longitude))
-            val += 1
-            intermediate_values.append(base64.b64encode(val.serialize()).decode("utf-8"))
+        check_deadline(g.deadline, "deserialization")
+        if 'context_id' in data:
+            pool = get_evaluation_pool(data['context_id'], g.deadline)
+        else:
+            # Older clients echo their full context with every request
+            pool = ContextPool(base64.b64decode(data['ckks_context'].encode("utf-8")), 0, TENSEAL_THREADS)
+        with pool.context() as context:
+            intermediate_values, upload_bytes, evaluated_bytes = evaluate_ckks_request(data['user_encrypted_location'], context, g.deadline, request_catalog.scheme_coefficients(scheme, circles), scheme)
+        forwarded_bytes = sum(len(value) for value in intermediate_values)
+        record_ciphertext_bytes(upload_bytes, evaluated_bytes or forwarded_bytes, forwarded_bytes)
 
         payload = {
-            "ckks_context": data['ckks_context'],
-            "intermediate_values": intermediate_values
+            "context_id": data.get('context_id'),
+            "intermediate_values": intermediate_values,
+            "thresholds": [request_catalog.thresholds[idx] for idx in circles],
+            "ring_thresholds": ring_thresholds,
+            "groups": groups,
+            "response_format": response_format,
+            "max_speed": data.get('max_speed')
         }
-        response = requests.post(
-            "http://keyauthority:5002/submit-geofence-result-prop-ckks",
+        check_deadline(g.deadline, "key_authority")
+        response = key_authority_pool.request(
+            "POST", key_authority_endpoint,
             json=payload,
-            timeout=30
+            headers=deadline_headers(g.deadline),
+            timeout=remaining_budget(g.deadline)
         )
-        response.raise_for_status()
+        check_key_authority_response(response, g.deadline)
         keyauth_response = response.json()
+        if response_format == "any":
+            keyauth_response = request_catalog.resolve_any_match(keyauth_response, circles, entries)
+        keyauth_response.update(request_catalog.response_fields(entries))
+        if keyauth_response.get("status") == "success":
+            result_cache.store(cache_key, keyauth_response)
         return jsonify(keyauth_response), 200
         
+    except DeadlineExceeded:
+        raise
+    except KeyAuthorityRejected as e:
+        return jsonify(e.body), e.status_code
+    except requests.exceptions.Timeout as e:
+        check_deadline(g.deadline, "key_authority")
+        print("Key authority timed out before the request deadline:", e)
+        return jsonify({"status": "error", "message": str(e)}), 500
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
-        print("Error in /submit-mobile-node-location-ckks:", e)
+        print(f"Error in {request.path}:", e)
         return jsonify({"status": "error", "message": str(e)}), 500
 
+# Smaller Overpass query than the integer backends, with a few fixed geofences when it fails
+start_catalog(timeout=5, limit=100, geofences=3, fallback=FALLBACK_GEOFENCES)
+
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=5001)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=int(os.environ.get("PORT", "5001")))
\ No newline at end of file
@@ -1,75 +1,210 @@
-from flask import Flask, jsonify, request
+from flask import g, jsonify, request
 import tenseal as ts
 import base64
+import json
 import traceback
+import os
+import threading
+from ckks_engine import CKKSEngine, ContextPool
+from key_authority_service import (app, DEFAULT_THRESHOLD, GEOFENCE_RADIUS, KEY_STORE_DIR, KeyRotationUnavailable, KeyStore,
+                                   admin_authorized, any_match_response, backend_stats, decision_parameters, decision_response,
+                                   decrypt_until_inside)
+from service_common import DEADLINE_CHECK_CHUNK, DeadlineExceeded, admission_controlled, check_deadline, deadline_bounded
 
-app = Flask(__name__)
-# Reduced max request size for better performance
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
+# The CKKS backend of the shared key authority (shared/key_authority_service.py)
+
+# Evaluation keys the Geofencing service needs: the prop/ref evaluations only multiply by plaintext scalars
+# and add constants, so neither relinearization nor galois (rotation) keys are used by default
+EVALUATION_RELIN_KEYS = os.environ.get("EVALUATION_RELIN_KEYS", "0") == "1"
+EVALUATION_GALOIS_KEYS = os.environ.get("EVALUATION_GALOIS_KEYS", "0") == "1"
+
+# TenSEAL threads per context, and parsed context instances kept per worker process (ckks_engine.ContextPool)
+TENSEAL_THREADS = int(os.environ.get("TENSEAL_THREADS", "1"))
+CONTEXT_POOL_SIZE = int(os.environ.get("CONTEXT_POOL_SIZE", "10"))  # Idle instances kept, match the threads per worker
+
+# CKKS parameters, optionally taken from a profile written by ckks_tuner.py (applies to newly generated keys).
+# The defaults are the tuner's selection for a 100 m radius: the cheapest set whose error stays a tenth of the
+# threshold 1 - cos(r/R) ~ 1.2e-10. Smaller scales are faster but err by far more than the threshold (2^21: ~2e-2).
+CKKS_PROFILE = os.environ.get("CKKS_PROFILE")
+DEFAULT_CKKS_PARAMETERS = {
+    "poly_modulus_degree": 8192,
+    "coeff_mod_bit_sizes": [60, 55, 60],
+    "global_scale_bits": 55,
+    "max_error": 8.8e-12                 # Largest absolute error of a decrypted value the tuner measured
+}
+
+def load_ckks_parameters(profile_path):
+    if not profile_path:
+        return dict(DEFAULT_CKKS_PARAMETERS)
+    with open(profile_path) as f:
+        selected = json.load(f)["selected"]
+    return {name: selected[name] for name in DEFAULT_CKKS_PARAMETERS}
+
+ckks_parameters = load_ckks_parameters(CKKS_PROFILE)
 
 # Generate CKKS context at startup - optimized for performance
 def create_ckks_context():
     context = ts.context(
         ts.SCHEME_TYPE.CKKS,
-        poly_modulus_degree=4096,  # Reduced from 8192
-        coeff_mod_bit_sizes=[40, 21, 40]  # Simplified from [60, 40, 40, 60]
+        poly_modulus_degree=ckks_parameters["poly_modulus_degree"],
+        coeff_mod_bit_sizes=ckks_parameters["coeff_mod_bit_sizes"],
+        n_threads=TENSEAL_THREADS
     )
-    context.generate_galois_keys()
-    context.global_scale = 2**21  # Reduced from 2**40
+    if EVALUATION_GALOIS_KEYS:
+        context.generate_galois_keys()
+    context.global_scale = 2 ** ckks_parameters["global_scale_bits"]
     return context
 
-ckks_context = create_ckks_context()
-ckks_context_serialized = ckks_context.serialize().decode("ISO-8859-1")
+def serialize_ckks_secret_context(context):
+    return context.serialize(save_secret_key=True)
+
+key_store = KeyStore(KEY_STORE_DIR, "ckks", ".bin", create_ckks_context, serialize_ckks_secret_context, ts.context_from)
+key_store.load()
+
+# Results arrive as one base64 ciphertext per evaluated circle, so the request limit follows from the ciphertext size
+# under the retained parameters times the most circles the Geofencing service evaluates at once (its catalog, after
+# polygons expand to circles), the same CKKS_MAX_RESULTS both services are deployed with
+CKKS_MAX_RESULTS = int(os.environ.get("CKKS_MAX_RESULTS", "1024"))
+REQUEST_OVERHEAD = 1024 * 1024  # Thresholds, groups and the other decision parameters
+
+def result_ciphertext_bytes(context):
+    # A fresh ciphertext sits on the top level, evaluated (and mod switched) results are never larger
+    return len(base64.b64encode(ts.ckks_vector(context, [0.0]).serialize()))
+
+app.config['MAX_CONTENT_LENGTH'] = CKKS_MAX_RESULTS * max(result_ciphertext_bytes(context) for _, context in key_store.retained()) + REQUEST_OVERHEAD
+print(f"Accepting results of up to {CKKS_MAX_RESULTS} circles, requests of up to {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB")
+
+def error_bound(context):
+    # The tuner's measured error applies to keys generated with the configured parameters, keys generated before
+    # a change of parameters have no known bound
+    degree = context.seal_context().data.key_context_data().parms().poly_modulus_degree()
+    if degree == ckks_parameters["poly_modulus_degree"] and context.global_scale == 2 ** ckks_parameters["global_scale_bits"]:
+        return ckks_parameters["max_error"]
+    return None
+
+def imprecise_response(bound, smallest_threshold):
+    # Decisions on thresholds within the decryption error would be noise, so none are made
+    return jsonify({
+        "status": "error",
+        "message": f"CKKS error bound {'unknown' if bound is None else f'{bound:.3g}'} is not below the threshold {smallest_threshold:.3g}, "
+                   "rotate to a key generated with parameters tuned for this radius (ckks_tuner.py)"
+    }), 422
+
+active_bound = error_bound(key_store.active()[1])
+if active_bound is None or active_bound >= DEFAULT_THRESHOLD:
+    print(f"Error: the active CKKS key cannot classify the default {GEOFENCE_RADIUS} m radius (error bound {active_bound}), "
+          "results will be refused until the key is rotated")
+
+# Public contexts per role, the secret key never leaves the key authority:
+# clients only need the public key to encrypt, the Geofencing service only needs the evaluation keys
+CONTEXT_ROLES = {
+    "client": {"save_public_key": True, "save_galois_keys": False, "save_relin_keys": False},
+    "evaluation": {"save_public_key": False, "save_galois_keys": EVALUATION_GALOIS_KEYS, "save_relin_keys": EVALUATION_RELIN_KEYS},
+}
+role_context_cache = {}  # (context_id, role) -> base64 serialized context
+
+def get_role_context(context_id, context, role):
+    if (context_id, role) not in role_context_cache:
+        serialized = context.serialize(save_secret_key=False, **CONTEXT_ROLES[role])
+        role_context_cache[(context_id, role)] = base64.b64encode(serialized).decode("utf-8")
+    return role_context_cache[(context_id, role)]
 
 @app.route("/get-ckks-context", methods=["GET"])
 def get_ckks_context():
-    import base64
-    return jsonify({"ckks_context": base64.b64encode(ckks_context.serialize()).decode("utf-8")})
+    role = request.args.get("role", "client")
+    if role not in CONTEXT_ROLES:
+        return jsonify({"status": "error", "message": f"Unknown role '{role}', expected one of: {', '.join(CONTEXT_ROLES)}"}), 400
+    context_id, context = key_store.active()
+    return jsonify({
+        "ckks_context": get_role_context(context_id, context, role),
+        "context_id": context_id,
+        "role": role
+    })
 
-def deserialize_ckks_vector(serialized_vec, context):
-    return ts.ckks_vector_from(context, base64.b64decode(serialized_vec.encode("utf-8")))
-
-@app.route("/submit-geofence-result-ref-ckks", methods=["POST"])
-def submit_geofence_result_ref_ckks():
-    data = request.get_json()
-    if not data or "ckks_context" not in data or "intermediate_values" not in data:
-        return jsonify({"status": "error", "message": "Missing required fields"}), 400
+@app.route("/get-ckks-context-ids", methods=["GET"])
+def get_ckks_context_ids():
+    # The contexts still accepted for decryption, active first, so the Geofencing service drops results of retired ones
+    return jsonify({"context_id": key_store.active()[0], "retained": [context_id for context_id, _ in key_store.retained()]})
 
+@app.route("/rotate-key", methods=["POST"])
+def rotate_key():
+    if not admin_authorized():
+        return jsonify({"status": "error", "message": "Invalid admin token"}), 403
     try:
-        # Use the startup context with secret key for decryption
-        context = ckks_context
-        results = []
-        for enc_val in data["intermediate_values"]:
-            vec = deserialize_ckks_vector(enc_val, context)
-            decrypted = vec.decrypt()[0]
-            status = "inside" if decrypted < 0.5 else "outside"
-            results.append({"value": decrypted, "status": status})
-        return jsonify({"status": "success", "results": results}), 200
-    except Exception as e:
-        print("Error in /submit-geofence-result-ref-ckks:", e)
-        print(traceback.format_exc())
-        return jsonify({"status": "error", "message": str(e)}), 500
+        context_id = key_store.rotate()
+    except KeyRotationUnavailable as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    return jsonify({"status": "success", "context_id": context_id}), 200
+
+decryption_pools = {}  # context_id -> ContextPool of secret contexts
+decryption_pool_lock = threading.Lock()
+
+def get_decryption_pool(context_id):
+    # Contexts inside the retention window still decrypt requests that were in flight during a rotation
+    if context_id is None:
+        context_id, context = key_store.active()
+    else:
+        context_id, context = key_store.find(lambda key_id, context: key_id == context_id)
+    if context is None:
+        return None
+    with decryption_pool_lock:
+        if context_id not in decryption_pools:
+            decryption_pools[context_id] = ContextPool(serialize_ckks_secret_context(context), CONTEXT_POOL_SIZE, TENSEAL_THREADS)
+        return decryption_pools[context_id]
+
+def get_engine(context):
+    # The shared CKKS engine (ckks_engine.py) on a secret context from the decryption pool
+    return CKKSEngine(context, checkpoint_chunk=DEADLINE_CHECK_CHUNK)
+
+def decrypt_classify_results(intermediate_values, context, thresholds, deadline):
+    engine = get_engine(context)
+    checkpoint = lambda stage: check_deadline(deadline, stage)
+    return engine.decrypt_classify_batch(engine.deserialize_batch(intermediate_values, checkpoint), thresholds, checkpoint)
+
+def get_context_pools():
+    with decryption_pool_lock:
+        return {context_id: pool.snapshot() for context_id, pool in decryption_pools.items()}
+
+backend_stats["context_pools"] = get_context_pools
 
 @app.route("/submit-geofence-result-prop-ckks", methods=["POST"])
-def submit_geofence_result_prop_ckks():
+@app.route("/submit-geofence-result-ref-ckks", methods=["POST"])
+@deadline_bounded
+@admission_controlled
+def submit_geofence_result_ckks():
     data = request.get_json()
-    if not data or "ckks_context" not in data or "intermediate_values" not in data:
+    if not data or "intermediate_values" not in data:
         return jsonify({"status": "error", "message": "Missing required fields"}), 400
+    try:
+        response_format, thresholds, ring_thresholds, groups, max_speed = decision_parameters(data, lambda data: len(data["intermediate_values"]))
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
     try:
-        # Use the startup context with secret key for decryption (more efficient)
-        context = ckks_context
-        results = []
-        for enc_val in data["intermediate_values"]:
-            vec = deserialize_ckks_vector(enc_val, context)
-            decrypted = vec.decrypt()[0]
-            status = "inside" if decrypted < 0.5 else "outside"
-            results.append({"value": decrypted, "status": status})
-        return jsonify({"status": "success", "results": results}), 200
+        # Use the key store context with secret key for decryption
+        pool = get_decryption_pool(data.get("context_id"))
+        if pool is None:
+            return jsonify({"status": "error", "message": "Unknown or retired context_id"}), 400
+        with pool.context() as context:
+            bound = error_bound(context)
+        smallest_threshold = min((array.min() for array in (thresholds, ring_thresholds) if array is not None and array.size), default=None)
+        if smallest_threshold is not None and (bound is None or smallest_threshold <= bound):
+            return imprecise_response(bound, smallest_threshold)
+        if response_format == "any":
+            with pool.context() as context:
+                engine = get_engine(context)
+                outcome = decrypt_until_inside(data["intermediate_values"], lambda chunk, chunk_thresholds: engine.decrypt_classify_batch(engine.deserialize_batch(chunk), chunk_thresholds),
+                                               thresholds, g.deadline)
+            return any_match_response(len(data["intermediate_values"]), outcome, thresholds, max_speed)
+        with pool.context() as context:
+            values, inside = decrypt_classify_results(data["intermediate_values"], context, thresholds, g.deadline)
+        return decision_response(values, inside, thresholds, ring_thresholds, groups, response_format, max_speed, with_values=True)
+    except DeadlineExceeded:
+        raise
     except Exception as e:
-        print("Error in /submit-geofence-result-prop-ckks:", e)
+        print(f"Error in {request.path}:", e)
         print(traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(debug=True, host="0.0.0.0", port=5002)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=int(os.environ.get("PORT", "5002")))
\ No newline at end of file
@@ -0,0 +1,122 @@
+import base64
+import json
+import math
+import pytest
+import tenseal as ts
+from src.app import app, DEFAULT_CKKS_PARAMETERS, load_ckks_parameters
+from ckks_engine import CKKSEngine
+from geofence_engine import location_terms
+
+EARTH_RADIUS = 6371000  # Meters
+
+# Pytest fixture to set up the test client for Flask app
+@pytest.fixture
+def client():
+    with app.test_client() as client:
+        yield client
+
+def fetch_context(client, role):
+    response = client.get(f"/get-ckks-context?role={role}")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["role"] == role
+    return data, ts.context_from(base64.b64decode(data["ckks_context"].encode("utf-8")))
+
+# The client context can encrypt but never carries the secret key
+def test_client_context_is_public_only(client):
+    data, context = fetch_context(client, "client")
+    assert context.has_public_key()
+    assert not context.has_secret_key()
+    assert ts.ckks_vector(context, [0.5]).serialize()
+
+# The evaluation context is a fraction of the client context and cannot encrypt
+def test_evaluation_context_is_slim(client):
+    client_data, _ = fetch_context(client, "client")
+    data, context = fetch_context(client, "evaluation")
+    assert data["context_id"] == client_data["context_id"]
+    assert len(data["ckks_context"]) < len(client_data["ckks_context"]) // 100
+    assert not context.has_public_key()
+    assert not context.has_secret_key()
+    with pytest.raises(Exception):
+        ts.ckks_vector(context, [0.5])
+
+# Results computed under a client context decrypt with the matching context_id
+def test_submit_with_context_id(client):
+    data, context = fetch_context(client, "client")
+    encrypted = base64.b64encode(ts.ckks_vector(context, [0.1]).serialize()).decode("utf-8")
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": data["context_id"], "intermediate_values": [encrypted], "thresholds": [0.5]})
+    assert response.status_code == 200
+    assert response.get_json()["results"][0]["status"] == "inside"
+
+    # Without per-geofence thresholds the default 100 m radius applies
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": data["context_id"], "intermediate_values": [encrypted]})
+    assert response.get_json()["results"][0]["status"] == "outside"
+
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": "unknown", "intermediate_values": [encrypted]})
+    assert response.status_code == 400
+
+# The retained context ids start with the active one the clients receive
+def test_context_ids_list_active_first(client):
+    data, _ = fetch_context(client, "client")
+    context_ids = client.get("/get-ckks-context-ids").get_json()
+    assert context_ids["context_id"] == data["context_id"]
+    assert context_ids["retained"][0] == data["context_id"]
+
+def test_unknown_role(client):
+    response = client.get("/get-ckks-context?role=secret")
+    assert response.status_code == 400
+
+# Profiles written by ckks_tuner.py select the parameters, without one the defaults apply
+def test_load_ckks_parameters(tmp_path):
+    assert load_ckks_parameters(None) == DEFAULT_CKKS_PARAMETERS
+    profile = tmp_path / "ckks_profile.json"
+    selected = {"poly_modulus_degree": 8192, "coeff_mod_bit_sizes": [60, 50, 60], "global_scale_bits": 50, "total_ms": 30.0, "max_error": 1.6e-11}
+    profile.write_text(json.dumps({"selected": selected, "pareto": [selected]}))
+    assert load_ckks_parameters(str(profile)) == {"poly_modulus_degree": 8192, "coeff_mod_bit_sizes": [60, 50, 60], "global_scale_bits": 50, "max_error": 1.6e-11}
+
+# Terms encrypted under the client context, evaluated by the engine under the evaluation context, decide at the key authority
+def test_engine_round_trip(client):
+    client_data, client_context = fetch_context(client, "client")
+    _, evaluation_context = fetch_context(client, "evaluation")
+    user_terms = CKKSEngine(client_context).serialize_terms(CKKSEngine(client_context).encrypt_terms(0.9, -0.17))
+    evaluation_engine = CKKSEngine(evaluation_context)
+    batch, = evaluation_engine.evaluate_many([evaluation_engine.deserialize_terms(user_terms)], [location_terms(0.9, -0.17), location_terms(-0.6, 2.6)])
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": client_data["context_id"], "intermediate_values": evaluation_engine.serialize_batch(batch),
+                                                                       "thresholds": [0.5, 0.5], "response_format": "indices"})
+    assert response.status_code == 200
+    assert response.get_json()["inside"] == [0]
+
+def evaluate_at_distance(client, distance, center=(0.9, -0.17)):
+    # A user the given number of meters north of the fence center, evaluated like the Geofencing service does
+    client_data, client_context = fetch_context(client, "client")
+    _, evaluation_context = fetch_context(client, "evaluation")
+    lat, lon = center[0] + distance / EARTH_RADIUS, center[1]
+    user_terms = CKKSEngine(client_context).serialize_terms(CKKSEngine(client_context).encrypt_terms(lat, lon))
+    evaluation_engine = CKKSEngine(evaluation_context)
+    batch, = evaluation_engine.evaluate_many([evaluation_engine.deserialize_terms(user_terms)], [location_terms(*center)])
+    return client_data["context_id"], evaluation_engine.serialize_batch(batch)
+
+# The default parameters are precise enough for the default 100 m radius: 1 km away is outside, 50 m away inside
+def test_default_parameters_classify_100m_radius(client):
+    for distance, status in ((1000, "outside"), (50, "inside")):
+        context_id, intermediate_values = evaluate_at_distance(client, distance)
+        response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": context_id, "intermediate_values": intermediate_values})
+        assert response.status_code == 200
+        assert response.get_json()["results"][0]["status"] == status
+
+# Thresholds within the decryption error are refused instead of classified
+def test_threshold_below_error_bound_is_refused(client):
+    context_id, intermediate_values = evaluate_at_distance(client, 1000)
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": context_id, "intermediate_values": intermediate_values,
+                                                                       "thresholds": [1 - math.cos(0.01 / EARTH_RADIUS)]})
+    assert response.status_code == 422
+    assert "error bound" in response.get_json()["message"]
+
+# Results of a few polygons (a 1 km polygon alone expands to 76 circles) fit the request limit of the default parameters
+def test_request_limit_fits_polygon_results(client):
+    data, context = fetch_context(client, "client")
+    encrypted = base64.b64encode(ts.ckks_vector(context, [0.1]).serialize()).decode("utf-8")
+    response = client.post("/submit-geofence-result-prop-ckks", json={"context_id": data["context_id"], "intermediate_values": [encrypted] * 200,
+                                                                       "thresholds": [0.5] * 200, "response_format": "indices"})
+    assert response.status_code == 200
+    assert len(response.get_json()["inside"]) == 200
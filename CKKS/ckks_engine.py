@@ -0,0 +1,134 @@
+import base64
+import os
+import sys
+import threading
+from contextlib import contextmanager
+import tenseal as ts
+
+# The modules shared by every backend live in the repository's shared directory, the Docker images copy them beside this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from geofence_engine import SCHEMES
+
+# Backend engine for both schemes under CKKS, with the interface of shared/geofence_engine.py. Results are
+# CKKS vectors rather than integer ciphertexts, so it does not build on AdditiveEngine.
+
+def serialize_ckks_vector(vec):
+    return base64.b64encode(vec.serialize()).decode("utf-8")
+
+class VectorBatch:
+    __slots__ = ("vectors", "evaluated_bytes")
+
+    def __init__(self, vectors, evaluated_bytes=0):
+        self.vectors = vectors
+        self.evaluated_bytes = evaluated_bytes  # Serialized size of the results before any level was dropped
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def __getitem__(self, window):
+        return VectorBatch(self.vectors[window])
+
+class CKKSEngine:
+    name = "ckks"
+
+    def __init__(self, context, level_drops=0, checkpoint_chunk=50):
+        self.context = context
+        # Results only need the last modulus level for decryption, the levels above it are dropped before transfer
+        self.level_drops = level_drops
+        self.checkpoint_chunk = checkpoint_chunk
+
+    def encrypt_terms(self, lat, lon, scheme="prop"):
+        return [ts.ckks_vector(self.context, [value]) for value in SCHEMES[scheme][1](lat, lon)]
+
+    def term_fields(self, scheme="prop"):
+        return [f"{name}_enc" for name in SCHEMES[scheme][0]]
+
+    def serialize_terms(self, terms, scheme="prop"):
+        return dict(zip(self.term_fields(scheme), (serialize_ckks_vector(term) for term in terms)))
+
+    def deserialize_terms(self, user_terms, scheme="prop"):
+        fields = self.term_fields(scheme)
+        missing_keys = [key for key in fields if key not in user_terms]
+        if missing_keys:
+            raise ValueError(f"Missing required keys in 'user_encrypted_location': {', '.join(missing_keys)}")
+        return [ts.ckks_vector_from(self.context, base64.b64decode(user_terms[key].encode("utf-8"))) for key in fields]
+
+    def switch_to_last_level(self, vec):
+        # TenSEAL has no mod switch on vectors, multiplying by one rescales away a modulus per step
+        for _ in range(self.level_drops):
+            vec = vec * 1.0
+        return vec
+
+    def evaluate_many(self, users, fences, checkpoint=None, scheme="prop"):
+        # prop subtracts the centre terms from 1, ref adds up the precomputed B terms, one plaintext multiplication deep
+        constant, sign = (1, -1) if scheme == "prop" else (0, 1)
+        batches = []
+        for terms in users:
+            results = []
+            evaluated_bytes = 0
+            for idx, fence in enumerate(fences):
+                if checkpoint and idx % self.checkpoint_chunk == 0:
+                    checkpoint("evaluation")
+                val = terms[0] * (sign * fence[0])
+                for term, coefficient in zip(terms[1:], fence[1:]):
+                    val += term * (sign * coefficient)
+                if constant:
+                    val += constant
+                if self.level_drops and idx == 0:
+                    # Sampled once per user, every result has the same size at a given level
+                    evaluated_bytes = len(serialize_ckks_vector(val)) * len(fences)
+                results.append(self.switch_to_last_level(val))
+            batches.append(VectorBatch(results, evaluated_bytes))
+        return batches
+
+    def serialize_batch(self, batch):
+        return [serialize_ckks_vector(vec) for vec in batch.vectors]
+
+    def deserialize_batch(self, serialized, checkpoint=None):
+        vectors = []
+        for idx, enc_val in enumerate(serialized):
+            if checkpoint and idx % self.checkpoint_chunk == 0:
+                checkpoint("deserialization")
+            vectors.append(ts.ckks_vector_from(self.context, base64.b64decode(enc_val.encode("utf-8"))))
+        return VectorBatch(vectors)
+
+    def decrypt_batch(self, batch, checkpoint=None):
+        values = []
+        for idx, vec in enumerate(batch.vectors):
+            if checkpoint and idx % self.checkpoint_chunk == 0:
+                checkpoint("decryption")
+            values.append(vec.decrypt()[0])
+        return values
+
+    def decrypt_classify_batch(self, batch, thresholds, checkpoint=None):
+        # Inside when 1 - cos(d/R) lies within the geofence's threshold 1 - cos(r/R)
+        values = self.decrypt_batch(batch, checkpoint)
+        return values, [value <= threshold for value, threshold in zip(values, thresholds)]
+
+# Parsed context instances kept per worker process, so concurrent request threads never share a context object
+class ContextPool:
+    def __init__(self, serialized, size, n_threads=1):
+        self.serialized = serialized
+        self.size = size
+        self.n_threads = n_threads  # TenSEAL threads per context
+        self.idle = []
+        self.lock = threading.Lock()
+        self.stats = {"created": 0, "reused": 0}
+
+    @contextmanager
+    def context(self):
+        with self.lock:
+            context = self.idle.pop() if self.idle else None
+            self.stats["reused" if context is not None else "created"] += 1
+        if context is None:
+            context = ts.context_from(self.serialized, n_threads=self.n_threads)
+        try:
+            yield context
+        finally:
+            with self.lock:
+                if len(self.idle) < self.size:
+                    self.idle.append(context)
+
+    def snapshot(self):
+        with self.lock:
+            return {"idle": len(self.idle), **self.stats}
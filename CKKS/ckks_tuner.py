@@ -0,0 +1,143 @@
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+import tenseal as ts
+
+EARTH_RADIUS = 6371000  # Meters
+
+# Largest total coefficient modulus SEAL allows at 128-bit security, per polynomial degree
+MAX_COEFF_MODULUS_BITS = {4096: 109, 8192: 218, 16384: 438}
+SCALE_BITS = [21, 25, 30, 35, 40, 50, 55]
+INTEGER_BITS = 20  # Bits kept above the scale in the first and special primes
+
+# Sweep candidate CKKS parameter sets, measure cost and decision error for the geofencing computation,
+# and write the Pareto-optimal sets plus the cheapest one meeting the precision target as a key authority profile
+def candidate_parameters():
+    for poly_modulus_degree, max_bits in MAX_COEFF_MODULUS_BITS.items():
+        for scale_bits in SCALE_BITS:
+            outer_bits = min(60, scale_bits + INTEGER_BITS)
+            # One middle prime: the evaluation rescales once after the scalar products
+            coeff_mod_bit_sizes = [outer_bits, scale_bits, outer_bits]
+            if sum(coeff_mod_bit_sizes) <= max_bits:
+                yield {
+                    "poly_modulus_degree": poly_modulus_degree,
+                    "coeff_mod_bit_sizes": coeff_mod_bit_sizes,
+                    "global_scale_bits": scale_bits
+                }
+
+def boundary_samples(count, radius):
+    # User positions between half and one and a half radii from a random fence center
+    samples = []
+    for _ in range(count):
+        center_lat = math.radians(random.uniform(-60, 60))
+        center_lon = math.radians(random.uniform(-180, 180))
+        angle = radius * random.uniform(0.5, 1.5) / EARTH_RADIUS
+        bearing = random.uniform(0, 2 * math.pi)
+        lat = math.asin(math.sin(center_lat) * math.cos(angle) + math.cos(center_lat) * math.sin(angle) * math.cos(bearing))
+        lon = center_lon + math.atan2(math.sin(bearing) * math.sin(angle) * math.cos(center_lat),
+                                      math.cos(angle) - math.sin(center_lat) * math.sin(lat))
+        samples.append((lat, lon, center_lat, center_lon, angle))
+    return samples
+
+def benchmark(parameters, samples, radius):
+    context = ts.context(ts.SCHEME_TYPE.CKKS, poly_modulus_degree=parameters["poly_modulus_degree"],
+                         coeff_mod_bit_sizes=parameters["coeff_mod_bit_sizes"])
+    context.global_scale = 2 ** parameters["global_scale_bits"]
+    client_context = ts.context_from(context.serialize(save_public_key=True))
+    evaluation_context = ts.context_from(context.serialize(save_public_key=False))
+    threshold = 1 - math.cos(radius / EARTH_RADIUS)
+
+    timings = {"encryption": [], "evaluation": [], "serialization": [], "decryption": []}
+    upload_bytes = result_bytes = 0
+    errors = []
+    misclassified = 0
+    for lat, lon, center_lat, center_lon, angle in samples:
+        start = time.perf_counter()
+        terms = [ts.ckks_vector(client_context, [value]).serialize() for value in
+                 (math.sin(lat), math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon))]
+        timings["encryption"].append(time.perf_counter() - start)
+        upload_bytes = sum(len(term) for term in terms)
+
+        start = time.perf_counter()
+        c1, c2, c3 = (ts.ckks_vector_from(evaluation_context, term) for term in terms)
+        val = c1 * (-math.sin(center_lat))
+        val += c2 * (-math.cos(center_lat) * math.cos(center_lon))
+        val += c3 * (-math.cos(center_lat) * math.sin(center_lon))
+        val += 1
+        for _ in range(max(evaluation_context.seal_context().data.first_context_data().chain_index() - 1, 0)):
+            val = val * 1.0
+        timings["evaluation"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        result = val.serialize()
+        timings["serialization"].append(time.perf_counter() - start)
+        result_bytes = len(result)
+
+        start = time.perf_counter()
+        decrypted = ts.ckks_vector_from(context, result).decrypt()[0]
+        timings["decryption"].append(time.perf_counter() - start)
+
+        errors.append(abs(decrypted - (1 - math.cos(angle))))
+        misclassified += (decrypted < threshold) != (angle * EARTH_RADIUS < radius)
+
+    stage_ms = {stage: round(statistics.median(values) * 1000, 3) for stage, values in timings.items()}
+    return {
+        **parameters,
+        "stage_ms": stage_ms,
+        "total_ms": round(sum(stage_ms.values()), 3),
+        "upload_bytes": upload_bytes,
+        "result_bytes": result_bytes,
+        "max_error": max(errors),
+        "misclassification_rate": misclassified / len(samples)
+    }
+
+def pareto_front(results):
+    # A set is dominated when another is no slower, no larger and no less precise, and better in one of them
+    def costs(result):
+        return (result["total_ms"], result["upload_bytes"] + result["result_bytes"], result["max_error"])
+    front = []
+    for result in results:
+        dominated = any(all(a <= b for a, b in zip(costs(other), costs(result))) and costs(other) != costs(result)
+                        for other in results)
+        if not dominated:
+            front.append(result)
+    return sorted(front, key=lambda result: result["total_ms"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Pick the cheapest CKKS parameters meeting a precision target")
+    parser.add_argument("--radius", type=float, default=100, help="geofence radius in meters")
+    parser.add_argument("--max-error", type=float, help="largest acceptable absolute error of the decrypted value "
+                        "(default: a tenth of the decision threshold for the radius)")
+    parser.add_argument("--samples", type=int, default=50, help="user positions measured per parameter set")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the sampled positions")
+    parser.add_argument("--output", default="ckks_profile.json", help="profile file for the key authority")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    max_error = args.max_error if args.max_error is not None else (1 - math.cos(args.radius / EARTH_RADIUS)) / 10
+    samples = boundary_samples(args.samples, args.radius)
+    results = []
+    for parameters in candidate_parameters():
+        result = benchmark(parameters, samples, args.radius)
+        results.append(result)
+        print(f"N={result['poly_modulus_degree']} bits={result['coeff_mod_bit_sizes']} scale=2^{result['global_scale_bits']}: "
+              f"{result['total_ms']} ms, {result['upload_bytes'] + result['result_bytes']} B, "
+              f"max error {result['max_error']:.3g}, misclassified {result['misclassification_rate']:.1%}")
+
+    front = pareto_front(results)
+    meeting_target = [result for result in front if result["max_error"] <= max_error]
+    if meeting_target:
+        selected = meeting_target[0]
+    else:
+        selected = min(front, key=lambda result: result["max_error"])
+        print(f"No parameter set reaches a max error of {max_error:.3g}, selecting the most precise one")
+    with open(args.output, "w") as f:
+        json.dump({"radius": args.radius, "max_error": max_error, "selected": selected, "pareto": front}, f, indent=2)
+    print(f"Selected N={selected['poly_modulus_degree']} bits={selected['coeff_mod_bit_sizes']} "
+          f"scale=2^{selected['global_scale_bits']}, profile written to {args.output}")
+
+if __name__ == "__main__":
+    main()
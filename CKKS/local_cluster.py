@@ -0,0 +1,69 @@
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_DIR = os.path.join(BASE_DIR, "..", "shared")
+
+# Start key authority replicas sharing one key store, plus a geofencing service balancing across them
+# (optionally a coordinator in front of geofencing shards that each hold a slice of the catalog)
+def start_service(service_dir, port, extra_env):
+    # The services import the backend engine from this directory and the modules every backend shares from SHARED_DIR
+    env = dict(os.environ, PORT=str(port), FLASK_DEBUG="0", PYTHONPATH=os.pathsep.join([BASE_DIR, SHARED_DIR]), **extra_env)
+    return subprocess.Popen([sys.executable, "app.py"], cwd=os.path.join(BASE_DIR, service_dir, "src"), env=env)
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the CKKS services as local processes")
+    parser.add_argument("--replicas", type=int, default=3, help="number of key authority replicas")
+    parser.add_argument("--key-authority-port", type=int, default=5002, help="port of the first replica")
+    parser.add_argument("--geofencing-port", type=int, default=5001, help="port of the geofencing service or coordinator")
+    parser.add_argument("--shards", type=int, default=0, help="number of geofencing shards behind a coordinator")
+    parser.add_argument("--shard-port", type=int, default=5101, help="port of the first geofencing shard")
+    args = parser.parse_args()
+
+    # Key rotation and catalog reloads need the admin token, printed below for the operator
+    os.environ.setdefault("ADMIN_TOKEN", secrets.token_hex(16))
+    key_store_dir = tempfile.mkdtemp(prefix="keyauthority-")
+    processes = []
+    key_authority_urls = []
+    try:
+        # The first replica creates the first key, the others load it
+        for i in range(args.replicas):
+            port = args.key_authority_port + i
+            processes.append(start_service("KeyAuthority-Microservice", port, {"KEY_STORE_DIR": key_store_dir}))
+            key_authority_urls.append(f"http://localhost:{port}")
+            if i == 0:
+                while not os.path.exists(os.path.join(key_store_dir, "active")) and processes[0].poll() is None:
+                    time.sleep(0.2)
+        shard_urls = []
+        for i in range(args.shards):
+            port = args.shard_port + i
+            processes.append(start_service("Geofencing-microservice", port, {
+                "KEY_AUTHORITY_URLS": ",".join(key_authority_urls),
+                "GEOFENCE_SHARD_INDEX": str(i),
+                "GEOFENCE_SHARD_COUNT": str(args.shards)
+            }))
+            shard_urls.append(f"http://localhost:{port}")
+        processes.append(start_service("Geofencing-microservice", args.geofencing_port, {
+            "KEY_AUTHORITY_URLS": ",".join(key_authority_urls),
+            "GEOFENCE_SHARD_URLS": ",".join(shard_urls)
+        }))
+        print(f"Key authority replicas: {', '.join(key_authority_urls)}")
+        if shard_urls:
+            print(f"Geofencing shards: {', '.join(shard_urls)}")
+        print(f"Geofencing service: http://localhost:{args.geofencing_port}")
+        print(f"Admin token (X-Admin-Token): {os.environ['ADMIN_TOKEN']}")
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import argparse
+import base64
+import itertools
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+import tenseal as ts
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Sweep gunicorn worker/thread counts and TenSEAL threads for both CKKS services, and report the
+# configuration with the most requests per second per core as docker-compose environment values
+def start_service(service_dir, port, workers, threads, extra_env):
+    env = dict(os.environ, CONTEXT_POOL_SIZE=str(threads), PYTHONPATH=BASE_DIR, **extra_env)
+    return subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-w", str(workers), "-k", "gthread", "--threads", str(threads),
+         "--preload", "-b", f"127.0.0.1:{port}", "app:app"],
+        cwd=os.path.join(BASE_DIR, service_dir, "src"), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def wait_until_ready(url, timeout=120):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"{url} did not become ready")
+
+def encrypted_payload(key_authority_url):
+    data = requests.get(f"{key_authority_url}/get-ckks-context", params={"role": "client"}, timeout=15).json()
+    context = ts.context_from(base64.b64decode(data["ckks_context"].encode("utf-8")))
+    lat, lon = math.radians(51.573037), math.radians(-9.724087)
+    terms = [math.sin(lat), math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon)]
+    serialized = [base64.b64encode(ts.ckks_vector(context, [term]).serialize()).decode("utf-8") for term in terms]
+    return {"user_encrypted_location": dict(zip(("c1_enc", "c2_enc", "c3_enc"), serialized)), "context_id": data["context_id"]}
+
+def measure(geofencing_url, payload, requests_count, concurrency):
+    def send(_):
+        try:
+            return requests.post(f"{geofencing_url}/submit-mobile-node-location-ckks", json=payload, timeout=60).status_code == 200
+        except requests.exceptions.RequestException:
+            return False
+    start = time.time()
+    with ThreadPoolExecutor(concurrency) as executor:
+        successes = sum(executor.map(send, range(requests_count)))
+    return successes / (time.time() - start), successes
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the worker and thread counts with the best CKKS throughput per core")
+    parser.add_argument("--workers", default="1,2,4", help="gunicorn worker counts to try")
+    parser.add_argument("--threads", default="2,4,10", help="gunicorn threads per worker to try")
+    parser.add_argument("--tenseal-threads", default="1,2", help="TenSEAL threads per context to try")
+    parser.add_argument("--requests", type=int, default=100, help="requests sent per configuration")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent client connections")
+    parser.add_argument("--key-authority-port", type=int, default=5202)
+    parser.add_argument("--geofencing-port", type=int, default=5201)
+    args = parser.parse_args()
+
+    cores = os.cpu_count()
+    key_authority_url = f"http://127.0.0.1:{args.key_authority_port}"
+    geofencing_url = f"http://127.0.0.1:{args.geofencing_port}"
+    key_store_dir = tempfile.mkdtemp(prefix="keyauthority-")
+    results = []
+    for workers, threads, tenseal_threads in itertools.product(
+            [int(v) for v in args.workers.split(",")], [int(v) for v in args.threads.split(",")],
+            [int(v) for v in args.tenseal_threads.split(",")]):
+        # Admission control is opened up to the thread count so it does not cap the measurement
+        env = {"TENSEAL_THREADS": str(tenseal_threads), "MAX_CONCURRENT_REQUESTS": str(threads),
+               "MAX_QUEUED_REQUESTS": str(args.concurrency), "KEY_STORE_DIR": key_store_dir}
+        processes = [start_service("KeyAuthority-Microservice", args.key_authority_port, workers, threads, env)]
+        try:
+            wait_until_ready(f"{key_authority_url}/service-stats")
+            processes.append(start_service("Geofencing-microservice", args.geofencing_port, workers, threads,
+                                           dict(env, KEY_AUTHORITY_URLS=key_authority_url)))
+            wait_until_ready(f"{geofencing_url}/service-stats")
+            payload = encrypted_payload(key_authority_url)
+            measure(geofencing_url, payload, args.concurrency, args.concurrency)  # Warm up the context pools
+            throughput, successes = measure(geofencing_url, payload, args.requests, args.concurrency)
+        finally:
+            for process in processes:
+                process.terminate()
+                process.wait()
+        results.append((throughput / cores, workers, threads, tenseal_threads))
+        print(f"workers={workers} threads={threads} tenseal_threads={tenseal_threads}: "
+              f"{throughput:.2f} req/s, {throughput / cores:.2f} req/s per core ({successes}/{args.requests} ok)")
+
+    best, workers, threads, tenseal_threads = max(results)
+    print(f"\nBest on {cores} cores ({best:.2f} req/s per core), set in the environment for docker compose:")
+    print(f"GUNICORN_WORKERS={workers}\nGUNICORN_THREADS={threads}\nTENSEAL_THREADS={tenseal_threads}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import requests
+import os
+import sys
+from ou_engine import OUEngine, OkamotoUchiyamaPublicKey
+from geofencing_service import app, key_authority_pool, keyed_engine, serve_keyed_locations, start_catalog
+
+# The Okamoto-Uchiyama backend of the shared Geofencing service (shared/geofencing_service.py)
+
+def get_key_authority_public_key(timeout=None):
+    try:
+        response = key_authority_pool.request("GET", "get-public-key", timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+        return OkamotoUchiyamaPublicKey(data['public_key_n'], data['g'], data['h'])
+    except (requests.exceptions.RequestException, KeyError) as e:
+        print(f"Failed to fetch public key: {e}")
+        return None
+
+def get_engine(public_key):
+    # The shared Okamoto-Uchiyama engine (ou_engine.py), re-randomizing with factors from this worker's pool
+    return keyed_engine(OUEngine, public_key)
+
+# Scheme and key authority endpoint of each location route, both schemes yield 1 - cos(d/R) against the same thresholds
+LOCATION_ROUTES = {
+    "/submit-mobile-node-location-prop": ("prop", "submit-geofence-result-prop"),
+    "/submit-mobile-node-location-ref": ("ref", "submit-geofence-result-ref")
+}
+
+serve_keyed_locations(sys.modules[__name__], LOCATION_ROUTES)
+start_catalog()
+
+if __name__ == '__main__':
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=int(os.environ.get("PORT", "5001")))
\ No newline at end of file
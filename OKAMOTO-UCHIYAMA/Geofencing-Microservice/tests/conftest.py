@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The backend engine and the shared service modules live next to the services, the Docker image copies them beside app.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "shared")))
@@ -0,0 +1,104 @@
+import pytest
+import json
+import math
+import time
+from unittest.mock import patch
+import src.app
+import geofencing_service
+from src.app import app
+from geofencing_service import Catalog, add_catalog_entry, new_catalog_draft
+from geofence_engine import location_terms, reference_center_terms
+from ou_engine import OUEngine, OkamotoUchiyamaPrivateKey, OkamotoUchiyamaPublicKey
+
+###### NOTE: if tests fail it can be due to the overpass query timing out ########
+
+# Define a small test key: n = p^2 q with 256-bit primes, enough room for the encoded mantissas
+TEST_P = 71080316740635434847826226404155525350858665815735362628681358801008595315961
+TEST_Q = 93732037379134040320600781527924204924560506215614316719363936364011908151499
+TEST_G = 37443228951802568663009971244047973526043866789078894634781079017731180732566387227529837003791004702251767914145363467637872218803630530772436223816754245292356952234804732820249900669477268448192155640667412417338674062320650241
+TEST_N = TEST_P * TEST_P * TEST_Q
+TEST_PUBLIC_KEY = OkamotoUchiyamaPublicKey(TEST_N, TEST_G)
+TEST_ENGINE = OUEngine(TEST_PUBLIC_KEY, OkamotoUchiyamaPrivateKey(TEST_PUBLIC_KEY, TEST_P, TEST_Q))
+ENCODING_EXPONENT = -14
+
+def encrypt(value, r=12345):
+    return pow(TEST_G, round(value * 16 ** -ENCODING_EXPONENT), TEST_N) * pow(TEST_PUBLIC_KEY.h, r, TEST_N) % TEST_N
+
+def location_payload(lat, lon):
+    terms = (math.sin(lat), math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon))
+    return {
+        "user_encrypted_location": {field: value for idx, term in enumerate(terms, 1)
+                                    for field, value in ((f"c{idx}_ct", encrypt(term)), (f"c{idx}_exp", ENCODING_EXPONENT))},
+        "public_key_n": TEST_N
+    }
+
+# Pytest fixture to set up the test client for Flask app
+@pytest.fixture
+def client():
+    # Create a test client instance and yield it for use in tests
+    with app.test_client() as client:
+        yield client
+
+# Test that the evaluation mod n decrypts to the plaintext haversine intermediate value of every geofence, in both schemes
+def test_evaluate_many_prop_and_ref():
+    lat, lon = math.radians(51.5730), math.radians(-9.7235)
+    centres = [(math.radians(51.5731), math.radians(-9.7236)), (math.radians(51.6510), math.radians(-9.9106))]
+    engine = src.app.get_engine(TEST_PUBLIC_KEY)
+
+    terms = engine.deserialize_terms(location_payload(lat, lon)["user_encrypted_location"])
+    prop_batch = engine.evaluate_many([terms], [location_terms(*centre) for centre in centres])[0]
+    ref_terms = engine.encrypt_terms(lat, lon, "ref")
+    ref_batch = engine.evaluate_many([ref_terms], [reference_center_terms(*centre, 2.0) for centre in centres], scheme="ref")[0]
+    for prop_value, ref_value, (c_lat, c_lon) in zip(TEST_ENGINE.decrypt_batch(prop_batch), TEST_ENGINE.decrypt_batch(ref_batch), centres):
+        expected = 1 - math.sin(lat) * math.sin(c_lat) - math.cos(lat) * math.cos(c_lat) * math.cos(lon - c_lon)
+        assert abs(prop_value - expected) < 1e-15                              # Confirm the value survives evaluation
+        assert abs(ref_value - expected) < 1e-15                               # The reference scheme yields the same value
+
+# Test the /submit-mobile-node-location-prop API endpoint with the key authority mocked
+@patch("geofencing_service.submit_geofence_results_to_key_authority")
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY)
+def test_submit_mobile_node_location_prop_success(mock_key, mock_submit, client):
+    mock_submit.return_value = {"status": "success", "format": "first", "count": 1, "first_inside": 0, "next_query_in": 0}
+    draft = new_catalog_draft()
+    add_catalog_entry(draft, {"geometry": {"type": "Point", "coordinates": [-9.7236, 51.5731]}, "properties": {"amenity": "cafe"}})
+    data = {**location_payload(math.radians(51.5730), math.radians(-9.7235)), "response_format": "first"}
+    with patch("geofencing_service.catalog", Catalog(draft)):
+        response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["first_inside"] == 0                              # Confirm the key authority's decision is returned
+    batch = mock_submit.call_args[0][1]
+    assert all(0 < ciphertext < TEST_N for ciphertext in batch["ciphertexts"])   # Results are sent as ciphertexts mod n
+    assert mock_submit.call_args[0][2] == "submit-geofence-result-prop"         # Confirm the key authority endpoint
+
+# Test that a ciphertext encrypted under another key is rejected
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY)
+def test_submit_mobile_node_location_prop_public_key_mismatch(mock_key, client):
+    data = {**location_payload(0.9, -0.17), "public_key_n": TEST_N + 2}
+    response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Check if the response status code is Bad Request
+    assert response.get_json()["message"] == "Public key mismatch. Encryption was not done with the correct public key."
+
+# Test that missing or out of range terms are rejected
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY)
+def test_submit_mobile_node_location_prop_invalid_terms(mock_key, client):
+    data = location_payload(0.9, -0.17)
+    del data["user_encrypted_location"]["c2_exp"]
+    response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Check if the response status code is Bad Request
+    assert response.get_json()["message"] == "Missing required keys in 'user_encrypted_location': c2_exp"
+
+    data = location_payload(0.9, -0.17)
+    data["user_encrypted_location"]["c1_ct"] = TEST_N
+    response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Ciphertexts must lie below n
+
+# Test that result submissions carry the result token the key authority restricts its decryption to
+@patch("geofencing_service.result_token_headers", {"X-Result-Token": "secret"})
+@patch("geofencing_service.key_authority_pool")
+def test_submit_geofence_results_sends_result_token(mock_pool):
+    mock_pool.request.return_value.status_code = 200
+    mock_pool.request.return_value.json.return_value = {"status": "success"}
+    response = geofencing_service.submit_geofence_results_to_key_authority(TEST_N, {"ciphertexts": [1], "exponent": -28}, "submit-geofence-result-prop", time.monotonic() + 5)
+    assert response == {"status": "success"}                                     # Confirm the key authority's answer is returned
+    assert mock_pool.request.call_args.kwargs["headers"]["X-Result-Token"] == "secret"
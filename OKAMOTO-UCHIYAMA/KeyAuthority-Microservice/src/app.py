@@ -0,0 +1,59 @@
+import json
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+from ou_engine import KEY_PROFILES, OUEngine, OkamotoUchiyamaPrivateKey, OkamotoUchiyamaPublicKey, generate_keypair
+from key_authority_service import app, KEY_STORE_DIR, RESULT_TOKEN, KeyStore, load_cost_model, serve_keyed_keys, serve_keyed_results
+from service_common import DEADLINE_CHECK_CHUNK
+
+# The Okamoto-Uchiyama backend of the shared key authority (shared/key_authority_service.py)
+#
+# Okamoto-Uchiyama falls to a chosen-ciphertext attack: whoever can have E(m) for an m above p decrypted learns a
+# multiple of p and factors n. The result routes answer with decrypted values and decisions on any ciphertext below n,
+# so they are a decryption oracle and must only accept the Geofencing service's results: the service refuses to start
+# without RESULT_TOKEN, known to the Geofencing service alone, and the routes must never be exposed to clients.
+if RESULT_TOKEN is None:
+    raise RuntimeError("RESULT_TOKEN is unset, any caller could submit ciphertexts for decryption and recover the private key")
+
+# Key profiles (ou_engine.py) apply to newly generated keys, OU_KEY_SIZE overrides the profile's size.
+OU_KEY_PROFILE = os.environ.get("OU_KEY_PROFILE", "standard")
+OU_KEY_SIZE = int(os.environ.get("OU_KEY_SIZE", str(KEY_PROFILES[OU_KEY_PROFILE]["key_size"])))
+OU_COST_MODEL = os.environ.get("OU_COST_MODEL")
+
+cost_model = load_cost_model(OU_COST_MODEL)
+
+def generate_ou_keypair_parallel(n_length=OU_KEY_SIZE):
+    # p and q are searched for in separate processes, roughly halving key generation time
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        return generate_keypair(n_length, executor)
+
+def serialize_ou_keypair(keypair):
+    public_key, private_key = keypair
+    return json.dumps({"n": public_key.n, "g": public_key.g, "p": private_key.p, "q": private_key.q}).encode("utf-8")
+
+def deserialize_ou_keypair(data):
+    key_data = json.loads(data)
+    public_key = OkamotoUchiyamaPublicKey(key_data["n"], key_data["g"])
+    return public_key, OkamotoUchiyamaPrivateKey(public_key, key_data["p"], key_data["q"])
+
+key_store = KeyStore(KEY_STORE_DIR, "ou", ".json", generate_ou_keypair_parallel,
+                     serialize_ou_keypair, deserialize_ou_keypair)
+key_store.load()
+
+def public_key_fields(keypair, profile):
+    return {"g": keypair[0].g, "h": keypair[0].h}
+
+def get_engine(keypair):
+    # The shared Okamoto-Uchiyama engine (ou_engine.py) under one of the retained keys
+    return OUEngine(*keypair, checkpoint_chunk=DEADLINE_CHECK_CHUNK)
+
+# Scheme name of each result route: the Geofencing service folds the reference scheme's constants into its
+# coefficients, so both deliver 1 - cos(d/R) and are decrypted and classified alike
+RESULT_ROUTES = {"/submit-geofence-result-prop": "Proposed", "/submit-geofence-result-ref": "Reference"}
+
+# n = p^2 q with primes of a third of the key size each only lands within two bits of it
+serve_keyed_keys(sys.modules[__name__], key_size_tolerance=2)
+serve_keyed_results(sys.modules[__name__], RESULT_ROUTES)
+
+if __name__ == '__main__':
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=int(os.environ.get("PORT", "5002")))
\ No newline at end of file
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The backend engine and the shared service modules live next to the services, the Docker image copies them beside app.py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "..", "shared")))
+
+# The service refuses to start without a result token, the test client sends this one (test_api_endpoints.py)
+os.environ.setdefault("RESULT_TOKEN", "secret")
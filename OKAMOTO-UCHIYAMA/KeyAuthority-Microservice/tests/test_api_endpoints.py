@@ -0,0 +1,101 @@
+import pytest
+import importlib
+import json
+import sys
+import math
+from unittest.mock import patch
+from src.app import app, key_store, get_engine, generate_ou_keypair_parallel, serialize_ou_keypair, deserialize_ou_keypair
+from key_authority_service import RESULT_TOKEN, decrypt_encrypted_results
+from geofence_engine import CiphertextBatch
+
+ENCODING_EXPONENT = -14
+THRESHOLD = 1 - math.cos(100 / 6371000)  # 100 m radius
+public_key, private_key = key_store.active()[1]
+
+def encrypt(value, r=98765):
+    # E(m) = g^m h^r mod n for the mantissa of the value at the encoding exponent
+    return pow(public_key.g, round(value * 16 ** -ENCODING_EXPONENT), public_key.n) * pow(public_key.h, r, public_key.n) % public_key.n
+
+def batch(values):
+    return {"ciphertexts": [encrypt(value) for value in values], "exponent": ENCODING_EXPONENT}
+
+# Pytest fixture to set up the test client for Flask app
+@pytest.fixture
+def client():
+    # Create a test client instance and yield it for use in tests, sending the Geofencing service's result token
+    with app.test_client() as client:
+        client.environ_base["HTTP_X_RESULT_TOKEN"] = RESULT_TOKEN
+        yield client
+
+# Test the /get-public-key API endpoint to ensure it returns the full Okamoto-Uchiyama public key
+def test_get_public_key(client):
+    response = client.get("/get-public-key")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    data = response.get_json()
+    assert data["public_key_n"] == public_key.n                                  # Confirm the modulus n = p^2 q
+    assert data["h"] == pow(data["g"], data["public_key_n"], data["public_key_n"])  # Confirm h = g^n mod n
+    assert data["key_profile"]["name"] == "standard"                             # Confirm the default profile
+
+# Test that decryption recovers positive and negative values mod p
+def test_decrypt_encrypted_results():
+    values = [0.25, -0.5, 1.2e-10]
+    response_batch = batch(values)
+    decrypted, inside = decrypt_encrypted_results(CiphertextBatch(public_key, response_batch["ciphertexts"], ENCODING_EXPONENT),
+                                                  get_engine((public_key, private_key)), [THRESHOLD] * 3)
+    assert all(abs(a - b) < 1e-16 for a, b in zip(decrypted, values))           # Confirm every value is recovered
+    assert inside == [False, True, True]                                         # Only values below the threshold are inside
+
+# Test the /submit-geofence-result-prop API endpoint with a batch of results
+def test_submit_geofence_result_prop_batch(client):
+    data = {"encrypted_batch": batch([1e-6, 1e-11, -1e-12]), "public_key_n": public_key.n,
+            "thresholds": [THRESHOLD] * 3, "response_format": "indices"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["inside"] == [1, 2]                               # Only values below the threshold are inside
+
+    data["encrypted_batch"]["ciphertexts"][0] = public_key.n
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Ciphertexts must lie below n
+
+# Test that the reference route decrypts and classifies like the proposed one
+def test_submit_geofence_result_ref(client):
+    data = {"encrypted_batch": batch([1e-6, 1e-11]), "public_key_n": public_key.n, "thresholds": [THRESHOLD] * 2}
+    response = client.post("/submit-geofence-result-ref", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["results"] == [{"status": "outside"}, {"status": "inside"}]
+
+# Test that only the Geofencing service holding the result token can have results decrypted
+def test_submit_geofence_result_requires_result_token(client):
+    data = {"encrypted_batch": batch([1e-11]), "public_key_n": public_key.n, "thresholds": [THRESHOLD]}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json",
+                           headers={"X-Result-Token": "guessed"})
+    assert response.status_code == 403                                           # The decryption oracle is closed to other callers
+    assert response.get_json()["message"] == "Invalid result token"
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+
+# Test that the service refuses to start without a result token
+def test_app_requires_result_token():
+    with patch("key_authority_service.RESULT_TOKEN", None), pytest.raises(RuntimeError, match="RESULT_TOKEN"):
+        importlib.reload(sys.modules["src.app"])
+
+# Test that the per-result format and any-match mode follow the same contract as the other backends
+def test_submit_geofence_result_prop_legacy_any_match(client):
+    results = [{"ciphertext": encrypt(value), "exponent": ENCODING_EXPONENT} for value in (1e-6, 1e-11)]
+    data = {"encrypted_results": results, "public_key_n": public_key.n, "thresholds": [THRESHOLD] * 2, "response_format": "any"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["hit_position"] == 1                              # Confirm the first inside position
+
+# Test that results under an unknown key are rejected
+def test_submit_geofence_result_prop_public_key_mismatch(client):
+    data = {"encrypted_batch": batch([0.0]), "public_key_n": public_key.n + 2}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Check if the response status code is Bad Request
+    assert response.get_json()["message"] == "Public key mismatch. Encryption was not done with the correct public key."
+
+# Test that generated keys survive serialization and decrypt their own ciphertexts
+def test_keypair_roundtrip():
+    key_public, key_private = deserialize_ou_keypair(serialize_ou_keypair(generate_ou_keypair_parallel(768)))
+    ciphertext = pow(key_public.g, 42, key_public.n) * pow(key_public.h, 7, key_public.n) % key_public.n
+    assert key_private.raw_decrypt(ciphertext) == 42                             # Confirm the plaintext is recovered
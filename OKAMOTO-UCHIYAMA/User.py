@@ -0,0 +1,224 @@
+import base64
+import requests
+import math
+import time
+import threading
+import csv
+import sys
+from ou_engine import OUEngine, OkamotoUchiyamaPublicKey
+from metrics_logger import log_metrics, get_cpu_ram, get_ciphertext_size, compute_classification_metrics
+
+# Global variable to store the Okamoto-Uchiyama public key modulus
+public_key_n = None
+# End-to-end time budget for one request, propagated to the services as a deadline
+REQUEST_TIMEOUT = 30  # seconds
+# Decision shape requested from the services, only geofence 0 is checked so the first hit is enough
+RESPONSE_FORMAT = "first"
+# Geofence classes to check (e.g. ["amenity=cafe"] or ["depot"]), None checks the whole catalog
+GEOFENCE_TAGS = None
+# Fastest the device moves in m/s, the key authority turns it into a safe interval before the next report
+MAX_SPEED = 40
+# Seconds between periodic reports while the services give no interval hint
+DEFAULT_REPORT_INTERVAL = 10
+# Interval hint from the last response, in seconds
+next_report_in = None
+
+def get_key_authority_public_key():
+    global public_key_n
+    try:
+        response = requests.get('http://localhost:5002/get-public-key')
+        response.raise_for_status()
+        data = response.json()
+        public_key_n = data.get('public_key_n')
+        public_key = OkamotoUchiyamaPublicKey(public_key_n, data['g'], data['h'])
+        return public_key
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to fetch public key: {e}")
+        return None
+
+def compute_and_encrypt_user_location_terms(user_latitude, user_longitude, public_key):
+    # The shared engine (ou_engine.py) encrypts the terms at the exponent the Geofencing service evaluates them at
+    start = time.time()
+    terms = OUEngine(public_key).encrypt_terms(user_latitude, user_longitude)
+    end = time.time()
+    print("(Runtime Performance Experiment) Encryption Runtime:", round((end-start), 3), "s")
+    return terms
+
+def is_inside_geofence_plaintext(user_latitude, user_longitude, geofence_center_lat, geofence_center_lon, radius_m):
+    R = 6371000  # Earth radius in meters
+    dlat = user_latitude - geofence_center_lat
+    dlon = user_longitude - geofence_center_lon
+    a = math.sin(dlat/2)**2 + math.cos(user_latitude) * math.cos(geofence_center_lat) * math.sin(dlon/2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+    distance = R * c
+    return "inside" if distance < radius_m else "outside"
+
+def geofence_decision(result, idx):
+    # Reads one geofence's decision straight from the compact response shapes
+    if idx in result.get("unknown", []):
+        return "unknown"
+    if "geofence_indices" in result:
+        # Tag-filtered responses only hold the selected geofences, positioned by their catalog index
+        if idx not in result["geofence_indices"]:
+            return "unknown"
+        idx = result["geofence_indices"].index(idx)
+    response_format = result.get("format", "list")
+    if response_format == "bitmap":
+        bitmap = base64.b64decode(result["bitmap"])
+        return "inside" if bitmap[idx >> 3] & (0x80 >> (idx & 7)) else "outside"
+    if response_format == "indices":
+        return "inside" if idx in result["inside"] else "outside"
+    if response_format == "first":
+        first_inside = result["first_inside"]
+        if first_inside is not None and first_inside < idx:
+            return "unknown"
+        return "inside" if first_inside == idx else "outside"
+    if response_format == "rings":
+        ring = result["rings"][idx]
+        return "unknown" if ring is None else ("inside" if ring == 0 else "outside")
+    if response_format == "any":
+        if result["first_match"] == idx:
+            return "inside"
+        return "unknown" if result["match"] else "outside"
+    return result["results"][idx]["status"]
+
+def send_encrypted_location_to_geofencing_service(terms, request_id, plaintext_decision):
+    global next_report_in
+    next_report_in = None
+    t_start = time.time()
+    cpu_start, ram_start = get_cpu_ram()
+    encryption_start = time.time()
+    ciphertext_size = sum(get_ciphertext_size(c) for c in terms.ciphertexts)
+    encryption_end = time.time()
+    try:
+        payload = {
+            "user_encrypted_location": OUEngine(terms.public_key).serialize_terms(terms),
+            "public_key_n": public_key_n,
+            "response_format": RESPONSE_FORMAT,
+            "max_speed": MAX_SPEED
+        }
+        if GEOFENCE_TAGS is not None:
+            payload["tags"] = GEOFENCE_TAGS
+        import json
+        response = requests.post(
+            'http://localhost:5001/submit-mobile-node-location-prop',
+            json=payload,
+            headers={"X-Deadline-Ms": str(REQUEST_TIMEOUT * 1000)},
+            timeout=REQUEST_TIMEOUT
+        )
+        payload_size = len(json.dumps(payload))
+        response.raise_for_status()
+        result = response.json()
+        encrypted_decision = None
+        if result.get("status") == "success":
+            encrypted_decision = geofence_decision(result, 0)
+            next_report_in = result.get("next_query_in")
+        else:
+            encrypted_decision = "unknown"
+    except Exception as e:
+        print(f"Failed to post results to key authority: {e}")
+        encrypted_decision = "error"
+        payload_size = 0
+    decryption_start = time.time()
+    decryption_end = time.time()
+    cpu_end, ram_end = get_cpu_ram()
+    t_end = time.time()
+    log_metrics(
+        "1000_requests_results.csv",
+        [
+            "scheme", "request_id", "correct", "plaintext_decision", "encrypted_decision",
+            "encryption_time", "decryption_time", "total_time", "cpu_start", "cpu_end", "ram_start", "ram_end",
+            "ciphertext_size", "payload_size", "next_query_in"
+        ],
+        {
+            "scheme": "OU-baseline",
+            "request_id": request_id,
+            "correct": plaintext_decision == encrypted_decision,
+            "plaintext_decision": plaintext_decision,
+            "encrypted_decision": encrypted_decision,
+            "encryption_time": encryption_end - encryption_start,
+            "decryption_time": decryption_end - decryption_start,
+            "total_time": t_end - t_start,
+            "cpu_start": cpu_start,
+            "cpu_end": cpu_end,
+            "ram_start": ram_start,
+            "ram_end": ram_end,
+            "ciphertext_size": ciphertext_size,
+            "payload_size": payload_size,
+            "next_query_in": next_report_in
+        }
+    )
+    return encrypted_decision
+
+def periodic_reporting(track, public_key):
+    # Reports each position of the track at the pace the services suggest: a device far from every
+    # boundary waits until it could first reach one instead of querying at a fixed rate
+    geofence_center_lat = math.radians(51.573037)
+    geofence_center_lon = math.radians(-9.724087)
+    radius_m = 1000  # 1 km
+    for request_id, (user_latitude, user_longitude) in enumerate(track):
+        plaintext_decision = is_inside_geofence_plaintext(user_latitude, user_longitude, geofence_center_lat, geofence_center_lon, radius_m)
+        user_location_terms = compute_and_encrypt_user_location_terms(user_latitude, user_longitude, public_key)
+        send_encrypted_location_to_geofencing_service(user_location_terms, request_id, plaintext_decision)
+        interval = DEFAULT_REPORT_INTERVAL if next_report_in is None else next_report_in
+        print(f"Next report in {interval} s")
+        time.sleep(interval)
+
+def scalability_experiment(user_location_terms, num_requests):
+    geofence_center_lat = math.radians(51.573037)
+    geofence_center_lon = math.radians(-9.724087)
+    radius_m = 1000  # 1 km
+
+    user_latitude = math.radians(round(51.573037, 5))
+    user_longitude = math.radians(round(-9.724087, 5))
+    plaintext_decision = is_inside_geofence_plaintext(user_latitude, user_longitude, geofence_center_lat, geofence_center_lon, radius_m)
+
+    start_time = time.time()
+    threads = []
+    y_true = []
+    y_pred = []
+    for i in range(num_requests):
+        thread = threading.Thread(
+            target=lambda idx: y_pred.append(
+                send_encrypted_location_to_geofencing_service(
+                    user_location_terms, idx, plaintext_decision
+                )
+            ),
+            args=(i,)
+        )
+        threads.append(thread)
+        thread.start()
+        y_true.append(plaintext_decision)
+    for thread in threads:
+        thread.join()
+    end_time = time.time()
+
+    print("Ground truth:", y_true)
+    print("Predictions:", y_pred)
+
+    total_runtime = end_time - start_time
+    throughput = num_requests / total_runtime
+    latency = total_runtime / num_requests
+
+    print(f"System runtime for {num_requests} requests excluding encryption runtime: {round(total_runtime, 3)} s")
+    print(f"Throughput: {round(throughput, 3)} queries/second")
+    print(f"Latency: {round(latency, 3)} seconds/query")
+
+    acc, prec, rec, f1 = compute_classification_metrics(y_true, y_pred)
+    print(f"(OU-baseline) Accuracy: {acc:.3f}, Precision: {prec:.3f}, Recall: {rec:.3f}, F1: {f1:.3f}")
+
+    with open("1000_requests_results.csv", "a", newline="") as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["System", "Runtime (s)", "Throughput (q/s)", "Latency (s/q)", "Accuracy", "Precision", "Recall", "F1"])
+        writer.writerow(["OU-baseline", round(total_runtime, 3), round(throughput, 3), round(latency, 3), acc, prec, rec, f1])
+
+def main():
+    public_key = get_key_authority_public_key()
+    user_latitude, user_longitude = math.radians(round(51.573037, 5)), math.radians(round(-9.724087, 5))
+    user_location_terms = compute_and_encrypt_user_location_terms(user_latitude, user_longitude, public_key)
+    scalability_experiment(user_location_terms, num_requests=1000)
+
+if __name__ == "__main__":
+    for run in range(30):
+        print(f"--- Experiment Run {run+1} ---")
+        main()
\ No newline at end of file
@@ -0,0 +1,7 @@
+from ou_engine import OUEngine, generate_keypair
+from profile_benchmark import main
+
+# Measure every Okamoto-Uchiyama key profile with the shared benchmark (shared/profile_benchmark.py), so its cost model
+# compares directly with paillier_benchmark.py's
+if __name__ == "__main__":
+    main("Okamoto-Uchiyama", OUEngine, generate_keypair, "ou_cost_model.json")
@@ -0,0 +1,77 @@
+import os
+import secrets
+import sys
+
+# The modules shared by every backend live in the repository's shared directory, the Docker images copy them beside this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from geofence_engine import KEY_PROFILES, AdditiveEngine
+
+# Okamoto-Uchiyama: n = p^2 q, plaintexts live mod p and ciphertexts mod n instead of mod n^2 as in Paillier, so every
+# homomorphic operation and decryption works on numbers of half the size. E(m) = g^m h^r mod n with h = g^n mod n.
+class OkamotoUchiyamaPublicKey:
+    __slots__ = ("n", "g", "h")
+
+    def __init__(self, n, g, h=None):
+        self.n = n
+        self.g = g
+        self.h = pow(g, n, n) if h is None else h
+
+class OkamotoUchiyamaPrivateKey:
+    __slots__ = ("public_key", "p", "q", "psquare", "g_inverse")
+
+    def __init__(self, public_key, p, q):
+        self.public_key = public_key
+        self.p = p
+        self.q = q
+        self.psquare = p * p
+        # m = L(c^(p-1) mod p^2) / L(g^(p-1) mod p^2) mod p with L(x) = (x - 1) / p
+        self.g_inverse = pow(self.l_function(pow(public_key.g, p - 1, self.psquare)), -1, p)
+
+    def l_function(self, x):
+        return (x - 1) // self.p
+
+    def raw_decrypt(self, ciphertext):
+        return self.l_function(pow(ciphertext, self.p - 1, self.psquare)) * self.g_inverse % self.p
+
+def choose_generator(n, p):
+    # g^(p-1) mod p^2 must have order p, which holds unless it is 1
+    while True:
+        g = secrets.randbelow(n - 2) + 2
+        if pow(g, p - 1, p * p) != 1:
+            return g
+
+def generate_keypair(n_length, executor=None):
+    # n = p^2 q with primes of a third of the key size each, which only lands within two bits of it. An executor
+    # searches for p and q in separate processes. Only the key authority and the benchmark generate keys, so phe
+    # (for its prime search) is not a dependency of the Geofencing service.
+    from phe.util import getprimeover
+    search = executor.map if executor is not None else map
+    while True:
+        p, q = search(getprimeover, [n_length // 3] * 2)
+        if p != q and abs((p * p * q).bit_length() - n_length) <= 2:
+            public_key = OkamotoUchiyamaPublicKey(p * p * q, choose_generator(p * p * q, p))
+            return public_key, OkamotoUchiyamaPrivateKey(public_key, p, q)
+
+# Backend engine for both schemes under Okamoto-Uchiyama, with the interface and the evaluation of shared/geofence_engine.py.
+# Ciphertexts live mod n, the constant terms are encrypted as g^m mod n and results re-randomized by h^r.
+class OUEngine(AdditiveEngine):
+    name = "ou"
+    modulus_name = "n"
+
+    @staticmethod
+    def ciphertext_modulus(public_key):
+        return public_key.n
+
+    @staticmethod
+    def random_factor(public_key):
+        return pow(public_key.h, secrets.randbelow(public_key.n - 1) + 1, public_key.n)
+
+    def encrypt_exact(self, mantissa):
+        # A negative mantissa raises the inverse of g
+        return pow(self.public_key.g, mantissa, self.modulus)
+
+    def signed_plaintext(self, ciphertext):
+        # Plaintexts live mod p, the upper half encodes negative numbers
+        p = self.private_key.p
+        mantissa = self.private_key.raw_decrypt(ciphertext)
+        return mantissa - p if mantissa > p // 2 else mantissa
@@ -4,6 +4,14 @@ import time
 import random
 import matplotlib.pyplot as plt
 from tabulate import tabulate
+from fast_paillier import ShortExponentPublicKey, short_exponent_base
+from paillier_engine import KEY_PROFILES, PaillierEngine
+from geofence_engine import location_terms, reference_center_terms
+
+# Key profile as in paillier_benchmark.py: "compact" (2048 bits), "standard" (3072 bits) or "high" (4096 bits)
+KEY_PROFILE = "standard"
+# Encrypt the user terms with hs^alpha for a short alpha instead of r^n (see fast_paillier.py)
+FAST_ENCRYPTION = False
 
 
 def generate_user_points(center_latitude, center_longitude, radius, earth_radius, num_points=10):
@@ -55,87 +63,30 @@ def evaluate_geofence(user_latitude, user_longitude, center_latitude, center_lon
 
 
 def initialize_keys():
-    public_key, private_key = paillier.generate_paillier_keypair()
+    profile = KEY_PROFILES[KEY_PROFILE]
+    public_key, private_key = paillier.generate_paillier_keypair(n_length=profile["key_size"])
+    if FAST_ENCRYPTION:
+        public_key = ShortExponentPublicKey(public_key.n, short_exponent_base(public_key), 2 * profile["security_bits"])
     return public_key, private_key
 
-# Reference encrypted haversine system
-
-def ref_precompute_user_terms(user_latitude, user_longitude, public_key):
-    # Terms derived from User point (original, squared, combined, encrypted where applicable)
-    alpha = math.cos(user_latitude / 2)
-    alpha_sq = alpha**2
-    alpha_sq_enc = public_key.encrypt(alpha_sq)
-    gamma = math.sin(user_latitude / 2)
-    gamma_sq = gamma**2
-    gamma_sq_enc = public_key.encrypt(gamma_sq)
-    zeta = math.cos(user_latitude)
-    theta = math.sin(user_longitude / 2)
-    theta_sq = theta**2
-    mu = math.cos(user_longitude / 2)
-    mu_sq = mu**2
-
-    alpha_gamma_product_A = alpha * gamma            
-    alpha_gamma_product_A_enc = public_key.encrypt(alpha_gamma_product_A)       # A-specific part for term2
-
-    zeta_theta_sq_product_A  = zeta * theta_sq          
-    zeta_theta_sq_product_A_enc = public_key.encrypt(zeta_theta_sq_product_A)   # A-specific part for term4
-
-    zeta_theta_mu_product_A = zeta * theta * mu
-    zeta_theta_mu_product_A_enc = public_key.encrypt(zeta_theta_mu_product_A)   # A-specific part for term5
-
-    zeta_mu_sq_product_A = zeta * mu_sq             
-    zeta_mu_sq_product_A_enc = public_key.encrypt(zeta_mu_sq_product_A)         # A-specific part for term6
-
-    # Return all precomputed terms as a dictionary
-    return {
-        'alpha_sq_enc': alpha_sq_enc,
-        'gamma_sq_enc': gamma_sq_enc,
-        'alpha_gamma_product_A_enc': alpha_gamma_product_A_enc,
-        'zeta_theta_sq_product_A_enc': zeta_theta_sq_product_A_enc,
-        'zeta_theta_mu_product_A_enc': zeta_theta_mu_product_A_enc,
-        'zeta_mu_sq_product_A_enc': zeta_mu_sq_product_A_enc,
-    }
-
-
-def ref_calculate_intermediate_haversine_value(user_precomputed, center_latitude, center_longitude):
-    # Extract precomputed user terms
-    alpha_sq_enc = user_precomputed['alpha_sq_enc']
-    gamma_sq_enc = user_precomputed['gamma_sq_enc']
-    alpha_gamma_product_A_enc = user_precomputed['alpha_gamma_product_A_enc']
-    zeta_theta_sq_product_A_enc = user_precomputed['zeta_theta_sq_product_A_enc']
-    zeta_theta_mu_product_A_enc = user_precomputed['zeta_theta_mu_product_A_enc']
-    zeta_mu_sq_product_A_enc = user_precomputed['zeta_mu_sq_product_A_enc']
-
-    # Terms derived from Center point (original, squared, and combined where applicable)
-    beta = math.sin(center_latitude / 2)
-    beta_sq = beta**2
-    delta = math.cos(center_latitude / 2)
-    delta_sq = delta**2
-    eta = math.cos(center_latitude)
-    lambda_ = math.cos(center_longitude / 2)
-    lambda_sq = lambda_**2
-    nu = math.sin(center_longitude / 2)
-    nu_sq = nu**2
-
-    beta_delta_product_B = beta * delta             # B-specific part for term2
-    eta_lambda_sq_product_B = eta * lambda_sq       # B-specific part for term4
-    eta_lambda_nu_product_B = eta * lambda_ * nu    # B-specific part for term5
-    eta_nu_sq_product_B = eta * nu_sq               # B-specific part for term6
-    
-    # Compute haversine intermediate value
-    term1 = alpha_sq_enc * beta_sq
-    term2 = -2 * (alpha_gamma_product_A_enc * beta_delta_product_B)
-    term3 = gamma_sq_enc * delta_sq
-    term4 = zeta_theta_sq_product_A_enc * eta_lambda_sq_product_B
-    term5 = -2 * (zeta_theta_mu_product_A_enc * eta_lambda_nu_product_B)
-    term6 = zeta_mu_sq_product_A_enc * eta_nu_sq_product_B
-    haversine_intermediate = term1 + term2 + term3 + term4 + term5 + term6
+# Reference encrypted haversine system, on the same engine as the Geofencing and Key Authority services (paillier_engine.py)
+def ref_precompute_user_terms(user_latitude, user_longitude, engine):
+    # Terms derived from User point: alpha^2, alpha * gamma, gamma^2, zeta * theta^2, zeta * theta * mu, zeta * mu^2
+    return engine.encrypt_terms(user_latitude, user_longitude, "ref")
+
+
+def ref_precompute_center_terms(center_latitude, center_longitude):
+    # Terms derived from Center point, computed once per geofence with the -2 of term2 and term5 folded in
+    return reference_center_terms(center_latitude, center_longitude)
 
-    return haversine_intermediate
 
+def ref_calculate_intermediate_haversine_value(user_precomputed, center_precomputed, engine):
+    # Compute haversine intermediate value term1 + ... + term6, one scalar multiplication per term
+    return engine.evaluate_many([user_precomputed], [center_precomputed], scheme="ref")[0]
 
-def ref_evaluate_geofence_encrypted(encrypted_result, radius, earth_radius, private_key):
-    haversine_intermediate = private_key.decrypt(encrypted_result)
+
+def ref_evaluate_geofence_encrypted(encrypted_result, radius, earth_radius, engine):
+    haversine_intermediate = engine.decrypt_batch(encrypted_result)[0]
 
     central_angle = 2 * math.atan2(math.sqrt(haversine_intermediate), math.sqrt(1 - haversine_intermediate))
 
@@ -147,47 +98,38 @@ def ref_evaluate_geofence_encrypted(encrypted_result, radius, earth_radius, priv
 
 # End of Reference encrypted haversine system
 
-# Proposed encrypted haversine system
-def prop_precompute_user_terms(user_latitude, user_longitude, public_key):
+# Proposed encrypted haversine system, on the same engine as the Geofencing and Key Authority services (paillier_engine.py)
+def prop_precompute_user_terms(user_latitude, user_longitude, engine):
     # Terms derived from User point
-    c1 = public_key.encrypt(math.sin(user_latitude))
-    c2 = public_key.encrypt(math.cos(user_latitude) * math.cos(user_longitude))
-    c3 = public_key.encrypt(math.cos(user_latitude) * math.sin(user_longitude))
+    return engine.encrypt_terms(user_latitude, user_longitude)
 
-    # Return all precomputed terms as a dictionary
-    return {
-        'c1': c1,
-        'c2': c2,
-        'c3': c3,
-    }
 
+def prop_precompute_center_terms(center_latitude, center_longitude):
+    # The coefficients of the geofence are the centre's terms, computed once per geofence
+    return location_terms(center_latitude, center_longitude)
 
-def prop_calculate_intermediate_haversine_value(user_precomputed, center_latitude, center_longitude):
-    # Extract precomputed user terms
-    c1 = user_precomputed['c1']
-    c2 = user_precomputed['c2']
-    c3 = user_precomputed['c3']
 
+def prop_calculate_intermediate_haversine_value(user_precomputed, center_precomputed, engine):
     # Compute haversine intermediate value
-    a = 1 - c1 * math.sin(center_latitude) - c2 * math.cos(center_latitude) * math.cos(center_longitude) - c3 * math.cos(center_latitude) * math.sin(center_longitude)
-    return a
-
+    return engine.evaluate_many([user_precomputed], [center_precomputed])[0]
 
-def prop_evaluate_geofence_encrypted(encrypted_result, radius, earth_radius, private_key):
-    haversine_intermediate = private_key.decrypt(encrypted_result)
 
-    distance = 2 * earth_radius * math.asin(math.sqrt(haversine_intermediate / 2))
-    # print(f"Distance from geofence centre: {round(distance, 2)} meters")
+def prop_evaluate_geofence_encrypted(encrypted_result, radius, earth_radius, engine):
+    # The intermediate value is 1 - cos(d/R), so the radius becomes the threshold 1 - cos(r/R)
+    _, inside = engine.decrypt_classify_batch(encrypted_result, [1 - math.cos(radius / earth_radius)])
 
     # Return 1 if distance is within the radius, else 0
-    return 1 if distance <= radius else 0
+    return 1 if inside[0] else 0
 
 # End of Proposed encrypted haversine system
 
 
-def security_overhead_exeperiment(user_latitude, user_longitude, center_latitude, center_longitude, radius, earth_radius, public_key, private_key):
+def security_overhead_exeperiment(user_latitude, user_longitude, center_latitude, center_longitude, radius, earth_radius, engine):
     encryption_counts = [10, 50, 100]
     runtime_results = []
+    # The geofence does not move, its terms are computed once as the Geofencing service does at catalog load
+    center_precomputed_ref = ref_precompute_center_terms(center_latitude, center_longitude)
+    center_precomputed_prop = prop_precompute_center_terms(center_latitude, center_longitude)
     
     for num_encryptions in encryption_counts:
         runtimes = []
@@ -207,13 +149,13 @@ def security_overhead_exeperiment(user_latitude, user_longitude, center_latitude
 
         for i in range(num_encryptions):
             # Encrypt user terms
-            user_precomputed_ref = ref_precompute_user_terms(user_latitude, user_longitude, public_key)
+            user_precomputed_ref = ref_precompute_user_terms(user_latitude, user_longitude, engine)
 
             # Calculate haversine intermediate value
-            encrypted_result_ref = ref_calculate_intermediate_haversine_value(user_precomputed_ref, center_latitude, center_longitude)
+            encrypted_result_ref = ref_calculate_intermediate_haversine_value(user_precomputed_ref, center_precomputed_ref, engine)
 
             # Check if inside geofence
-            ref_evaluate_geofence_encrypted(encrypted_result_ref, radius, earth_radius, private_key)
+            ref_evaluate_geofence_encrypted(encrypted_result_ref, radius, earth_radius, engine)
 
         end_encrypted_system_ref = time.time()
 
@@ -223,13 +165,13 @@ def security_overhead_exeperiment(user_latitude, user_longitude, center_latitude
 
         for i in range(num_encryptions):
             # Encrypt user terms
-            user_precomputed_prop = prop_precompute_user_terms(user_latitude, user_longitude, public_key)
+            user_precomputed_prop = prop_precompute_user_terms(user_latitude, user_longitude, engine)
 
             # Calculate haversine intermediate value
-            encrypted_result_prop = prop_calculate_intermediate_haversine_value(user_precomputed_prop, center_latitude, center_longitude)
+            encrypted_result_prop = prop_calculate_intermediate_haversine_value(user_precomputed_prop, center_precomputed_prop, engine)
 
             # Check if inside geofence
-            prop_evaluate_geofence_encrypted(encrypted_result_prop, radius, earth_radius, private_key)
+            prop_evaluate_geofence_encrypted(encrypted_result_prop, radius, earth_radius, engine)
         
         end_encrypted_system_prop = time.time()
 
@@ -247,21 +189,23 @@ def security_overhead_exeperiment(user_latitude, user_longitude, center_latitude
     print(tabulate(runtime_results, headers=head, tablefmt="grid"))
 
 
-def accuracy_experiment(center_latitude, center_longitude, radius, earth_radius, user_points, public_key, private_key):
+def accuracy_experiment(center_latitude, center_longitude, radius, earth_radius, user_points, engine):
     accuracy_results = []
+    center_precomputed_ref = ref_precompute_center_terms(center_latitude, center_longitude)
+    center_precomputed_prop = prop_precompute_center_terms(center_latitude, center_longitude)
     for user_latitude, user_longitude in user_points:
         # Establish ground truth
         ground_truth = "Inside" if evaluate_geofence(user_latitude, user_longitude, center_latitude, center_longitude, radius, earth_radius) else "Outside"
 
         # Reference encrypted system
-        user_precomputed_ref = ref_precompute_user_terms(user_latitude, user_longitude, public_key)
-        encrypted_result_ref = ref_calculate_intermediate_haversine_value(user_precomputed_ref, center_latitude, center_longitude)
-        system_result_ref = "Inside" if ref_evaluate_geofence_encrypted(encrypted_result_ref, radius, earth_radius, private_key) else "Outside"
+        user_precomputed_ref = ref_precompute_user_terms(user_latitude, user_longitude, engine)
+        encrypted_result_ref = ref_calculate_intermediate_haversine_value(user_precomputed_ref, center_precomputed_ref, engine)
+        system_result_ref = "Inside" if ref_evaluate_geofence_encrypted(encrypted_result_ref, radius, earth_radius, engine) else "Outside"
 
         # Proposed encrypted system
-        user_precomputed_prop = prop_precompute_user_terms(user_latitude, user_longitude, public_key)
-        encrypted_result_prop = prop_calculate_intermediate_haversine_value(user_precomputed_prop, center_latitude, center_longitude)
-        system_result_prop = "Inside" if prop_evaluate_geofence_encrypted(encrypted_result_prop, radius, earth_radius, private_key) else "Outside"
+        user_precomputed_prop = prop_precompute_user_terms(user_latitude, user_longitude, engine)
+        encrypted_result_prop = prop_calculate_intermediate_haversine_value(user_precomputed_prop, center_precomputed_prop, engine)
+        system_result_prop = "Inside" if prop_evaluate_geofence_encrypted(encrypted_result_prop, radius, earth_radius, engine) else "Outside"
 
         # Check if both systems are correctly identifying if a point is inside/outside
         final_result_ref = "Correct" if ground_truth == system_result_ref else "Incorrect"
@@ -319,6 +263,7 @@ def plot_geofence(center_latitude, center_longitude, radius, earth_radius, point
 def main():
     # Parameters
     public_key, private_key = initialize_keys()
+    engine = PaillierEngine(public_key, private_key)
     radius = 1000           # radius in meters
     earth_radius = 6371000  # Earth's radius in meters
 
@@ -328,14 +273,14 @@ def main():
     center_latitude, center_longitude = math.radians(round(51.651051, 6)), math.radians(round(-9.910685, 6))
 
     # Quantify the additional runtime and resource overhead introduced by encryption 
-    security_overhead_exeperiment(user_latitude, user_longitude, center_latitude, center_longitude, radius, earth_radius, public_key, private_key)
+    security_overhead_exeperiment(user_latitude, user_longitude, center_latitude, center_longitude, radius, earth_radius, engine)
 
     # Generate user points inside, outside and on edge of the geofence
     points_inside, points_outside, points_edge = generate_user_points(center_latitude, center_longitude, radius, earth_radius)
     user_points = points_inside + points_outside + points_edge
 
     # Evaluate the correctness of the geofencing system in determining whether a point is inside or outside the geofence
-    accuracy_experiment(center_latitude, center_longitude, radius, earth_radius, user_points, public_key, private_key)
+    accuracy_experiment(center_latitude, center_longitude, radius, earth_radius, user_points, engine)
 
     # Plot points for visualisation
     plot_geofence(center_latitude, center_longitude, radius, earth_radius, points_inside, points_outside, points_edge)
@@ -1,8 +1,17 @@
 import pytest
 import json
+import requests
+import math
+import time
 from phe import paillier
 from unittest.mock import patch
+import src.app
+import geofencing_service
 from src.app import app
+from service_common import AdmissionController
+from geofencing_service import KeyAuthorityPool, KeyCache, HitOrder, ResultCache, ObfuscationPool, polygon_circle_cover
+from geofence_engine import location_terms, reference_center_terms
+from paillier_engine import PaillierEngine
 
 ###### NOTE: if tests fail it can be due to the overpass query timing out ########
 
@@ -19,7 +28,7 @@ def client():
 # Test the /submit-mobile-node-location-ref API endpoint to ensure it processes and responds to encrypted user data correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_ref_success(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -60,7 +69,7 @@ def test_submit_mobile_node_location_ref_success(mock_geo, mock_key, client):
 # Test the /submit-mobile-node-location-ref API endpoint to ensure it responds to missing data correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_ref_missing_data(mock_geo, mock_key, client):
     # Send POST request to the /submit-mobile-node-location-ref endpoint using the test client
     response = client.post(
@@ -80,7 +89,7 @@ def test_submit_mobile_node_location_ref_missing_data(mock_geo, mock_key, client
 # Test the /submit-mobile-node-location-ref API endpoint to ensure it responds to missing fields correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_ref_missing_fields(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -109,7 +118,7 @@ def test_submit_mobile_node_location_ref_missing_fields(mock_geo, mock_key, clie
 # Test the /submit-mobile-node-location-ref API endpoint to ensure it responds to public key mismatch correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_ref_public_key_mismatch(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -150,7 +159,7 @@ def test_submit_mobile_node_location_ref_public_key_mismatch(mock_geo, mock_key,
 # Test the /submit-mobile-node-location-ref API endpoint to ensure it responds to missing keys correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_ref_missing_keys(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -191,7 +200,7 @@ def test_submit_mobile_node_location_ref_missing_keys(mock_geo, mock_key, client
 # Test the /submit-mobile-node-location-prop API endpoint to ensure it processes and responds to encrypted user data correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_prop_succcess(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -229,7 +238,7 @@ def test_submit_mobile_node_location_prop_succcess(mock_geo, mock_key, client):
 # Test the /submit-mobile-node-location-prop API endpoint to ensure it responds to missing data correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_prop_missing_data(mock_geo, mock_key, client):
     # Send POST request to the /submit-mobile-node-location-prop endpoint using the test client
     response = client.post(
@@ -249,7 +258,7 @@ def test_submit_mobile_node_location_prop_missing_data(mock_geo, mock_key, clien
 # Test the /submit-mobile-node-location-prop API endpoint to ensure it responds to missing fields correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_prop_missing_fields(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -278,7 +287,7 @@ def test_submit_mobile_node_location_prop_missing_fields(mock_geo, mock_key, cli
 # Test the /submit-mobile-node-location-prop API endpoint to ensure it responds to public key mismatch correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_prop_public_key_mismatch(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -316,7 +325,7 @@ def test_submit_mobile_node_location_prop_public_key_mismatch(mock_geo, mock_key
 # Test the /submit-mobile-node-location-prop API endpoint to ensure it responds to missing keys correctly
 # Mock public key function and geofence fetch function
 @patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
-@patch("src.app.get_geofence_coordinates")
+@patch("geofencing_service.get_geofence_coordinates")
 def test_submit_mobile_node_location_prop_missing_keys(mock_geo, mock_key, client):
     # Test value to be encrypted and submitted
     test_value = 1.1672744938776433e-15
@@ -347,4 +356,387 @@ def test_submit_mobile_node_location_prop_missing_keys(mock_geo, mock_key, clien
     assert response.status_code == 400                                                                      # Check if the response status code is a Bad Request
     response_json = response.get_json()                                                                     # Parse JSON from response
     assert response_json["status"] == "error"                                                               # Confirm response status
-    assert response_json["message"] == "Missing required keys in 'user_encrypted_location': c1_exp"         # Confirm error message
\ No newline at end of file
+    assert response_json["message"] == "Missing required keys in 'user_encrypted_location': c1_exp"         # Confirm error message
+
+
+
+# Test the /submit-mobile-node-location-prop API endpoint to ensure a saturated service sheds the request with Retry-After
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
+@patch("geofencing_service.get_geofence_coordinates")
+def test_submit_mobile_node_location_prop_overloaded(mock_geo, mock_key, client):
+    # Admission controller with no free slots and no queue
+    with patch("service_common.admission_controller", AdmissionController(0, 0)):
+        response = client.post(
+            "/submit-mobile-node-location-prop",
+            data=json.dumps({"public_key_n": TEST_PUBLIC_KEY_N}),
+            content_type="application/json"
+        )
+
+    # Verify the request was rejected before any homomorphic work was done
+    assert response.status_code == 503                                           # Check if the response status code is Service Unavailable
+    assert response.headers["Retry-After"] == "1"                                # Confirm retry hint is present
+    mock_key.assert_not_called()                                                 # Key authority was never contacted
+
+
+
+# Test the /submit-mobile-node-location-prop API endpoint to ensure an unreachable key authority is a 502 that keeps the cache
+@patch("src.app.get_key_authority_public_key", return_value=None)
+def test_submit_mobile_node_location_prop_public_key_unavailable(mock_key, client):
+    cache = ResultCache(4, 60)
+    cache.observe_key(TEST_PUBLIC_KEY_N)
+    cache.store(cache.lookup(TEST_PUBLIC_KEY_N, "v1", {"user_encrypted_location": {"c1_ct": 1}})[0], {"status": "success"})
+    data = {"user_encrypted_location": {"c1_ct": 1}, "public_key_n": TEST_PUBLIC_KEY_N}
+    with patch("geofencing_service.result_cache", cache), patch("geofencing_service.current_key", KeyCache(60)):
+        response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+
+    assert response.status_code == 502                                           # Check if the response status code is Bad Gateway
+    assert response.get_json()["message"] == "Failed to fetch the public key from the key authority"
+    assert len(cache.entries) == 1                                               # A failed key fetch does not count as a rotation
+
+
+# Test that a key rotation at the key authority stops cached results under the old key once the cached key expires
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N + 2)
+def test_submit_mobile_node_location_prop_cache_after_rotation(mock_key, client):
+    cache = ResultCache(4, 60)
+    data = {"user_encrypted_location": {"c1_ct": 1}, "public_key_n": TEST_PUBLIC_KEY_N}
+    cache.observe_key(TEST_PUBLIC_KEY_N)
+    cache.store(cache.lookup(TEST_PUBLIC_KEY_N, geofencing_service.catalog.version, data)[0], {"status": "success", "first_inside": 0})
+    with patch("geofencing_service.result_cache", cache), patch("geofencing_service.current_key", KeyCache(60)):
+        response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+
+    assert response.status_code == 400                                           # The old key is refused instead of served from the cache
+    assert not cache.entries                                                     # Entries under the old key are dropped
+
+
+# Test that cached results are served without a key authority round trip while the current key is cached
+def test_submit_mobile_node_location_prop_cache_hit_skips_key_authority(client):
+    cache = ResultCache(4, 60)
+    data = {"user_encrypted_location": {"c1_ct": 1}, "public_key_n": TEST_PUBLIC_KEY_N}
+    cache.observe_key(TEST_PUBLIC_KEY_N)
+    cache.store(cache.lookup(TEST_PUBLIC_KEY_N, geofencing_service.catalog.version, data)[0], {"status": "success", "first_inside": 0})
+    with patch("geofencing_service.result_cache", cache), patch("geofencing_service.current_key", KeyCache(60)), \
+            patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N) as mock_key:
+        for _ in range(3):
+            response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+            assert response.get_json()["cached"] is True                        # Served from the result cache
+        assert mock_key.call_count == 1                                          # Only the first request asked the key authority
+
+        mock_key.return_value = TEST_PUBLIC_KEY_N + 2
+        response = client.post("/submit-mobile-node-location-prop", data=json.dumps({**data, "public_key_n": TEST_PUBLIC_KEY_N + 2}), content_type="application/json")
+        assert mock_key.call_count == 2                                          # A client on another key refreshes it at once
+    assert not cache.entries                                                     # and the rotation drops the old key's entries
+
+
+# Test the /submit-mobile-node-location-prop API endpoint to ensure an expired deadline stops work before the key authority is called
+@patch("geofencing_service.submit_geofence_results_to_key_authority")
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
+@patch("geofencing_service.get_geofence_coordinates")
+def test_submit_mobile_node_location_prop_deadline_exceeded(mock_geo, mock_key, mock_submit, client):
+    response = client.post(
+        "/submit-mobile-node-location-prop",
+        data=json.dumps({"public_key_n": TEST_PUBLIC_KEY_N}),
+        content_type="application/json",
+        headers={"X-Deadline-Ms": "0"}
+    )
+
+    # Verify the request was abandoned without any downstream work
+    assert response.status_code == 504                                           # Check if the response status code is Gateway Timeout
+    mock_submit.assert_not_called()                                              # Key authority was never contacted
+
+
+
+# Test the /submit-mobile-node-location-prop API endpoint to ensure a key authority refusal keeps its status and body
+@patch("src.app.get_key_authority_public_key", return_value=TEST_PUBLIC_KEY_N)
+@patch("geofencing_service.key_authority_pool")
+def test_submit_mobile_node_location_prop_key_authority_refusal(mock_pool, mock_key, client):
+    draft = geofencing_service.new_catalog_draft()
+    geofencing_service.add_catalog_entry(draft, {"geometry": {"type": "Point", "coordinates": [-9.7240, 51.5730]}, "properties": {}})
+    refusal = {"status": "error", "message": "Ring threshold within the decryption error"}
+    mock_pool.request.return_value.status_code = 422
+    mock_pool.request.return_value.json.return_value = refusal
+    encrypted_result = paillier.PaillierPublicKey(TEST_PUBLIC_KEY_N).encrypt(0.5)
+    location = {f"{term}_{field}": value for term in ("c1", "c2", "c3")
+                for field, value in (("ct", encrypted_result.ciphertext()), ("exp", encrypted_result.exponent))}
+    with patch("geofencing_service.catalog", geofencing_service.Catalog(draft)):
+        response = client.post(
+            "/submit-mobile-node-location-prop",
+            data=json.dumps({"user_encrypted_location": location, "public_key_n": TEST_PUBLIC_KEY_N, "response_format": "rings", "radii": [10]}),
+            content_type="application/json"
+        )
+
+    # Verify the client sees the key authority's answer rather than a generic failure
+    assert response.status_code == 422                                           # Status passed through
+    assert response.get_json() == refusal                                        # Body passed through unchanged
+
+
+
+# Test the key authority pool to ensure a slow replica is hedged and the faster duplicate answer is used
+@patch("geofencing_service.HEDGE_DEFAULT_DELAY", 0.05)
+def test_key_authority_pool_hedges_slow_replica():
+    class FakeResponse:
+        def __init__(self, url):
+            self.url = url
+            self.status_code = 200
+
+    def fake_request(method, url, **kwargs):
+        if url.startswith("http://slow"):
+            time.sleep(1)                                                        # Slow replica answers after the hedge delay
+        return FakeResponse(url)
+
+    pool = KeyAuthorityPool(["http://slow:5002", "http://fast:5002"])
+    with patch("geofencing_service.requests.request", side_effect=fake_request):
+        response = pool.request("GET", "get-public-key", timeout=5)
+
+    # Verify the duplicate sent to the fast replica won the race
+    assert response.url == "http://fast:5002/get-public-key"                     # Answer came from the hedged replica
+    stats = pool.snapshot()
+    assert stats["hedges_sent"] == 1                                             # Exactly one duplicate was sent
+    assert stats["hedges_won"] == 1                                              # Duplicate answered first
+
+
+
+# Test the key authority pool to ensure a missing configuration is a clear error and an exhausted budget still sends
+def test_key_authority_pool_without_urls_or_budget():
+    with pytest.raises(requests.exceptions.InvalidURL, match="KEY_AUTHORITY_URLS"):
+        KeyAuthorityPool([""]).request("GET", "get-public-key", timeout=5)      # No replica configured
+
+    timeouts = []
+    def fake_request(method, url, **kwargs):
+        timeouts.append(kwargs["timeout"])
+        raise requests.exceptions.Timeout("too slow")
+
+    pool = KeyAuthorityPool(["http://keyauthority:5002"])
+    with patch("geofencing_service.requests.request", side_effect=fake_request):
+        with pytest.raises(requests.exceptions.Timeout):
+            pool.request("GET", "get-public-key", timeout=-0.5)                  # A spent budget is a timeout, not a ValueError
+    assert timeouts == [0.001]                                                   # Sent once with the smallest timeout
+
+
+
+# Test the /submit-mobile-node-location-prop API endpoint in coordinator mode to ensure shard decisions are merged and failed shards are flagged
+@patch("geofencing_service.GEOFENCE_SHARD_URLS", ["http://shard-0:5001", "http://shard-1:5001"])
+def test_submit_mobile_node_location_prop_coordinator_partial(client):
+    def fake_query_shard(url, path, payload, deadline):
+        if url == "http://shard-1:5001":
+            raise TimeoutError("shard too slow")                                 # Second shard does not answer in time
+        return {"results": [{"status": "inside"}, {"status": "outside"}], "geofence_indices": [0, 2], "catalog_size": 4}
+
+    data = {"user_encrypted_location": {}, "public_key_n": TEST_PUBLIC_KEY_N}
+    with patch("geofencing_service.query_shard", side_effect=fake_query_shard):
+        response = client.post(
+            "/submit-mobile-node-location-prop",
+            data=json.dumps(data),
+            content_type="application/json"
+        )
+
+    # Verify decisions are placed at their catalog positions and the gap is reported
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    response_json = response.get_json()
+    assert [r["status"] for r in response_json["results"]] == ["inside", "unknown", "outside", "unknown"]
+    assert response_json["partial"] is True                                      # Confirm the result is flagged as partial
+    assert response_json["failed_shards"] == ["http://shard-1:5001"]             # Confirm the failed shard is named
+
+
+# Test that the coordinator merges compact shard responses into catalog positions
+@patch("geofencing_service.GEOFENCE_SHARD_URLS", ["http://shard-0:5001", "http://shard-1:5001"])
+def test_submit_mobile_node_location_prop_coordinator_compact(client):
+    def fake_query_shard(url, path, payload, deadline):
+        if url == "http://shard-1:5001":
+            return {"status": "success", "format": "first", "count": 2, "first_inside": 1, "geofence_indices": [1, 3], "catalog_size": 4}
+        return {"status": "success", "format": "first", "count": 2, "first_inside": None, "geofence_indices": [0, 2], "catalog_size": 4}
+
+    data = {"user_encrypted_location": {}, "public_key_n": TEST_PUBLIC_KEY_N, "response_format": "first"}
+    with patch("geofencing_service.query_shard", side_effect=fake_query_shard):
+        response = client.post(
+            "/submit-mobile-node-location-prop",
+            data=json.dumps(data),
+            content_type="application/json"
+        )
+
+    # Verify the second shard's local first hit maps to catalog position 3
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    response_json = response.get_json()
+    assert response_json["format"] == "first"                                    # Confirm the requested shape is kept
+    assert response_json["first_inside"] == 3                                    # Confirm the hit is placed in the catalog
+    assert response_json["partial"] is False                                     # Confirm every shard answered
+
+
+# Test that any-match queries put likely hits first
+def test_hit_order_recency_and_popularity():
+    recency = HitOrder(4, "recency")
+    recency.record(2, 3)
+    recency.record(3, 4)
+    assert recency.snapshot() == [3, 2, 0, 1]                                    # Most recent hit first
+
+    popularity = HitOrder(4, "popularity")
+    for hit in (3, 1, 1, None):
+        popularity.record(hit, 2)
+    assert popularity.snapshot() == [1, 3, 0, 2]                                 # Most frequent hit first
+    summary = popularity.summary()
+    assert summary["queries"] == 4 and summary["matches"] == 3                   # Confirm queries and hits are counted
+    assert summary["decrypted_per_query"] == 2                                   # Confirm the decryptions per query
+
+
+# Test that a polygon cover stays within the tolerance and covers the whole polygon
+def test_polygon_circle_cover():
+    square = [[[-9.7250, 51.5720], [-9.7220, 51.5720], [-9.7220, 51.5740], [-9.7250, 51.5740], [-9.7250, 51.5720]]]
+    circles = polygon_circle_cover(square, 25)
+    assert 1 < len(circles) < 200                                                # Compact compared to the 200 m by 220 m area
+
+    def distance(lon1, lat1, lon2, lat2):
+        return 6371000 * math.acos(min(1.0, math.sin(lat1) * math.sin(lat2) + math.cos(lat1) * math.cos(lat2) * math.cos(lon1 - lon2)))
+
+    for lon, lat in [(-9.7249, 51.5721), (-9.7235, 51.5730), (-9.7221, 51.5739)]:  # Corners and centre
+        assert any(distance(math.radians(lon), math.radians(lat), c_lon, c_lat) <= r for c_lon, c_lat, r in circles)
+    far = (math.radians(-9.7270), math.radians(51.5730))                         # About 140 m west of the polygon
+    assert not any(distance(*far, c_lon, c_lat) <= r for c_lon, c_lat, r in circles)
+
+
+# Test that tag-filtered queries are answered over the selected geofences only
+@patch("geofencing_service.GEOFENCE_SHARD_URLS", ["http://shard-0:5001", "http://shard-1:5001"])
+def test_submit_mobile_node_location_prop_coordinator_tags(client):
+    def fake_query_shard(url, path, payload, deadline):
+        if url == "http://shard-1:5001":
+            return {"status": "success", "format": "indices", "count": 1, "inside": [0], "geofence_indices": [5], "catalog_size": 8}
+        return {"status": "success", "format": "indices", "count": 2, "inside": [], "geofence_indices": [2, 4], "catalog_size": 8}
+
+    data = {"user_encrypted_location": {}, "public_key_n": TEST_PUBLIC_KEY_N, "response_format": "indices", "tags": ["depot"]}
+    with patch("geofencing_service.query_shard", side_effect=fake_query_shard):
+        response = client.post(
+            "/submit-mobile-node-location-prop",
+            data=json.dumps(data),
+            content_type="application/json"
+        )
+
+    # Verify positions refer to the selected geofences, placed in the catalog by geofence_indices
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    response_json = response.get_json()
+    assert response_json["geofence_indices"] == [2, 4, 5]                        # Only depots were evaluated
+    assert response_json["inside"] == [2]                                        # The hit is catalog geofence 5
+
+    data["tags"] = "depot"
+    response = client.post("/submit-mobile-node-location-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Tags must be a list
+
+
+# Test that repeated ciphertexts are served from the result cache until evicted, expired or the key rotates
+def test_result_cache_hits_evicts_and_invalidates():
+    cache = ResultCache(1, 60)
+    request_a = {"user_encrypted_location": {"c1_ct": 1}, "response_format": "first"}
+    request_b = {"user_encrypted_location": {"c1_ct": 2}, "response_format": "first"}
+    cache.observe_key(7)
+    digest, cached = cache.lookup(7, "v1", request_a)
+    assert cached is None                                                        # First submission misses
+    cache.store(digest, {"status": "success", "first_inside": 0})
+    assert cache.lookup(7, "v1", request_a)[1] == {"status": "success", "first_inside": 0}  # Resend is a hit
+    assert cache.lookup(8, "v1", request_a)[1] is None                                 # Another key never matches
+    assert cache.lookup(7, "v1", {**request_a, "response_format": "indices"})[1] is None  # Nor other query options
+    assert cache.lookup(7, "v2", request_a)[1] is None                           # Nor another catalog version
+
+    cache.store(cache.lookup(7, "v1", request_b)[0], {"status": "success", "first_inside": None})
+    assert cache.lookup(7, "v1", request_a)[1] is None                                 # Least recently used entry evicted
+    cache.observe_key(8)
+    assert cache.lookup(7, "v1", request_b)[1] is None                                 # Key rotation drops every entry
+    summary = cache.summary()
+    assert summary["hits"] == 1 and summary["evictions"] == 1 and summary["invalidations"] == 1
+
+    retained = ResultCache(4, 60)
+    retained.store(retained.lookup("ckks-v1", "v1", request_a)[0], {"status": "success"})
+    retained.store(retained.lookup("ckks-v2", "v1", request_a)[0], {"status": "success"})
+    retained.drop_key("ckks-v1")
+    assert retained.lookup("ckks-v1", "v1", request_a)[1] is None                      # A retired context's entries are dropped
+    assert retained.lookup("ckks-v2", "v1", request_a)[1] is not None                  # Other retained contexts keep theirs
+
+    expiring = ResultCache(4, 0)
+    expiring.store(expiring.lookup(7, "v1", request_a)[0], {"status": "success"})
+    assert expiring.lookup(7, "v1", request_a)[1] is None                              # Expired entries are not served
+    assert expiring.summary()["expired"] == 1
+
+
+# Test that a reload swaps in the new catalog version, reaches the other workers and a broken catalog file keeps the old one
+def test_reload_catalog_swaps_version(client, tmp_path):
+    def point(lon, lat, amenity):
+        return {"type": "Feature", "geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"amenity": amenity}}
+
+    catalog_file = tmp_path / "catalog.json"
+    catalog_file.write_text(json.dumps({"type": "FeatureCollection", "features": [point(-9.7240, 51.5730, "cafe")]}))
+    admin = {"X-Admin-Token": "secret"}
+    with patch("geofencing_service.GEOFENCE_CATALOG_FILE", str(catalog_file)), patch("geofencing_service.catalog", geofencing_service.catalog), \
+            patch("geofencing_service.CATALOG_STATE_DIR", str(tmp_path)), patch("geofencing_service.catalog_generation", None), \
+            patch("service_common.ADMIN_TOKEN", "secret"):
+        response = client.post("/reload-catalog", headers=admin)
+        assert response.status_code == 200                                       # Check if the response status code is OK
+        first = response.get_json()
+        assert first["geofences"] == 1                                           # Confirm the file was loaded
+        first_catalog, first_generation = geofencing_service.catalog, geofencing_service.catalog_generation
+
+        catalog_file.write_text(json.dumps({"type": "FeatureCollection", "features": [point(-9.7240, 51.5730, "cafe"), point(-9.7230, 51.5720, "fuel")]}))
+        second = client.post("/reload-catalog", headers=admin).get_json()
+        assert second["geofences"] == 2 and second["version"] != first["version"]  # A new version is swapped in
+        assert geofencing_service.catalog.tag_index == {"amenity=cafe": [0], "amenity=fuel": [1]}
+
+        # Another worker still serving the first version adopts the published one before its next request
+        geofencing_service.catalog, geofencing_service.catalog_generation = first_catalog, first_generation
+        client.get("/service-stats")
+        assert geofencing_service.catalog.version == second["version"]           # Confirm the reload reached the worker
+
+        catalog_file.write_text("{")
+        response = client.post("/reload-catalog", headers=admin)
+        assert response.status_code == 500                                      # A broken file is rejected
+        assert geofencing_service.catalog.version == second["version"]                      # Confirm the old catalog keeps serving
+
+        assert client.post("/reload-catalog", headers={"X-Admin-Token": "wrong"}).status_code == 403  # Reloads need the admin token
+    assert client.post("/reload-catalog").status_code == 403                     # Without a configured token reloads are refused
+
+
+# Test that re-randomized results still decrypt to their values and pooled factors are used before inline ones
+def test_obfuscation_pool_rerandomizes_results():
+    test_public_key, test_private_key = paillier.generate_paillier_keypair(n_length=256)
+    encrypted = test_public_key.encrypt(0.25, r_value=1)
+    pool = ObfuscationPool(2)
+    factors = pool.take(test_public_key, 2, PaillierEngine.random_factor)
+    assert pool.summary()["inline"] == 2                                         # An empty pool computes the factors inline
+    for factor in factors:
+        rerandomized = paillier.EncryptedNumber(test_public_key, encrypted.ciphertext(False) * factor % test_public_key.nsquare, encrypted.exponent)
+        assert rerandomized.ciphertext(False) != encrypted.ciphertext(False)     # Confirm the ciphertext changes
+        assert test_private_key.decrypt(rerandomized) == 0.25                    # Confirm the value does not
+
+    end = time.time() + 10
+    while pool.summary()["available"] < 2 and time.time() < end:
+        time.sleep(0.01)
+    pool.take(test_public_key, 3, PaillierEngine.random_factor)
+    summary = pool.summary()
+    assert summary["pooled"] == 2 and summary["inline"] == 3                     # The refill thread restocked the pool
+    pool.take(paillier.generate_paillier_keypair(n_length=256)[0], 1, PaillierEngine.random_factor)
+    assert pool.summary()["inline"] == 4                                         # Factors of another key are never used
+
+
+# Test that one evaluate_many call serves several users and every result decrypts to its plaintext value
+def test_engine_evaluate_many_matches_plaintext():
+    test_public_key, test_private_key = paillier.generate_paillier_keypair(n_length=512)
+    engine = src.app.get_engine(test_public_key.n)
+    users = [(math.radians(51.5730), math.radians(-9.7235)), (math.radians(-33.8688), math.radians(151.2093))]
+    fences = [location_terms(math.radians(51.5731), math.radians(-9.7236)), location_terms(math.radians(-33.8690), math.radians(151.2095))]
+    encrypted_users = [engine.deserialize_terms(engine.serialize_terms(engine.encrypt_terms(lat, lon))) for lat, lon in users]
+    batches = geofencing_service.calculate_intermediate_haversine_values(engine, encrypted_users, fences)
+
+    decrypting_engine = PaillierEngine(test_public_key, test_private_key)
+    assert len(batches) == len(users)                                            # One result batch per user
+    for (lat, lon), batch in zip(users, batches):
+        values, inside = decrypting_engine.decrypt_classify_batch(batch, [1 - math.cos(100 / 6371000)] * len(fences))
+        expected = [1 - sum(a * b for a, b in zip(location_terms(lat, lon), fence)) for fence in fences]
+        assert all(abs(value - target) < 1e-15 for value, target in zip(values, expected))  # Confirm every value survives evaluation
+        assert sum(inside) == 1                                                  # Each user is inside only the geofence next to it
+
+# Test that the reference scheme with the catalog's folded B terms yields the same 1 - cos(d/R) as the proposed scheme
+def test_engine_evaluate_many_reference_matches_proposed():
+    test_public_key, test_private_key = paillier.generate_paillier_keypair(n_length=512)
+    engine = src.app.get_engine(test_public_key.n)
+    lat, lon = math.radians(51.5730), math.radians(-9.7235)
+    centres = [(math.radians(51.5731), math.radians(-9.7236)), (math.radians(51.6510), math.radians(-9.9106))]
+    terms = engine.deserialize_terms(engine.serialize_terms(engine.encrypt_terms(lat, lon, "ref"), "ref"), "ref")
+    batch, = geofencing_service.calculate_intermediate_haversine_values(engine, [terms], [reference_center_terms(c_lat, c_lon, 2.0) for c_lat, c_lon in centres], scheme="ref")
+
+    values = PaillierEngine(test_public_key, test_private_key).decrypt_batch(batch)
+    expected = [1 - sum(a * b for a, b in zip(location_terms(lat, lon), location_terms(c_lat, c_lon))) for c_lat, c_lon in centres]
+    assert all(abs(value - target) < 1e-15 for value, target in zip(values, expected))  # Confirm both schemes agree
@@ -1,96 +1,75 @@
-from flask import Flask, jsonify, request
 from phe import paillier
-import math
-import time
+from phe.util import getprimeover, powmod
+import hashlib
+import json
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+from paillier_engine import KEY_PROFILES, PaillierEngine
+from key_authority_service import app, KEY_STORE_DIR, KeyStore, load_cost_model, serve_keyed_keys, serve_keyed_results
+from service_common import DEADLINE_CHECK_CHUNK
 
-app = Flask(__name__)
+# The Paillier backend of the shared key authority (shared/key_authority_service.py)
 
-# Generate Paillier public and private keys
-public_key, private_key = paillier.generate_paillier_keypair()
-radius = 100            # Geofence radius in meters
-earth_radius = 6371000  # Approximate Earth radius in meters
+# Key profiles (paillier_engine.py) apply to newly generated keys, paillier_benchmark.py measures them and its cost model
+# is reported at /get-public-key. PAILLIER_KEY_SIZE still overrides the profile's size.
+PAILLIER_KEY_PROFILE = os.environ.get("PAILLIER_KEY_PROFILE", "standard")
+PAILLIER_KEY_SIZE = int(os.environ.get("PAILLIER_KEY_SIZE", str(KEY_PROFILES[PAILLIER_KEY_PROFILE]["key_size"])))
+PAILLIER_COST_MODEL = os.environ.get("PAILLIER_COST_MODEL")
 
-@app.route("/get-public-key", methods=['GET'])
-def get_public_key():
-    public_key_data = {
-        "public_key_n": public_key.n
-    }
-    return jsonify(public_key_data)
+cost_model = load_cost_model(PAILLIER_COST_MODEL)
 
-def parse_encrypted_results(encrypted_results, public_key):
-    encrypted_result_list = []
-    try:
-        for entry in encrypted_results:
-            ciphertext_value = entry.get("ciphertext")
-            exponent = entry.get("exponent")
-            if ciphertext_value is None or exponent is None:
-                raise ValueError("Missing ciphertext or exponent in encrypted result entry")
-            encrypted_result = paillier.EncryptedNumber(public_key, ciphertext_value, exponent)
-            encrypted_result_list.append(encrypted_result)
-            print("encrypted result:", encrypted_result)
-        return encrypted_result_list
-    except Exception as e:
-        print(f"Error parsing encrypted results: {e}")
-        return None
+def generate_paillier_keypair_parallel(n_length=PAILLIER_KEY_SIZE):
+    # p and q are searched for in separate processes, roughly halving key generation time
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        while True:
+            p, q = executor.map(getprimeover, [n_length // 2] * 2)
+            if p != q and (p * q).bit_length() == n_length:
+                public_key = paillier.PaillierPublicKey(p * q)
+                return public_key, paillier.PaillierPrivateKey(public_key, p, q)
 
-def decrypt_encrypted_results(encrypted_result_list, private_key):
-    decrypted_values = []
-    try:
-        for encrypted_result in encrypted_result_list:
-            decrypted_value = private_key.decrypt(encrypted_result)
-            decrypted_values.append(decrypted_value)
-        return decrypted_values
-    except Exception as e:
-        print(f"Error decrypting encrypted results: {e}")
-        return None
+def serialize_paillier_keypair(keypair):
+    public_key, private_key = keypair
+    return json.dumps({"n": public_key.n, "p": private_key.p, "q": private_key.q}).encode("utf-8")
 
-def evaluate_geofence_result_prop(haversine_intermediate_values):
-    results = []
-    for haversine_intermediate in haversine_intermediate_values:
-        try:
-            distance = 2 * earth_radius * math.asin(math.sqrt(haversine_intermediate / 2))
-            print(f"Distance from geofence centre: {round(distance, 2)} meters")
-            results.append(1 if distance <= radius else 0)
-        except Exception as e:
-            print(f"Unexpected error in evaluate_geofence_result: {e}")
-            return None
-    return results
+def deserialize_paillier_keypair(data):
+    key_data = json.loads(data)
+    public_key = paillier.PaillierPublicKey(key_data["n"])
+    return public_key, paillier.PaillierPrivateKey(public_key, key_data["p"], key_data["q"])
 
-@app.route("/submit-geofence-result-prop", methods=['POST'])
-def submit_geofence_result_prop():
-    data = request.get_json()
-    if not data or 'encrypted_results' not in data or 'public_key_n' not in data:
-        return jsonify({
-            "status": "error",
-            "message": "Missing 'encrypted_results' or 'public_key_n' in request data"
-        }), 400
-    if data['public_key_n'] != public_key.n:
-        return jsonify({
-            "status": "error",
-            "message": "Public key mismatch. Encryption was not done with the correct public key."
-        }), 400
-    encrypted_result_list = parse_encrypted_results(data['encrypted_results'], public_key)
-    if encrypted_result_list is None:
-        return jsonify({
-            "status": "error",
-            "message": "Invalid encrypted results"
-        }), 400
-    start_prop = time.time()
-    haversine_intermediate_values = decrypt_encrypted_results(encrypted_result_list, private_key)
-    if haversine_intermediate_values is None:
-        return jsonify({
-            "status": "error",
-            "message": "Couldn't decrypt encrypted results",
-        }), 500
-    results = evaluate_geofence_result_prop(haversine_intermediate_values)
-    end_prop = time.time()
-    print("(Runtime Performance Experiment) Decryption & Evaluation Runtime Proposed:", round((end_prop-start_prop), 3), "s")
-    # Return a list of results for each geofence
-    status_list = [{"status": "inside" if r == 1 else "outside"} for r in results]
-    return jsonify({
-        "status": "success",
-        "results": status_list
-    }), 200
+key_store = KeyStore(KEY_STORE_DIR, "paillier", ".json", generate_paillier_keypair_parallel,
+                     serialize_paillier_keypair, deserialize_paillier_keypair)
+key_store.load()
+
+# Fast encryption: clients obfuscate with hs^alpha for a short random alpha instead of r^n, where hs = h^n mod n^2
+# and h = -x^2 mod n. x is derived from the private key, so every worker and replica publishes the same hs per key.
+FAST_ENCRYPTION = os.environ.get("FAST_ENCRYPTION", "0") == "1"
+SHORT_EXPONENT_BITS = int(os.environ.get("SHORT_EXPONENT_BITS", "0"))  # 0 uses twice the security level of the key's profile
+short_exponent_bases = {}  # n -> hs
+
+def short_exponent_base(keypair):
+    key_public, key_private = keypair
+    if key_public.n not in short_exponent_bases:
+        seed = hashlib.shake_256(f"hs:{key_private.p}:{key_private.q}".encode("utf-8")).digest(key_public.n.bit_length() // 8 + 16)
+        x = int.from_bytes(seed, "big") % key_public.n
+        short_exponent_bases[key_public.n] = powmod(-x * x % key_public.n, key_public.n, key_public.nsquare)
+    return short_exponent_bases[key_public.n]
+
+def public_key_fields(keypair, profile):
+    if not FAST_ENCRYPTION:
+        return {}
+    return {"hs": short_exponent_base(keypair), "short_exponent_bits": SHORT_EXPONENT_BITS or 2 * (profile["security_bits"] or 128)}
+
+def get_engine(keypair):
+    # The shared Paillier engine (paillier_engine.py) under one of the retained keys
+    return PaillierEngine(*keypair, checkpoint_chunk=DEADLINE_CHECK_CHUNK)
+
+# Scheme name of each result route: the Geofencing service folds the reference scheme's constants into its
+# coefficients, so both deliver 1 - cos(d/R) and are decrypted and classified alike
+RESULT_ROUTES = {"/submit-geofence-result-prop": "Proposed", "/submit-geofence-result-ref": "Reference"}
+
+serve_keyed_keys(sys.modules[__name__])
+serve_keyed_results(sys.modules[__name__], RESULT_ROUTES)
 
 if __name__ == '__main__':
-    app.run(debug=True, host="0.0.0.0", port=5002)
\ No newline at end of file
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1", host="0.0.0.0", port=int(os.environ.get("PORT", "5002")))
@@ -1,7 +1,15 @@
 import pytest
 import json
+import math
 from phe import paillier
-from src.app import app, public_key  # Import app and public_key from Flask app
+from unittest.mock import patch
+from src.app import app, key_store  # Import app and its key store from Flask app
+from src.app import generate_paillier_keypair_parallel, serialize_paillier_keypair, deserialize_paillier_keypair
+from service_common import AdmissionController
+from key_authority_service import KeyRotationUnavailable, KeyStore, decrypt_encrypted_results
+
+# The key authority's active key, tests that rotate use their own key store
+public_key, private_key = key_store.active()[1]
 
 # Define global public key for tests
 TEST_PUBLIC_KEY_N = 3210131167491402381360855405768136524723131583063401686939536377248206612898093902281517087989350447973680309349844939869625646069464283107102315140957135030855566698657728970743088872406086683005602981278782061462055117278358014685112717964828813688516035554137921655736181767637289690401259456491103568200339004419723774721415806936330885537229629641534942073956043863651976921040523281337551635982725737466262891323780975172451930241745652810226072575597011991165681288123337624183920090048905922282510614733081584888927789152871527795813868130394440878786340663453158764179621633859940291709225244925576473129803649759479666630736435849023151048963155970604007302450251210062572989831233579665555916445017421998785129641602069991707623738433829244731105324853096864425578633661846748179236139451724598230259714841024752729202889975310593161557704676030992651855327522255343082019593345265429213697707608079783448122041581
@@ -278,4 +286,276 @@ def test_submit_geofence_result_prop_decryption_failure(client):
     assert response.status_code == 500                                                                              # Check if the response status code is a Bad Request
     response_json = response.get_json()                                                                             # Parse JSON from response
     assert response_json["status"] == "error"                                                                       # Confirm response status
-    assert response_json["message"] == "Couldn't decrypt encrypted results"                                          # Confirm error message
\ No newline at end of file
+    assert response_json["message"] == "Couldn't decrypt encrypted results"                                          # Confirm error message
+
+
+
+# Test the /submit-geofence-result-prop API endpoint to ensure a saturated service sheds the request with Retry-After
+def test_submit_geofence_result_prop_overloaded(client):
+    # Admission controller with no free slots and no queue
+    with patch("service_common.admission_controller", AdmissionController(0, 0)):
+        response = client.post(
+            "/submit-geofence-result-prop",
+            data=json.dumps({"public_key_n": public_key.n}),
+            content_type="application/json"
+        )
+
+    # Verify the request was rejected quickly with a retry hint
+    assert response.status_code == 503                                           # Check if the response status code is Service Unavailable
+    assert response.headers["Retry-After"] == "1"                                # Confirm retry hint is present
+    assert response.get_json()["status"] == "error"                              # Confirm response status
+
+
+
+# Test the admission controller to ensure low priority requests are shed before high priority requests
+def test_admission_controller_sheds_low_priority_first():
+    controller = AdmissionController(1, 4)
+    assert controller.acquire("normal", timeout=0) is None                       # First request takes the only slot
+    assert controller.acquire("low", timeout=0) == "timeout"                     # Low priority may queue but cannot get a slot
+    controller.waiting["normal"] = 1                                             # Simulate one queued request
+    assert controller.acquire("low", timeout=0) == "priority"                    # Low priority share of the queue is exhausted
+    assert controller.acquire("high", timeout=0) == "timeout"                    # High priority is still allowed to queue
+    controller.waiting["normal"] = 0
+    controller.release()
+    assert controller.snapshot()["active"] == 0                                  # Slot released
+
+
+
+# Test the /submit-geofence-result-prop API endpoint to ensure requests whose deadline already passed are dropped
+def test_submit_geofence_result_prop_deadline_exceeded(client):
+    encrypted_result = public_key.encrypt(1.1672744938776433e-15)
+    data = {
+        "encrypted_results": [{"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent}],
+        "public_key_n": public_key.n
+    }
+
+    # Send the request with no time budget left
+    response = client.post(
+        "/submit-geofence-result-prop",
+        data=json.dumps(data),
+        content_type="application/json",
+        headers={"X-Deadline-Ms": "0"}
+    )
+
+    # Verify the work was abandoned and counted
+    assert response.status_code == 504                                           # Check if the response status code is Gateway Timeout
+    assert response.get_json()["message"] == "Deadline exceeded during arrival"  # Confirm the stage that expired
+    stats = client.get("/service-stats").get_json()
+    assert stats["deadline_expired"]["arrival"] >= 1                             # Confirm the expiry was counted
+
+
+
+# Test the key store to ensure keys persist across restarts and only change on an explicit rotation
+def test_key_store_persists_and_rotates(tmp_path):
+    def new_store():
+        return KeyStore(str(tmp_path), "paillier", ".json", lambda: generate_paillier_keypair_parallel(512),
+                        serialize_paillier_keypair, deserialize_paillier_keypair)
+
+    store = new_store()
+    store.load()
+    store.generator.join()                                                       # Wait for the background pre-generated key
+    first_id, (first_public_key, _) = store.active()
+    assert first_id == "paillier-v1"                                             # First start generates version 1
+    assert store.pending_ids() == ["paillier-v2"]                                # Next key is ready ahead of time
+    assert oct((tmp_path / "paillier-v1.json").stat().st_mode)[-3:] == "600"     # Key file is private to the owner
+
+    # A restart loads the same key instead of generating a new one
+    restarted = new_store()
+    restarted.load()
+    assert restarted.active()[0] == first_id                                     # Same active key after restart
+
+    # Rotation promotes the pre-generated key and still accepts the previous one
+    assert restarted.rotate() == "paillier-v2"                                   # Pre-generated key becomes active
+    assert store.active()[0] == "paillier-v2"                                    # Other instances see the rotation
+    key_id, _ = store.find(lambda key_id, keypair: keypair[0].n == first_public_key.n)
+    assert key_id == "paillier-v1"                                               # Previous key is retained for decryption
+
+# Test that in-memory keys are only rotated by the process that loaded them, not by one forked worker
+def test_in_memory_rotation_refused_in_forked_worker(client):
+    store = KeyStore(None, "paillier", ".json", lambda: generate_paillier_keypair_parallel(512),
+                     serialize_paillier_keypair, deserialize_paillier_keypair)
+    store.load()
+    assert store.rotate() == "paillier-v2"                                       # The loading process may rotate
+
+    store.owner_pid = -1                                                         # As in a worker forked after --preload
+    with pytest.raises(KeyRotationUnavailable):
+        store.rotate()
+    assert store.active()[0] == "paillier-v2"                                    # The active key is unchanged
+
+    with patch.object(key_store, "owner_pid", -1), patch("service_common.ADMIN_TOKEN", "secret"):
+        response = client.post("/rotate-key", headers={"X-Admin-Token": "secret"})
+    assert response.status_code == 409                                           # The operator is told to set KEY_STORE_DIR
+    assert "KEY_STORE_DIR" in response.get_json()["message"]
+    assert key_store.active()[1][0].n == public_key.n                            # The service keeps its key
+
+# Test that /rotate-key fails closed: refused without a configured admin token and with a wrong one
+def test_rotate_key_requires_admin_token(client):
+    response = client.post("/rotate-key", headers={"X-Admin-Token": ""})
+    assert response.status_code == 403                                           # No token configured, nobody may rotate
+
+    with patch("service_common.ADMIN_TOKEN", "secret"):
+        response = client.post("/rotate-key", headers={"X-Admin-Token": "wrong"})
+    assert response.status_code == 403                                           # Wrong token
+    assert key_store.active()[1][0].n == public_key.n                            # The service keeps its key
+
+# Test the compact response shapes of /submit-geofence-result-prop
+def test_submit_geofence_result_prop_compact_formats(client):
+    # Geofences 0 and 2 are inside (zero distance), geofence 1 is far outside
+    encrypted_results = []
+    for value in (0.0, 1.0, 0.0):
+        encrypted_result = public_key.encrypt(value)
+        encrypted_results.append({"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent})
+
+    expected = {
+        "bitmap": {"bitmap": "oA=="},           # 0b10100000
+        "indices": {"inside": [0, 2]},
+        "first": {"first_inside": 0}
+    }
+    for response_format, fields in expected.items():
+        data = {"encrypted_results": encrypted_results, "public_key_n": public_key.n, "response_format": response_format}
+        response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+        assert response.status_code == 200                                       # Check if the response status code is OK
+        response_json = response.get_json()
+        assert response_json["format"] == response_format                        # Confirm the requested shape is used
+        assert response_json["count"] == 3                                       # Confirm the number of decided geofences
+        assert "results" not in response_json                                    # Confirm no per-geofence objects are built
+        for key, value in fields.items():
+            assert response_json[key] == value
+
+    data = {"encrypted_results": encrypted_results, "public_key_n": public_key.n, "response_format": "csv"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Unknown shapes are rejected
+
+
+# Test that any-match mode stops decrypting after the chunk holding the first inside result
+@patch("key_authority_service.ANY_MATCH_CHUNK", 2)
+def test_submit_geofence_result_prop_any_match(client):
+    encrypted_results = []
+    for value in (1.0, 1.0, 0.0, 1.0, 0.0, 1.0):
+        encrypted_result = public_key.encrypt(value)
+        encrypted_results.append({"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent})
+
+    data = {"encrypted_results": encrypted_results, "public_key_n": public_key.n, "response_format": "any"}
+    with patch("key_authority_service.decrypt_encrypted_results", wraps=decrypt_encrypted_results) as decrypt:
+        response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    response_json = response.get_json()
+    assert response_json["match"] is True                                        # Confirm a hit was found
+    assert response_json["hit_position"] == 2                                    # Confirm the first inside position
+    assert response_json["decrypted"] == 4                                       # Confirm the last chunk was skipped
+    assert decrypt.call_count == 2                                               # Confirm two chunks were decrypted
+
+
+# Test that every geofence is classified against its own precomputed threshold
+def test_submit_geofence_result_prop_per_geofence_thresholds(client):
+    # 1 - cos(d/R) for a user about 127 m from both geofence centres
+    encrypted_result = public_key.encrypt(2e-10)
+    entry = {"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent}
+    thresholds = [1 - math.cos(200 / 6371000), 1 - math.cos(100 / 6371000)]  # 200 m and 100 m radii
+
+    data = {"encrypted_results": [entry, entry], "public_key_n": public_key.n, "thresholds": thresholds, "response_format": "indices"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["inside"] == [0]                                  # Only the 200 m geofence contains the user
+
+    data["thresholds"] = thresholds[:1]
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # One threshold per result is required
+
+
+# Test that one decrypted value is classified against several radii at once
+def test_submit_geofence_result_prop_rings(client):
+    encrypted_results = []
+    for value in (0.0, 2e-10, 1.0):                                              # 0 m, about 127 m and far away
+        encrypted_result = public_key.encrypt(value)
+        encrypted_results.append({"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent})
+    ring_thresholds = [1 - math.cos(1000 / 6371000), 1 - math.cos(100 / 6371000)]  # 1 km and 100 m, in any order
+
+    data = {"encrypted_results": encrypted_results, "public_key_n": public_key.n, "ring_thresholds": ring_thresholds, "response_format": "rings"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["rings"] == [0, 1, 2]                             # Inner ring, outer ring, outside both
+
+    data["ring_thresholds"] = [[ring_thresholds[1]], ring_thresholds, [ring_thresholds[0]]]  # Per-geofence radii
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.get_json()["rings"] == [0, 1, 1]                             # Ring indices follow each geofence's radii
+
+
+# Test that a polygon's cover circles are decided as one geofence
+def test_submit_geofence_result_prop_grouped_circles(client):
+    encrypted_results = []
+    for value in (1.0, 2e-10, 1.0, 1.0):                                         # Only the second circle contains the user
+        encrypted_result = public_key.encrypt(value)
+        encrypted_results.append({"ciphertext": encrypted_result.ciphertext(), "exponent": encrypted_result.exponent})
+    thresholds = [1 - math.cos(200 / 6371000)] * 4
+
+    data = {"encrypted_results": encrypted_results, "public_key_n": public_key.n, "thresholds": thresholds, "groups": [0, 3]}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert [r["status"] for r in response.get_json()["results"]] == ["inside", "outside"]  # One decision per polygon
+
+    data["groups"] = [1, 3]
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Groups must start at the first result
+
+
+# Test that the safe interval hint follows the distance to the nearest boundary
+def test_submit_geofence_result_prop_query_interval(client):
+    far = public_key.encrypt(1e-6)                                               # About 9 km from the geofence centre
+    near = public_key.encrypt(2e-10)                                             # About 127 m, 27 m outside a 100 m radius
+    thresholds = [1 - math.cos(100 / 6371000)]
+
+    data = {"encrypted_results": [{"ciphertext": far.ciphertext(), "exponent": far.exponent}],
+            "public_key_n": public_key.n, "thresholds": thresholds, "max_speed": 10, "response_format": "indices"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["next_query_in"] == 300                           # 9 km at 10 m/s lands in the longest bucket
+
+    data["encrypted_results"].append({"ciphertext": near.ciphertext(), "exponent": near.exponent})
+    data["thresholds"] = thresholds * 2
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.get_json()["next_query_in"] == 0                             # The nearby boundary takes under 3 s to reach
+
+    data["max_speed"] = -1
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Speeds must be positive
+
+
+# Test that batches of raw ciphertexts under one exponent decide like the legacy per-result format
+def test_submit_geofence_result_prop_encrypted_batch(client):
+    negative, inside, outside = public_key.encrypt(-0.5), public_key.encrypt(1e-10), public_key.encrypt(1e-6)
+    exponent = min(value.exponent for value in (negative, inside, outside))
+    ciphertexts = [value.decrease_exponent_to(exponent).ciphertext() for value in (negative, inside, outside)]
+
+    data = {"encrypted_batch": {"ciphertexts": ciphertexts, "exponent": exponent}, "public_key_n": public_key.n,
+            "thresholds": [1 - math.cos(100 / 6371000)] * 3, "response_format": "indices"}
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 200                                           # Check if the response status code is OK
+    assert response.get_json()["inside"] == [0, 1]                               # Negative values decode as negative
+
+    data["encrypted_batch"]["ciphertexts"][2] = public_key.nsquare
+    response = client.post("/submit-geofence-result-prop", data=json.dumps(data), content_type="application/json")
+    assert response.status_code == 400                                           # Ciphertexts must lie below n^2
+
+
+# Test that fast encryption mode publishes a stable hs whose short powers encrypt decryptable ciphertexts
+@patch("src.app.FAST_ENCRYPTION", True)
+def test_get_public_key_fast_encryption(client):
+    data = client.get("/get-public-key").get_json()
+    assert data["short_exponent_bits"] == 256                                    # Confirm the exponent length is published
+    assert client.get("/get-public-key").get_json()["hs"] == data["hs"]          # Confirm hs is derived per key, not per request
+
+    n, hs = data["public_key_n"], data["hs"]
+    encoding = paillier.EncodedNumber.encode(public_key, 0.125)
+    ciphertext = (n * encoding.encoding + 1) * pow(hs, 2 ** 255 + 12345, n * n) % (n * n)
+    assert private_key.decrypt(paillier.EncryptedNumber(public_key, ciphertext, encoding.exponent)) == 0.125
+
+
+# Test that the public key reports its profile and the measured cost of that profile
+@patch("src.app.cost_model", {"standard": {"request_ms": 1870.5}})
+def test_get_public_key_profile_cost_model(client):
+    profile = client.get("/get-public-key").get_json()["key_profile"]
+    assert profile["key_size"] == public_key.n.bit_length()                      # The profile follows the key's actual size
+    assert profile["name"] == "standard" and profile["security_bits"] == 128     # Confirm the default profile
+    assert profile["cost"] == {"request_ms": 1870.5}                             # Confirm the measured cost is reported
@@ -1,14 +1,31 @@
 from phe import paillier
+import base64
 import requests
 import math
 import time
 import threading
 import csv
 import sys
+import os
+# The modules shared by every backend live in the repository's shared directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
 from metrics_logger import log_metrics, get_cpu_ram, get_ciphertext_size, compute_classification_metrics
+from fast_paillier import ShortExponentPublicKey
 
 # Global variable to store paillier public key
 public_key_n = None
+# End-to-end time budget for one request, propagated to the services as a deadline
+REQUEST_TIMEOUT = 30  # seconds
+# Decision shape requested from the services, only geofence 0 is checked so the first hit is enough
+RESPONSE_FORMAT = "first"
+# Geofence classes to check (e.g. ["amenity=cafe"] or ["depot"]), None checks the whole catalog
+GEOFENCE_TAGS = None
+# Fastest the device moves in m/s, the key authority turns it into a safe interval before the next report
+MAX_SPEED = 40
+# Seconds between periodic reports while the services give no interval hint
+DEFAULT_REPORT_INTERVAL = 10
+# Interval hint from the last response, in seconds
+next_report_in = None
 
 def get_key_authority_public_key():
     global public_key_n
@@ -17,6 +34,9 @@ def get_key_authority_public_key():
         response.raise_for_status()
         data = response.json()
         public_key_n = data.get('public_key_n')
+        # Key authorities in fast encryption mode publish hs, its window tables are built once per key here
+        if data.get('hs') is not None:
+            return ShortExponentPublicKey(public_key_n, data['hs'], data['short_exponent_bits'])
         public_key = paillier.PaillierPublicKey(public_key_n)
         return public_key
     except requests.exceptions.RequestException as e:
@@ -44,7 +64,38 @@ def is_inside_geofence_plaintext(user_latitude, user_longitude, geofence_center_
     distance = R * c
     return "inside" if distance < radius_m else "outside"
 
+def geofence_decision(result, idx):
+    # Reads one geofence's decision straight from the compact response shapes
+    if idx in result.get("unknown", []):
+        return "unknown"
+    if "geofence_indices" in result:
+        # Tag-filtered responses only hold the selected geofences, positioned by their catalog index
+        if idx not in result["geofence_indices"]:
+            return "unknown"
+        idx = result["geofence_indices"].index(idx)
+    response_format = result.get("format", "list")
+    if response_format == "bitmap":
+        bitmap = base64.b64decode(result["bitmap"])
+        return "inside" if bitmap[idx >> 3] & (0x80 >> (idx & 7)) else "outside"
+    if response_format == "indices":
+        return "inside" if idx in result["inside"] else "outside"
+    if response_format == "first":
+        first_inside = result["first_inside"]
+        if first_inside is not None and first_inside < idx:
+            return "unknown"
+        return "inside" if first_inside == idx else "outside"
+    if response_format == "rings":
+        ring = result["rings"][idx]
+        return "unknown" if ring is None else ("inside" if ring == 0 else "outside")
+    if response_format == "any":
+        if result["first_match"] == idx:
+            return "inside"
+        return "unknown" if result["match"] else "outside"
+    return result["results"][idx]["status"]
+
 def send_encrypted_location_to_geofencing_service(c1, c2, c3, request_id, plaintext_decision):
+    global next_report_in
+    next_report_in = None
     t_start = time.time()
     cpu_start, ram_start = get_cpu_ram()
     encryption_start = time.time()
@@ -65,18 +116,25 @@ def send_encrypted_location_to_geofencing_service(c1, c2, c3, request_id, plaint
                 "c3_ct": c3_ct, "c3_exp": c3_exp
             },
             "public_key_n": public_key_n,
+            "response_format": RESPONSE_FORMAT,
+            "max_speed": MAX_SPEED
         }
+        if GEOFENCE_TAGS is not None:
+            payload["tags"] = GEOFENCE_TAGS
         import json
         response = requests.post(
             'http://localhost:5001/submit-mobile-node-location-prop',
-            json=payload
+            json=payload,
+            headers={"X-Deadline-Ms": str(REQUEST_TIMEOUT * 1000)},
+            timeout=REQUEST_TIMEOUT
         )
         payload_size = len(json.dumps(payload))
         response.raise_for_status()
         result = response.json()
         encrypted_decision = None
-        if "results" in result:
-            encrypted_decision = result["results"][0]["status"]
+        if result.get("status") == "success":
+            encrypted_decision = geofence_decision(result, 0)
+            next_report_in = result.get("next_query_in")
         else:
             encrypted_decision = "unknown"
     except Exception as e:
@@ -92,7 +150,7 @@ def send_encrypted_location_to_geofencing_service(c1, c2, c3, request_id, plaint
         [
             "scheme", "request_id", "correct", "plaintext_decision", "encrypted_decision",
             "encryption_time", "decryption_time", "total_time", "cpu_start", "cpu_end", "ram_start", "ram_end",
-            "ciphertext_size", "payload_size"
+            "ciphertext_size", "payload_size", "next_query_in"
         ],
         {
             "scheme": "Paillier-baseline",
@@ -108,11 +166,26 @@ def send_encrypted_location_to_geofencing_service(c1, c2, c3, request_id, plaint
             "ram_start": ram_start,
             "ram_end": ram_end,
             "ciphertext_size": ciphertext_size,
-            "payload_size": payload_size
+            "payload_size": payload_size,
+            "next_query_in": next_report_in
         }
     )
     return encrypted_decision
 
+def periodic_reporting(track, public_key):
+    # Reports each position of the track at the pace the services suggest: a device far from every
+    # boundary waits until it could first reach one instead of querying at a fixed rate
+    geofence_center_lat = math.radians(51.573037)
+    geofence_center_lon = math.radians(-9.724087)
+    radius_m = 1000  # 1 km
+    for request_id, (user_latitude, user_longitude) in enumerate(track):
+        plaintext_decision = is_inside_geofence_plaintext(user_latitude, user_longitude, geofence_center_lat, geofence_center_lon, radius_m)
+        user_location_terms = compute_and_encrypt_user_location_terms(user_latitude, user_longitude, public_key)
+        send_encrypted_location_to_geofencing_service(*user_location_terms, request_id, plaintext_decision)
+        interval = DEFAULT_REPORT_INTERVAL if next_report_in is None else next_report_in
+        print(f"Next report in {interval} s")
+        time.sleep(interval)
+
 def scalability_experiment(user_location_terms, num_requests):
     geofence_center_lat = math.radians(51.573037)
     geofence_center_lon = math.radians(-9.724087)
@@ -0,0 +1,50 @@
+import secrets
+from phe import paillier
+
+# Fast Paillier encryption (Damgard-Jurik-Nielsen): with hs = h^n mod n^2 for h = -x^2 mod n, the obfuscator r^n
+# of a fresh encryption is replaced by hs^alpha for a short random alpha. Ciphertexts stay ordinary Paillier
+# ciphertexts, so the Geofencing evaluation and the key authority's decryption are unchanged.
+WINDOW_BITS = 6  # Bits of alpha per table row, every row costs one multiplication per encryption
+
+def short_exponent_base(public_key):
+    # For keys generated locally, the key authority publishes hs for its own keys
+    x = secrets.randbelow(public_key.n - 1) + 1
+    return pow(-x * x % public_key.n, public_key.n, public_key.nsquare)
+
+class ShortExponentPublicKey(paillier.PaillierPublicKey):
+    def __init__(self, n, hs, exponent_bits):
+        super().__init__(n)
+        self.hs = hs
+        self.exponent_bits = exponent_bits
+        # Fixed-base table: row i holds hs^(d * 2^(WINDOW_BITS * i)) for every digit d of a window
+        self.table = []
+        base = hs
+        for _ in range(-(-exponent_bits // WINDOW_BITS)):
+            row = [1, base]
+            for _ in range(2, 1 << WINDOW_BITS):
+                row.append(row[-1] * base % self.nsquare)
+            self.table.append(row)
+            base = row[-1] * base % self.nsquare
+
+    def short_obfuscator(self):
+        alpha = secrets.randbits(self.exponent_bits)
+        obfuscator = 1
+        for row in self.table:
+            digit = alpha & ((1 << WINDOW_BITS) - 1)
+            if digit:
+                obfuscator = obfuscator * row[digit] % self.nsquare
+            alpha >>= WINDOW_BITS
+        return obfuscator
+
+    def raw_encrypt(self, plaintext, r_value=None):
+        if r_value is not None:
+            return super().raw_encrypt(plaintext, r_value)
+        return super().raw_encrypt(plaintext, 1) * self.short_obfuscator() % self.nsquare
+
+    def encrypt_encoded(self, encoding, r_value):
+        if r_value is not None:
+            return super().encrypt_encoded(encoding, r_value)
+        encrypted_number = paillier.EncryptedNumber(self, self.raw_encrypt(encoding.encoding), encoding.exponent)
+        # phe has no public way to mark a number as obfuscated, without it ciphertext() would add a full r^n again
+        encrypted_number._EncryptedNumber__is_obfuscated = True
+        return encrypted_number
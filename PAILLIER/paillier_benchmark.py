@@ -0,0 +1,20 @@
+from phe import paillier
+from fast_paillier import ShortExponentPublicKey, short_exponent_base
+from paillier_engine import PaillierEngine
+from geofence_engine import location_terms
+from profile_benchmark import main
+
+# Measure every Paillier key profile with the shared benchmark (shared/profile_benchmark.py) and write the cost model
+# the key authority reports per profile, next to the fast (short exponent) client encryption
+def generate_keypair(n_length):
+    return paillier.generate_paillier_keypair(n_length=n_length)
+
+def fast_encryption(public_key, profile):
+    short_exponent_bits = 2 * profile["security_bits"]
+    fast_public_key = ShortExponentPublicKey(public_key.n, short_exponent_base(public_key), short_exponent_bits)
+    return {"short_exponent_bits": short_exponent_bits}, {
+        "fast_encryption": lambda lat, lon: [fast_public_key.encrypt(value) for value in location_terms(lat, lon)]
+    }
+
+if __name__ == "__main__":
+    main("Paillier", PaillierEngine, generate_keypair, "paillier_cost_model.json", fast_encryption)
@@ -0,0 +1,39 @@
+import os
+import sys
+from phe.util import powmod
+
+# The modules shared by every backend live in the repository's shared directory, the Docker images copy them beside this file
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "shared"))
+from geofence_engine import KEY_PROFILES, AdditiveEngine, CiphertextBatch, SCHEMES
+
+# Backend engine for both schemes under Paillier, with the interface and the evaluation of shared/geofence_engine.py.
+# Ciphertexts live mod n^2, the constant terms are encrypted as (1 + n * m) mod n^2 and results re-randomized by r^n.
+class PaillierEngine(AdditiveEngine):
+    name = "paillier"
+    modulus_name = "n^2"
+
+    @staticmethod
+    def ciphertext_modulus(public_key):
+        return public_key.nsquare
+
+    @staticmethod
+    def random_factor(public_key):
+        return powmod(public_key.get_random_lt_n(), public_key.n, public_key.nsquare)
+
+    def encrypt_exact(self, mantissa):
+        return (1 + self.public_key.n * mantissa) % self.modulus
+
+    def encrypt_terms(self, lat, lon, scheme="prop"):
+        # Every term keeps the exponent phe encodes it at, evaluation aligns them
+        terms = [self.public_key.encrypt(value) for value in SCHEMES[scheme][1](lat, lon)]
+        return CiphertextBatch(self.public_key, [term.ciphertext(False) for term in terms], [term.exponent for term in terms])
+
+    def signed_plaintext(self, ciphertext):
+        # Decodes like phe's EncodedNumber: encodings above max_int are negative, the middle third is an overflow
+        n, max_int = self.public_key.n, self.public_key.max_int
+        mantissa = self.private_key.raw_decrypt(ciphertext)
+        if mantissa > max_int:
+            if mantissa < n - max_int:
+                raise OverflowError("Overflow detected in decrypted number")
+            mantissa -= n
+        return mantissa
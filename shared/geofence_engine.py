@@ -0,0 +1,183 @@
+import math
+
+# What every backend engine shares. The backends offer the same interface, so the client, the Geofencing service,
+# the key authority and the experiment scripts share one implementation per scheme:
+#   encrypt_terms(lat, lon)                     client: the encrypted user terms
+#   evaluate_many(users, fences, checkpoint)    Geofencing: the intermediate value 1 - cos(d/R) per user and geofence
+#   serialize_batch(batch)                      Geofencing: one user's results in the key authority's wire format
+#   decrypt_classify_batch(batch, thresholds)   key authority: decrypted values and their inside decisions
+# plus the matching term_fields/serialize_terms/deserialize_terms, deserialize_batch and decrypt_batch.
+# checkpoint is called with the stage name every checkpoint_chunk values, the services pass their deadline check.
+# The term methods and evaluate_many take the scheme: "prop" (three terms, 1 - c1 * f1 - c2 * f2 - c3 * f3) or
+# "ref" (the reference scheme's six A terms, sum of A_i * B_i with the fences' precomputed B terms).
+# Backends: PAILLIER/paillier_engine.py and OKAMOTO-UCHIYAMA/ou_engine.py on AdditiveEngine below, CKKS/ckks_engine.py.
+
+def location_terms(lat, lon):
+    # The user terms, and with a geofence centre the coefficients of its geofence
+    return (math.sin(lat), math.cos(lat) * math.cos(lon), math.cos(lat) * math.sin(lon))
+
+def reference_user_terms(lat, lon):
+    # The reference scheme's A terms, in the order of REFERENCE_TERMS
+    alpha, gamma, zeta = math.cos(lat / 2), math.sin(lat / 2), math.cos(lat)
+    theta, mu = math.sin(lon / 2), math.cos(lon / 2)
+    return (alpha ** 2, alpha * gamma, gamma ** 2, zeta * theta ** 2, zeta * theta * mu, zeta * mu ** 2)
+
+def reference_center_terms(lat, lon, factor=1.0):
+    # The B terms of a geofence centre with the -2 of the cross terms folded in, so the sum of A_i * B_i is the
+    # haversine a = sin^2(dlat/2) + cos(lat_u) cos(lat_c) sin^2(dlon/2). factor=2 gives 2a = 1 - cos(d/R).
+    beta, delta, eta = math.sin(lat / 2), math.cos(lat / 2), math.cos(lat)
+    lambda_, nu = math.cos(lon / 2), math.sin(lon / 2)
+    return (factor * beta ** 2, -2 * factor * beta * delta, factor * delta ** 2,
+            factor * eta * lambda_ ** 2, -2 * factor * eta * lambda_ * nu, factor * eta * nu ** 2)
+
+# Wire names and plaintext terms of each scheme's user terms
+REFERENCE_TERMS = ("alpha_sq", "alpha_gamma_product_A", "gamma_sq", "zeta_theta_sq_product_A", "zeta_theta_mu_product_A", "zeta_mu_sq_product_A")
+SCHEMES = {
+    "prop": (("c1", "c2", "c3"), location_terms),
+    "ref": (REFERENCE_TERMS, reference_user_terms)
+}
+
+ENCODING_BASE = 16          # phe's EncodedNumber.BASE, the integer backends encode every value as mantissa * 16^exponent
+TERM_EXPONENT = -14         # Exponent user terms are encoded at when the backend does not pick one per value
+COEFFICIENT_EXPONENT = -14  # Exponent the geofence coefficients are encoded at, 2^-56 is below float64 resolution on [-1, 1]
+
+# Batches of integer ciphertexts are kept as raw ints under one key, instead of an object per value
+class CiphertextBatch:
+    __slots__ = ("public_key", "ciphertexts", "exponent")
+
+    def __init__(self, public_key, ciphertexts, exponent):
+        self.public_key = public_key
+        self.ciphertexts = ciphertexts
+        self.exponent = exponent  # One base-16 exponent for the batch, or a list with one per ciphertext
+
+    def __len__(self):
+        return len(self.ciphertexts)
+
+    def __getitem__(self, window):
+        exponent = self.exponent if isinstance(self.exponent, int) else self.exponent[window]
+        return CiphertextBatch(self.public_key, self.ciphertexts[window], exponent)
+
+    def exponents(self):
+        return [self.exponent] * len(self.ciphertexts) if isinstance(self.exponent, int) else self.exponent
+
+# Key profiles of the integer backends, selectable with PAILLIER_KEY_PROFILE and OU_KEY_PROFILE, with their approximate
+# security level (NIST SP 800-57). Both backends use the same sizes so their cost models compare directly. The key
+# authorities generate keys of the selected profile, paillier_benchmark.py and ou_benchmark.py measure every one.
+KEY_PROFILES = {
+    "compact": {"key_size": 2048, "security_bits": 112},
+    "standard": {"key_size": 3072, "security_bits": 128},
+    "high": {"key_size": 4096, "security_bits": 152}
+}
+
+class AdditiveEngine:
+    # Evaluation, batching and decryption of the integer backends, whose ciphertexts multiply to add their plaintexts.
+    # A backend names its ciphertext modulus and supplies ciphertext_modulus, random_factor (a re-randomization
+    # factor), encrypt_exact (an encryption without randomness) and signed_plaintext (a decrypted signed mantissa).
+    name = None
+    modulus_name = None
+
+    def __init__(self, public_key, private_key=None, obfuscators=None, checkpoint_chunk=50):
+        self.public_key = public_key
+        self.private_key = private_key
+        self.modulus = self.ciphertext_modulus(public_key)
+        # Source of re-randomization factors, e.g. a precomputed pool, by default computed inline
+        self.obfuscators = obfuscators or self.inline_obfuscators
+        self.checkpoint_chunk = checkpoint_chunk
+
+    def inline_obfuscators(self, count):
+        return [self.random_factor(self.public_key) for _ in range(count)]
+
+    def encrypt_terms(self, lat, lon, scheme="prop"):
+        mantissas = [round(value * ENCODING_BASE ** -TERM_EXPONENT) for value in SCHEMES[scheme][1](lat, lon)]
+        factors = self.obfuscators(len(mantissas))
+        return CiphertextBatch(self.public_key, [self.encrypt_exact(mantissa) * factor % self.modulus
+                                                 for mantissa, factor in zip(mantissas, factors)], TERM_EXPONENT)
+
+    def term_fields(self, scheme="prop"):
+        return [f"{name}_{field}" for name in SCHEMES[scheme][0] for field in ("ct", "exp")]
+
+    def serialize_terms(self, terms, scheme="prop"):
+        return {f"{name}_{field}": value for name, ciphertext, exponent in zip(SCHEMES[scheme][0], terms.ciphertexts, terms.exponents())
+                for field, value in (("ct", ciphertext), ("exp", exponent))}
+
+    def deserialize_terms(self, user_location_data, scheme="prop"):
+        missing_keys = [key for key in self.term_fields(scheme) if key not in user_location_data]
+        if missing_keys:
+            raise ValueError(f"Missing required keys in 'user_encrypted_location': {', '.join(missing_keys)}")
+        terms = [(user_location_data[f'{name}_ct'], user_location_data[f'{name}_exp']) for name in SCHEMES[scheme][0]]
+        if not all(isinstance(ciphertext, int) and 0 < ciphertext < self.modulus and isinstance(exponent, int) for ciphertext, exponent in terms):
+            raise ValueError(f"Encrypted location terms must be ciphertexts below {self.modulus_name} with integer exponents")
+        return self.align(CiphertextBatch(self.public_key, [ciphertext for ciphertext, _ in terms], [exponent for _, exponent in terms]))
+
+    def align(self, terms):
+        # Terms are brought to one exponent once per user, so no evaluation step has to align exponents
+        if isinstance(terms.exponent, int):
+            return terms
+        exponent = min(0, *terms.exponent)
+        ciphertexts = [pow(ciphertext, ENCODING_BASE ** (term_exponent - exponent), self.modulus)
+                       for ciphertext, term_exponent in zip(terms.ciphertexts, terms.exponent)]
+        return CiphertextBatch(terms.public_key, ciphertexts, exponent)
+
+    def evaluate_many(self, users, fences, checkpoint=None, scheme="prop"):
+        # A constant plus scalar multiples of the terms on the raw ciphertexts: a positive scalar is a power of the term,
+        # a negative one a power of its inverse, and the constant an encryption without randomness. The fence scalars
+        # are encoded once for all users, and every finished result is re-randomized once so it cannot be linked to
+        # the user terms. prop subtracts the centre terms from 1, ref adds up the precomputed B terms.
+        modulus = self.modulus
+        scale = ENCODING_BASE ** -COEFFICIENT_EXPONENT
+        constant, sign = (1, -1) if scheme == "prop" else (0, 1)
+        fence_mantissas = [[sign * round(coefficient * scale) for coefficient in fence] for fence in fences]
+        batches = []
+        for terms in users:
+            terms = self.align(terms)
+            inverses = [pow(ciphertext, -1, modulus) for ciphertext in terms.ciphertexts]
+            exponent = terms.exponent + COEFFICIENT_EXPONENT
+            start = self.encrypt_exact(constant * ENCODING_BASE ** -exponent)
+            results = []
+            for idx, mantissas in enumerate(fence_mantissas):
+                if checkpoint and idx % self.checkpoint_chunk == 0:
+                    checkpoint("evaluation")
+                value = start
+                for ciphertext, inverse, mantissa in zip(terms.ciphertexts, inverses, mantissas):
+                    if mantissa > 0:
+                        value = value * pow(ciphertext, mantissa, modulus) % modulus
+                    elif mantissa < 0:
+                        value = value * pow(inverse, -mantissa, modulus) % modulus
+                results.append(value)
+            factors = self.obfuscators(len(results))
+            batches.append(CiphertextBatch(self.public_key, [value * factor % modulus for value, factor in zip(results, factors)], exponent))
+        return batches
+
+    def serialize_batch(self, batch):
+        return {"ciphertexts": batch.ciphertexts, "exponent": batch.exponent}
+
+    def deserialize_batch(self, data):
+        # Raw ciphertext ints sharing one exponent ("encrypted_batch"), or the legacy "encrypted_results" format
+        # where every result carries its own exponent
+        if 'encrypted_batch' in data:
+            ciphertexts = data['encrypted_batch']['ciphertexts']
+            exponent = data['encrypted_batch'].get('exponent')
+            exponents = [exponent]
+        else:
+            ciphertexts = [entry.get("ciphertext") for entry in data['encrypted_results']]
+            exponents = exponent = [entry.get("exponent") for entry in data['encrypted_results']]
+        if any(value is None for value in ciphertexts + exponents):
+            raise ValueError("Missing ciphertext or exponent in encrypted result entry")
+        if not all(isinstance(value, int) for value in exponents):
+            raise ValueError("Exponents must be integers")
+        if not all(isinstance(value, int) and 0 < value < self.modulus for value in ciphertexts):
+            raise ValueError(f"Ciphertexts must be integers below {self.modulus_name}")
+        return CiphertextBatch(self.public_key, ciphertexts, exponent)
+
+    def decrypt_batch(self, batch, checkpoint=None):
+        values = []
+        for idx, (ciphertext, exponent) in enumerate(zip(batch.ciphertexts, batch.exponents())):
+            if checkpoint and idx % self.checkpoint_chunk == 0:
+                checkpoint("decryption")
+            values.append(self.signed_plaintext(ciphertext) * pow(ENCODING_BASE, exponent))
+        return values
+
+    def decrypt_classify_batch(self, batch, thresholds, checkpoint=None):
+        # Inside when 1 - cos(d/R) lies within the geofence's threshold 1 - cos(r/R)
+        values = self.decrypt_batch(batch, checkpoint)
+        return values, [value <= threshold for value, threshold in zip(values, thresholds)]
@@ -0,0 +1,1074 @@
+from flask import Flask, g, jsonify, request
+import base64
+import hashlib
+import json
+import requests
+import overpass
+import math
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import os
+import tempfile
+import threading
+from geofence_engine import location_terms, reference_center_terms
+from service_common import (DEADLINE_CHECK_CHUNK, RESPONSE_FORMATS, admin_authorized, admission_controlled, admission_controller,
+                            check_deadline, deadline_bounded, deadline_headers, deadline_lock, deadline_stats, encode_decisions,
+                            remaining_budget)
+
+# The Geofencing service of every backend: the key authority pool, the catalog, sharding and the result cache, with
+# the admission control and deadlines of service_common.py. A backend's app.py adds its location routes (serve_keyed_locations for the
+# integer backends) and starts the catalog with start_catalog().
+app = Flask(__name__)
+
+backend_stats = {}  # Sections a backend adds to /service-stats, name -> function returning the section
+
+@app.route("/service-stats", methods=['GET'])
+def get_service_stats():
+    with deadline_lock:
+        expired = dict(deadline_stats)
+    return jsonify({
+        "admission": admission_controller.snapshot(),
+        "deadline_expired": expired,
+        "key_authority": key_authority_pool.snapshot(),
+        "key_cache": current_key.summary(),
+        "shards": shard_stats,
+        "any_match": catalog.hit_order.summary(),
+        "catalog": {**catalog.summary(), **catalog_stats},
+        "result_cache": result_cache.summary(),
+        **{name: section() for name, section in backend_stats.items()}
+    })
+
+# Key authority replicas (comma separated), balanced by least outstanding requests with hedged duplicates
+KEY_AUTHORITY_URLS = os.environ.get("KEY_AUTHORITY_URLS", "http://keyauthority:5002").split(",")
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))       # Latency percentile after which a duplicate is sent
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))       # Latency samples needed before the percentile is trusted
+HEDGE_DEFAULT_DELAY = float(os.environ.get("HEDGE_DEFAULT_DELAY", "2"))  # Seconds to wait for a reply before enough samples exist
+
+class KeyAuthorityPool:
+    def __init__(self, urls):
+        self.urls = [url.strip().rstrip("/") for url in urls if url.strip()]
+        self.outstanding = {url: 0 for url in self.urls}
+        self.latencies = deque(maxlen=500)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=8 * max(len(self.urls), 1))
+        self.stats = {"requests": 0, "hedges_sent": 0, "hedges_won": 0, "failovers": 0, "failures": 0}
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _pick(self, exclude):
+        with self.lock:
+            candidates = [url for url in self.urls if url not in exclude]
+            if not candidates:
+                return None
+            url = min(candidates, key=lambda u: self.outstanding[u])
+            self.outstanding[url] += 1
+            return url
+
+    def hedge_delay(self):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return samples[min(int(len(samples) * HEDGE_PERCENTILE / 100), len(samples) - 1)]
+
+    def _send(self, url, method, path, kwargs):
+        start = time.monotonic()
+        try:
+            response = requests.request(method, f"{url}/{path}", **kwargs)
+            if response.status_code < 500:
+                with self.lock:
+                    self.latencies.append(time.monotonic() - start)
+            return response
+        finally:
+            with self.lock:
+                self.outstanding[url] -= 1
+
+    def request(self, method, path, timeout=None, **kwargs):
+        if not self.urls:
+            raise requests.exceptions.InvalidURL("No key authority configured, set KEY_AUTHORITY_URLS")
+        self._count("requests")
+        # An exhausted budget still sends once with the smallest timeout, requests rejects timeouts <= 0
+        timeout = None if timeout is None else max(timeout, 0.001)
+        kwargs["timeout"] = timeout
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        futures = {}
+
+        def launch():
+            url = self._pick(exclude=futures.values())
+            if url is None:
+                return None
+            future = self.executor.submit(self._send, url, method, path, kwargs)
+            futures[future] = url
+            return future
+
+        pending = {launch()}
+        primary = futures[next(iter(pending))]
+        hedged = False
+        last_response, last_error = None, None
+        while pending:
+            wait_for = None if give_up_at is None else max(give_up_at - time.monotonic(), 0)
+            if not hedged:
+                wait_for = self.hedge_delay() if wait_for is None else min(wait_for, self.hedge_delay())
+            done, pending = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+            if not done:
+                if hedged or (give_up_at is not None and time.monotonic() >= give_up_at):
+                    break
+                # Primary is slower than the recent tail latency, race one duplicate on another replica
+                hedged = True
+                hedge = launch()
+                if hedge is not None:
+                    self._count("hedges_sent")
+                    pending.add(hedge)
+                continue
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.exceptions.RequestException as e:
+                    last_error = e
+                else:
+                    # 504 means the deadline passed, another replica cannot do better
+                    if response.status_code < 500 or response.status_code == 504:
+                        if futures[future] != primary:
+                            self._count("hedges_won")
+                        return response
+                    last_response = response
+                # Replica failed, fail over to one that has not been tried yet
+                if not pending:
+                    failover = launch()
+                    if failover is not None:
+                        self._count("failovers")
+                        pending.add(failover)
+        self._count("failures")
+        if last_response is not None:
+            return last_response
+        raise last_error or requests.exceptions.Timeout("No key authority replica replied in time")
+
+    def snapshot(self):
+        hedge_delay = self.hedge_delay()
+        with self.lock:
+            return {"outstanding": dict(self.outstanding), "hedge_delay": hedge_delay, **self.stats}
+
+key_authority_pool = KeyAuthorityPool(KEY_AUTHORITY_URLS)
+
+# The key authority's current key (or the CKKS contexts it retains), trusted for KEY_CACHE_TTL seconds so a cached
+# result needs no key authority round trip. A client on a key the cached one does not match refreshes it at once,
+# so a rotation is seen by the first request under the new key and by every request after KEY_CACHE_TTL.
+KEY_CACHE_TTL = float(os.environ.get("KEY_CACHE_TTL", "5"))
+
+class KeyCache:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.value = None
+        self.expires = 0.0
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "fetches": 0}
+
+    def get(self, fetch, timeout, refresh=False):
+        # fetch(timeout=...) asks the key authority, a failure (None or an exception) is not cached
+        with self.lock:
+            if not refresh and self.value is not None and time.monotonic() < self.expires:
+                self.stats["hits"] += 1
+                return self.value
+            self.stats["fetches"] += 1
+        value = fetch(timeout=timeout)
+        if value is not None:
+            with self.lock:
+                self.value, self.expires = value, time.monotonic() + self.ttl
+        return value
+
+    def summary(self):
+        with self.lock:
+            return {"ttl": self.ttl, **self.stats}
+
+current_key = KeyCache(KEY_CACHE_TTL)
+
+
+# Geofence catalog: loaders fill a draft of per-circle lists, a Catalog derives everything requests read from it
+GEOFENCE_RADIUS = float(os.environ.get("GEOFENCE_RADIUS", "100"))  # Meters, for entries without their own radius
+EARTH_RADIUS = 6371000  # Approximate Earth radius in meters
+
+def new_catalog_draft():
+    # Per circle, except for the per-entry tags
+    return {"coordinates": [], "radii": [], "ring_radii": [], "cover_offsets": [], "owners": [], "tags": []}
+
+def feature_radius(feature):
+    # Catalog entries may carry their own radius in meters as a "radius" tag
+    try:
+        return float(feature.get('properties', {}).get('radius', GEOFENCE_RADIUS))
+    except (TypeError, ValueError):
+        return GEOFENCE_RADIUS
+
+def feature_ring_radii(feature, radius):
+    # Ring queries without client radii use the entry's "radii" tag (e.g. "100;1000"), or just its radius
+    try:
+        return sorted(float(r) for r in str(feature['properties']['radii']).split(";"))
+    except (KeyError, TypeError, ValueError):
+        return [radius]
+
+def feature_tags(feature):
+    # OSM key=value pairs (e.g. "amenity=cafe") plus the classes of a "class" tag (e.g. "depot;restricted")
+    properties = feature.get('properties') or {}
+    tags = {f"{key}={value}" for key, value in properties.items() if isinstance(value, str) and key != 'class'}
+    tags.update(name for name in str(properties.get('class', '')).split(";") if name)
+    return sorted(tags)
+
+GEOFENCE_CATALOG_FILE = os.environ.get("GEOFENCE_CATALOG_FILE")  # GeoJSON FeatureCollection loaded instead of the Overpass query
+COVER_TOLERANCE = float(os.environ.get("COVER_TOLERANCE", "25"))  # Meters a polygon's circle cover may reach beyond it
+
+def polygon_circle_cover(rings, tolerance):
+    # Quadtree over the polygon in local meters: a cell becomes the circle around it once that circle reaches at most
+    # `tolerance` beyond the polygon, cells missing the polygon are dropped. Interior cells stop splitting early, so
+    # the circle count grows with the perimeter over the tolerance rather than with the area.
+    if tolerance <= 0:
+        raise ValueError("The cover tolerance must be positive")
+    points = [point[:2] for ring in rings for point in ring]
+    lon0 = sum(lon for lon, _ in points) / len(points)
+    lat0 = sum(lat for _, lat in points) / len(points)
+    scale = math.cos(math.radians(lat0)) * EARTH_RADIUS
+    local_rings = [[(math.radians(lon - lon0) * scale, math.radians(lat - lat0) * EARTH_RADIUS) for lon, lat, *_ in ring] for ring in rings]
+    edges = [(ring[idx - 1], ring[idx]) for ring in local_rings for idx in range(len(ring))]
+
+    def signed_distance(x, y):
+        # Distance to the nearest edge, negative inside (even-odd rule, so holes and multipolygons work too)
+        inside = False
+        distance = math.inf
+        for (x1, y1), (x2, y2) in edges:
+            if (y1 > y) != (y2 > y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            dx, dy = x2 - x1, y2 - y1
+            t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy))) if dx or dy else 0.0
+            distance = min(distance, math.hypot(x - x1 - t * dx, y - y1 - t * dy))
+        return -distance if inside else distance
+
+    xs = [x for ring in local_rings for x, _ in ring]
+    ys = [y for ring in local_rings for _, y in ring]
+    cells = [((max(xs) + min(xs)) / 2, (max(ys) + min(ys)) / 2, max(max(xs) - min(xs), max(ys) - min(ys)) / 2)]
+    circles = []
+    while cells:
+        x, y, half = cells.pop()
+        radius = half * math.sqrt(2)
+        distance = signed_distance(x, y)
+        if distance > radius:
+            continue
+        if radius + distance <= tolerance:
+            circles.append((math.radians(lon0) + x / scale, math.radians(lat0) + y / EARTH_RADIUS, radius))
+            continue
+        half /= 2
+        cells.extend((x + sx * half, y + sy * half, half) for sx in (-1, 1) for sy in (-1, 1))
+    # Largest circles first: they are the likeliest hits when a polygon is decrypted in any-match order
+    return sorted(circles, key=lambda circle: -circle[2])
+
+def add_catalog_entry(draft, feature):
+    # A point is one circle and a polygon the circles of its cover, every circle remembers the entry owning it
+    geometry = feature['geometry']
+    owner = draft["owners"][-1] + 1 if draft["owners"] else 0
+    draft["tags"].append(feature_tags(feature))
+    if geometry['type'] == 'Point':
+        lon, lat = geometry['coordinates'][:2]
+        radius = feature_radius(feature)
+        draft["coordinates"].append([math.radians(round(lon, 6)), math.radians(round(lat, 6))])
+        draft["radii"].append(radius)
+        draft["ring_radii"].append(feature_ring_radii(feature, radius))
+        draft["cover_offsets"].append(0.0)
+        draft["owners"].append(owner)
+        return
+    if geometry['type'] == 'Polygon':
+        rings = geometry['coordinates']
+    elif geometry['type'] == 'MultiPolygon':
+        rings = [ring for polygon in geometry['coordinates'] for ring in polygon]
+    else:
+        raise ValueError(f"Unsupported geofence geometry '{geometry['type']}'")
+    # A polygon's "radii" tag holds distances beyond its boundary, by default the polygon itself
+    buffers = feature_ring_radii(feature, 0.0)
+    for lon, lat, radius in polygon_circle_cover(rings, COVER_TOLERANCE):
+        draft["coordinates"].append([lon, lat])
+        draft["radii"].append(radius)
+        draft["ring_radii"].append([radius + buffer for buffer in buffers])
+        draft["cover_offsets"].append(radius)
+        draft["owners"].append(owner)
+
+def load_catalog_file(draft, path):
+    with open(path) as f:
+        features = json.load(f)['features']
+    for feature in features:
+        add_catalog_entry(draft, feature)
+    print(f"Loaded {len(features)} geofences as {len(draft['coordinates'])} circles from {path}")
+    return draft
+
+RING_CACHE_SIZE = 64  # Distinct client radius sets whose thresholds each catalog keeps
+
+# Overpass source of catalogs without a GEOFENCE_CATALOG_FILE, set per service by start_catalog()
+overpass_source = {"timeout": 60000, "limit": 10000, "geofences": 10, "fallback": None}
+
+def get_geofence_coordinates():
+    draft = new_catalog_draft()
+    if GEOFENCE_CATALOG_FILE:
+        return load_catalog_file(draft, GEOFENCE_CATALOG_FILE)
+    api = overpass.API(timeout=overpass_source["timeout"])
+    query = f"""
+    node["amenity"="cafe"](50.0,-10.0,60.0,2.0);
+    out qt {overpass_source["limit"]};
+    """
+    try:
+        result = api.get(query)
+        num_coordinates = len(result['features'])
+        print(f"Total lon-lat pairs: {num_coordinates}")
+        count = 0
+        numGeofenceBoundaries = overpass_source["geofences"]
+        if num_coordinates < numGeofenceBoundaries:
+            raise ValueError(f"Insufficient coordinates: Found {num_coordinates}, but need at least {numGeofenceBoundaries}")
+        for feature in result['features']:
+            if count >= numGeofenceBoundaries:
+                break
+            lon, lat = feature['geometry']['coordinates']
+            print(f"longitude: {round(lon, 6)}, latitude: {round(lat, 6)}")
+            add_catalog_entry(draft, feature)
+            count += 1
+        print(f"Number of processed geofence coordinates: {len(draft['coordinates'])}")
+        print("Geofence coordinates fetched successfully.")
+        return draft
+    except Exception as e:
+        print(f"Failed to fetch geofence coordinates: {e.__class__.__name__}: {e}")
+        if overpass_source["fallback"] is None or catalog.coordinates:
+            raise  # A reload keeps the current catalog rather than falling back
+        # Fallback coordinates prevent startup delays
+        draft = new_catalog_draft()
+        for lon, lat in overpass_source["fallback"]:
+            add_catalog_entry(draft, {"geometry": {"type": "Point", "coordinates": [lon, lat]}, "properties": {"amenity": "cafe"}})
+        print(f"Using {len(draft['coordinates'])} fallback coordinates")
+        return draft
+
+# Scatter-gather sharding: each shard evaluates a slice of the catalog, a coordinator fans requests out and merges decisions
+GEOFENCE_SHARD_URLS = [url.strip().rstrip("/") for url in os.environ.get("GEOFENCE_SHARD_URLS", "").split(",") if url.strip()]
+GEOFENCE_SHARD_INDEX = int(os.environ.get("GEOFENCE_SHARD_INDEX", "0"))
+GEOFENCE_SHARD_COUNT = int(os.environ.get("GEOFENCE_SHARD_COUNT", "1"))
+SHARD_TIMEOUT = float(os.environ.get("SHARD_TIMEOUT", "10"))  # Max seconds the coordinator waits for the slowest shard
+
+shard_executor = ThreadPoolExecutor(max_workers=4 * max(len(GEOFENCE_SHARD_URLS), 1))
+shard_lock = threading.Lock()
+shard_stats = {"requests": 0, "partial": 0, "failed": 0, "shard_failures": {}}
+
+# Fence order for any-match queries: fences that produced hits recently (or most often) are evaluated and
+# decrypted first, so the key authority can stop after a handful of decryptions
+HIT_ORDER_POLICY = os.environ.get("HIT_ORDER_POLICY", "recency")  # "recency" or "popularity"
+
+class HitOrder:
+    def __init__(self, size, policy):
+        self.policy = policy
+        self.order = list(range(size))
+        self.hits = [0] * size
+        self.lock = threading.Lock()
+        self.stats = {"queries": 0, "matches": 0, "decrypted": 0}
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.order)
+
+    def record(self, first_match, decrypted):
+        with self.lock:
+            self.stats["queries"] += 1
+            self.stats["decrypted"] += decrypted
+            if first_match is None:
+                return
+            self.stats["matches"] += 1
+            self.hits[first_match] += 1
+            pos = self.order.index(first_match)
+            if self.policy == "recency":
+                self.order.insert(0, self.order.pop(pos))
+                return
+            while pos > 0 and self.hits[self.order[pos - 1]] < self.hits[first_match]:
+                self.order[pos - 1], self.order[pos] = self.order[pos], self.order[pos - 1]
+                pos -= 1
+
+    def summary(self):
+        with self.lock:
+            queries = self.stats["queries"]
+            return {"policy": self.policy, **self.stats, "decrypted_per_query": self.stats["decrypted"] / queries if queries else None}
+
+class Catalog:
+    # Everything requests read about the geofences, derived once from a loader draft off the request path.
+    # Never modified after construction: a reload builds a new Catalog and swaps the module reference.
+    def __init__(self, draft, source_signature=None):
+        self.source_signature = source_signature  # Catalog file state it was loaded from
+        self.size = draft["owners"][-1] + 1 if draft["owners"] else 0
+        # Round-robin partitioning keeps shards balanced when the catalog is ordered by region, a polygon's circles stay together
+        self.indices = [idx for idx in range(self.size) if idx % GEOFENCE_SHARD_COUNT == GEOFENCE_SHARD_INDEX]
+        local_entries = {entry: position for position, entry in enumerate(self.indices)}
+        circles = [idx for idx, owner in enumerate(draft["owners"]) if owner in local_entries]
+        self.coordinates = [draft["coordinates"][idx] for idx in circles]
+        self.radii = [draft["radii"][idx] for idx in circles]
+        self.thresholds = [1 - math.cos(radius / EARTH_RADIUS) for radius in self.radii]
+        self.ring_radii = [draft["ring_radii"][idx] for idx in circles]
+        self.ring_thresholds = [[1 - math.cos(radius / EARTH_RADIUS) for radius in radii] for radii in self.ring_radii]
+        self.cover_offsets = [draft["cover_offsets"][idx] for idx in circles]
+        self.owners = [local_entries[draft["owners"][idx]] for idx in circles]
+        self.groups = [idx for idx in range(len(circles)) if idx == 0 or self.owners[idx] != self.owners[idx - 1]] + [len(circles)]
+        # The center terms of the haversine dot product never change, so requests only multiply and add
+        self.coefficients = [location_terms(lat, lon) for lon, lat in self.coordinates]
+        # The reference scheme's B terms with its constants folded in, doubled so it yields the same 1 - cos(d/R)
+        self.ref_coefficients = [reference_center_terms(lat, lon, 2.0) for lon, lat in self.coordinates]
+        self.tags = [draft["tags"][idx] for idx in self.indices]
+        self.tag_index = {}
+        for entry, tags in enumerate(self.tags):
+            for tag in tags:
+                self.tag_index.setdefault(tag, []).append(entry)
+        self.hit_order = HitOrder(len(self.indices), HIT_ORDER_POLICY)
+        self.ring_threshold_cache = {}
+        self.ring_cache_lock = threading.Lock()
+        self.version = hashlib.sha256(json.dumps([self.indices, self.owners, self.coordinates, self.radii,
+                                                  self.ring_radii, self.tags]).encode("utf-8")).hexdigest()[:16]
+        if GEOFENCE_SHARD_COUNT > 1:
+            print(f"Shard {GEOFENCE_SHARD_INDEX + 1}/{GEOFENCE_SHARD_COUNT} holds {len(self.indices)} of {self.size} geofences")
+
+    def scheme_coefficients(self, scheme, circles):
+        table = self.coefficients if scheme == "prop" else self.ref_coefficients
+        return [table[idx] for idx in circles]
+
+    def get_ring_thresholds(self, radii, circles):
+        # Client radii apply to every geofence, otherwise each geofence's catalog radii are used
+        if radii is None:
+            return [self.ring_thresholds[idx] for idx in circles]
+        if not isinstance(radii, list) or not radii or not all(isinstance(r, (int, float)) and r > 0 for r in radii):
+            raise ValueError("'radii' must be a non-empty list of positive radii in meters")
+        key = tuple(sorted(radii))
+        with self.ring_cache_lock:
+            if key not in self.ring_threshold_cache:
+                if len(self.ring_threshold_cache) >= RING_CACHE_SIZE:
+                    self.ring_threshold_cache.pop(next(iter(self.ring_threshold_cache)))
+                if any(self.cover_offsets):
+                    # Radii around a polygon count from the edge of its cover circles
+                    self.ring_threshold_cache[key] = [[1 - math.cos((offset + radius) / EARTH_RADIUS) for radius in key] for offset in self.cover_offsets]
+                else:
+                    self.ring_threshold_cache[key] = [1 - math.cos(radius / EARTH_RADIUS) for radius in key]
+            thresholds = self.ring_threshold_cache[key]
+        return [thresholds[idx] for idx in circles] if any(self.cover_offsets) else thresholds
+
+    def select_entries(self, tags):
+        # Local entries carrying any of the requested tags, every entry when the request names none
+        if tags is None:
+            return list(range(len(self.indices)))
+        if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+            raise ValueError("'tags' must be a list of tag strings")
+        return sorted(set().union(*(self.tag_index.get(tag, ()) for tag in tags)))
+
+    def select_circles(self, entries):
+        # Coefficient slices of the given entries in that order, with the start of every entry's circles
+        circles, groups = [], []
+        for entry in entries:
+            groups.append(len(circles))
+            circles.extend(range(self.groups[entry], self.groups[entry + 1]))
+        return circles, groups
+
+    def plan_evaluation(self, entries, response_format):
+        # Circles to evaluate and the groups the key authority ORs per entry, omitted while every entry is one circle.
+        # Any-match queries follow the hit order and stop at the first inside circle, so they need no groups.
+        if response_format == "any":
+            selected = set(entries)
+            return self.select_circles([entry for entry in self.hit_order.snapshot() if entry in selected])[0], None
+        circles, groups = self.select_circles(entries)
+        return circles, groups if len(circles) > len(entries) else None
+
+    def resolve_any_match(self, keyauth_response, circles, entries):
+        # Maps the key authority's position in the submitted circle order back to the local catalog and learns from the hit
+        position = keyauth_response.pop("hit_position")
+        owner = None if position is None else self.owners[circles[position]]
+        self.hit_order.record(owner, keyauth_response.get("decrypted", 0))
+        # Like every other format, positions refer to the selected entries in catalog order
+        keyauth_response["first_match"] = None if owner is None else entries.index(owner)
+        keyauth_response["count"] = len(entries)
+        return keyauth_response
+
+    def response_fields(self, entries):
+        # The version a response was decided against, and for shards and tag-filtered queries where its
+        # decisions sit in the full catalog
+        fields = {"catalog_version": self.version}
+        if GEOFENCE_SHARD_COUNT > 1 or len(entries) != len(self.indices):
+            fields.update(geofence_indices=[self.indices[entry] for entry in entries], catalog_size=self.size)
+        return fields
+
+    def summary(self):
+        return {"version": self.version, "geofences": len(self.indices), "circles": len(self.coordinates)}
+
+# Opt-in result cache: a device resending the same ciphertexts (stationary devices cache them) is answered without
+# homomorphic or key authority work. Entries are keyed by the key, the catalog version, the ciphertexts and the query
+# options, so a rotated key or a changed catalog never matches an old entry.
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "0"))  # Responses kept, 0 disables the cache
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", "60"))  # Seconds a cached response is served
+
+class ResultCache:
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.key_id = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, key_id, catalog_version, data):
+        # Returns the request's cache key (its digest and key) and its cached response, both None while the cache is off
+        if not self.size:
+            return None, None
+        fields = {name: data.get(name) for name in ("user_encrypted_location", "response_format", "tags", "radii", "max_speed")}
+        digest = hashlib.sha256(json.dumps([str(key_id), catalog_version, fields], sort_keys=True).encode("utf-8")).hexdigest()
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None and entry[0] < time.monotonic():
+                del self.entries[digest]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return (digest, str(key_id)), None
+            self.entries.move_to_end(digest)
+            self.stats["hits"] += 1
+            return (digest, str(key_id)), entry[1]
+
+    def store(self, cache_key, response):
+        if cache_key is None:
+            return
+        digest, key_id = cache_key
+        with self.lock:
+            self.entries[digest] = (time.monotonic() + self.ttl, response, key_id)
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        # Entries of a replaced catalog can no longer match, dropping them frees the space
+        with self.lock:
+            self.entries.clear()
+
+    def observe_key(self, key_id):
+        # Responses under a rotated key must not outlive it
+        with self.lock:
+            if key_id != self.key_id:
+                if self.entries:
+                    self.stats["invalidations"] += 1
+                self.entries.clear()
+                self.key_id = key_id
+
+    def drop_key(self, key_id):
+        # For backends whose entries span several keys at once (the retained CKKS contexts): drops one retired key's
+        with self.lock:
+            stale = [digest for digest, entry in self.entries.items() if entry[2] == str(key_id)]
+            for digest in stale:
+                del self.entries[digest]
+            if stale:
+                self.stats["invalidations"] += 1
+
+    def summary(self):
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {"capacity": self.size, "ttl": self.ttl, "entries": len(self.entries), **self.stats,
+                    "hit_rate": self.stats["hits"] / lookups if lookups else None}
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+def decode_inside_indices(result):
+    response_format = result.get("format", "list")
+    if response_format == "bitmap":
+        bitmap = base64.b64decode(result["bitmap"])
+        return [idx for idx in range(result["count"]) if bitmap[idx >> 3] & (0x80 >> (idx & 7))]
+    if response_format == "indices":
+        return result["inside"]
+    if response_format == "first":
+        return [] if result["first_inside"] is None else [result["first_inside"]]
+    if response_format == "any":
+        return [] if result["first_match"] is None else [result["first_match"]]
+    return [idx for idx, decision in enumerate(result["results"]) if decision["status"] == "inside"]
+
+def empty_decisions(response_format):
+    # No geofence carries the requested tags, answered without any homomorphic or key authority work
+    if response_format == "list":
+        return {"status": "success", "results": []}
+    if response_format == "rings":
+        return {"status": "success", "format": "rings", "count": 0, "rings": []}
+    return {"status": "success", **encode_decisions([], 0, response_format)}
+
+def query_shard(url, path, payload, deadline):
+    response = requests.post(
+        f"{url}{path}",
+        json=payload,
+        headers=deadline_headers(deadline),
+        timeout=max(min(SHARD_TIMEOUT, remaining_budget(deadline)), 0.001)
+    )
+    response.raise_for_status()
+    result = response.json()
+    if "geofence_indices" not in result:
+        raise ValueError("Shard response has no indexed results")
+    return result
+
+def scatter_gather(path, payload, deadline):
+    futures = {shard_executor.submit(query_shard, url, path, payload, deadline): url for url in GEOFENCE_SHARD_URLS}
+    done, not_done = wait(futures, timeout=max(min(SHARD_TIMEOUT, remaining_budget(deadline)), 0))
+    failed_shards = [futures[future] for future in not_done]
+    response_format = payload.get("response_format", "list")
+    merged = {}
+    merged_size = 0
+    covered = set()
+    inside = []
+    hints = []
+    catalog_versions = {}
+    for future in done:
+        try:
+            result = future.result()
+        except Exception as e:
+            print(f"Geofencing shard {futures[future]} failed: {e}")
+            failed_shards.append(futures[future])
+            continue
+        merged_size = max(merged_size, result["catalog_size"])
+        covered.update(result["geofence_indices"])
+        catalog_versions[futures[future]] = result.get("catalog_version")
+        if "next_query_in" in result:
+            hints.append(result["next_query_in"])
+        if response_format == "list":
+            for idx, decision in zip(result["geofence_indices"], result["results"]):
+                merged[idx] = decision
+        elif response_format == "rings":
+            merged.update(zip(result["geofence_indices"], result["rings"]))
+        else:
+            # Shard positions map to the catalog in increasing order, so the merged first hit stays exact
+            inside.extend(result["geofence_indices"][idx] for idx in decode_inside_indices(result))
+    with shard_lock:
+        shard_stats["requests"] += 1
+        shard_stats["partial"] += 1 if failed_shards else 0
+        shard_stats["failed"] += 1 if len(failed_shards) == len(futures) else 0
+        for url in failed_shards:
+            shard_stats["shard_failures"][url] = shard_stats["shard_failures"].get(url, 0) + 1
+    if len(failed_shards) == len(futures):
+        check_deadline(deadline, "shards")
+        return jsonify({
+            "status": "error",
+            "message": "No geofencing shard returned a decision",
+            "failed_shards": failed_shards
+        }), 502
+    # Geofences held by a slow or failed shard stay unknown and the response is flagged as partial.
+    # Tag-filtered queries are answered over the geofences the shards selected, placed by "geofence_indices".
+    tagged = payload.get("tags") is not None
+    positions = sorted(covered) if tagged else list(range(merged_size))
+    placement = {"geofence_indices": positions, "catalog_size": merged_size} if tagged else {}
+    placement["catalog_versions"] = catalog_versions
+    if hints:
+        # The device may be close to a fence of a shard that did not answer, so a partial result gets the shortest hint
+        placement["next_query_in"] = 0 if failed_shards else min(hints)
+    if response_format == "rings":
+        return jsonify({
+            "status": "success",
+            "format": "rings",
+            "count": len(positions),
+            "rings": [merged.get(idx) for idx in positions],
+            **placement,
+            "partial": bool(failed_shards),
+            "failed_shards": failed_shards
+        }), 200
+    if response_format != "list":
+        position_of = {idx: position for position, idx in enumerate(positions)}
+        decisions = encode_decisions(sorted(position_of[idx] for idx in inside), len(positions), response_format)
+        if failed_shards and not tagged:
+            decisions["unknown"] = [idx for idx in range(merged_size) if idx not in covered]
+        return jsonify({
+            "status": "success",
+            **decisions,
+            **placement,
+            "partial": bool(failed_shards),
+            "failed_shards": failed_shards
+        }), 200
+    results = [merged.get(idx, {"status": "unknown"}) for idx in positions]
+    return jsonify({
+        "status": "success",
+        "results": results,
+        **placement,
+        "partial": bool(failed_shards),
+        "failed_shards": failed_shards
+    }), 200
+
+# Hot reload: POST /reload-catalog, or a change of GEOFENCE_CATALOG_FILE while watching, builds the new catalog and
+# swaps it in with one reference assignment. Requests read the catalog once and finish against that version.
+# A reload reaches every worker through CATALOG_STATE_DIR: the worker that loads a catalog publishes its draft there,
+# the others adopt it before their next request. Workers forked after --preload share the directory created at import,
+# services run as separate processes without --preload need CATALOG_STATE_DIR set to one directory for all of them.
+CATALOG_WATCH_INTERVAL = float(os.environ.get("CATALOG_WATCH_INTERVAL", "0"))  # Seconds between catalog file checks, 0 disables watching
+CATALOG_STATE_DIR = os.environ.get("CATALOG_STATE_DIR") or tempfile.mkdtemp(prefix="geofence-catalog-")
+catalog_reload_lock = threading.Lock()
+catalog_watcher_lock = threading.Lock()
+catalog_watcher_pid = None
+catalog_generation = None  # Published catalog this worker serves, as the state of the "current" pointer file
+catalog_stats = {"reloads": 0, "failed_reloads": 0, "adopted": 0}
+
+def catalog_source_signature():
+    try:
+        stat = os.stat(GEOFENCE_CATALOG_FILE)
+        return (stat.st_mtime_ns, stat.st_size)
+    except (TypeError, OSError):
+        return None
+
+def published_generation():
+    # Every publication replaces the pointer file, so its inode and mtime change
+    try:
+        stat = os.stat(os.path.join(CATALOG_STATE_DIR, "current"))
+        return (stat.st_ino, stat.st_mtime_ns)
+    except OSError:
+        return None
+
+def publish_catalog(draft, signature):
+    # Files are written aside and renamed into place, so no worker reads a partial catalog
+    name = f"catalog-{time.time_ns()}-{os.getpid()}.json"
+    for path, data in ((name, json.dumps({"draft": draft, "source_signature": signature})), ("current", name)):
+        temp_path = os.path.join(CATALOG_STATE_DIR, f".{path}.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(CATALOG_STATE_DIR, path))
+    for old in os.listdir(CATALOG_STATE_DIR):
+        if old.startswith("catalog-") and old != name:
+            try:
+                os.remove(os.path.join(CATALOG_STATE_DIR, old))
+            except OSError:
+                pass
+    return published_generation()
+
+def swap_catalog(new_catalog, generation):
+    global catalog, catalog_generation
+    catalog = new_catalog
+    catalog_generation = generation
+    result_cache.clear()
+
+def reload_catalog():
+    with catalog_reload_lock:
+        signature = catalog_source_signature()
+        try:
+            draft = get_geofence_coordinates()
+            new_catalog = Catalog(draft, signature)
+            generation = publish_catalog(draft, signature)
+        except Exception:
+            catalog_stats["failed_reloads"] += 1
+            raise
+        swap_catalog(new_catalog, generation)
+        catalog_stats["reloads"] += 1
+    print(f"Catalog version {new_catalog.version}: {len(new_catalog.indices)} geofences as {len(new_catalog.coordinates)} circles")
+    return new_catalog
+
+@app.before_request
+def adopt_published_catalog():
+    # Picks up catalogs loaded by other workers, a failed read is retried on the next request
+    generation = published_generation()
+    if generation is None or generation == catalog_generation:
+        return
+    with catalog_reload_lock:
+        generation = published_generation()
+        if generation == catalog_generation:
+            return
+        try:
+            with open(os.path.join(CATALOG_STATE_DIR, "current")) as f:
+                name = f.read().strip()
+            with open(os.path.join(CATALOG_STATE_DIR, name)) as f:
+                published = json.load(f)
+        except (OSError, ValueError):
+            return
+        signature = published["source_signature"]
+        swap_catalog(Catalog(published["draft"], tuple(signature) if signature else None), generation)
+        catalog_stats["adopted"] += 1
+
+def watch_catalog_file():
+    failed_signature = None
+    while True:
+        signature = catalog_source_signature()
+        if signature not in (None, catalog.source_signature, failed_signature):
+            try:
+                reload_catalog()
+            except Exception as e:
+                failed_signature = signature
+                print(f"Catalog reload failed, keeping version {catalog.version}: {e}")
+        time.sleep(CATALOG_WATCH_INTERVAL)
+
+@app.before_request
+def start_catalog_watcher():
+    # Threads do not survive gunicorn's fork after --preload, so every worker starts its own watcher
+    global catalog_watcher_pid
+    if CATALOG_WATCH_INTERVAL <= 0 or not GEOFENCE_CATALOG_FILE or catalog_watcher_pid == os.getpid():
+        return
+    with catalog_watcher_lock:
+        if catalog_watcher_pid == os.getpid():
+            return
+        catalog_watcher_pid = os.getpid()
+    threading.Thread(target=watch_catalog_file, daemon=True).start()
+
+@app.route("/reload-catalog", methods=['POST'])
+def reload_catalog_endpoint():
+    if not admin_authorized():
+        return jsonify({
+            "status": "error",
+            "message": "Invalid admin token"
+        }), 403
+    if GEOFENCE_SHARD_URLS:
+        return jsonify({
+            "status": "error",
+            "message": "A coordinator holds no catalog, reload its shards"
+        }), 400
+    try:
+        new_catalog = reload_catalog()
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": f"Catalog reload failed, keeping version {catalog.version}: {e}"
+        }), 500
+    return jsonify({"status": "success", **new_catalog.summary()}), 200
+
+catalog = Catalog(new_catalog_draft())
+
+def start_catalog(**source):
+    # Loads the first catalog, with the service's Overpass settings (timeout, limit, geofences, fallback) when given.
+    # A coordinator holds no catalog itself, the shards do.
+    overpass_source.update(source)
+    if not GEOFENCE_SHARD_URLS:
+        try:
+            reload_catalog()
+        except Exception as e:
+            print(f"Starting without geofences: {e}")
+
+# Evaluation in the integer backends (AdditiveEngine) works on unobfuscated ciphertexts, and every result
+# is re-randomized exactly once by a factor of the backend engine's random_factor. The factors come from a pool a
+# background thread refills between requests, the rest are computed inline. Refilling holds the GIL for a full-size
+# exponentiation at a time, so it pauses while any evaluation runs.
+OBFUSCATION_POOL_SIZE = int(os.environ.get("OBFUSCATION_POOL_SIZE", "1024"))  # Precomputed factors per worker, 0 computes them inline
+
+class ObfuscationPool:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.refill_needed = threading.Event()
+        self.idle = threading.Event()
+        self.idle.set()
+        self.evaluations = 0
+        self.public_key = None  # Factors are only valid under the key they were computed for
+        self.factor = None
+        self.factors = deque()
+        self.worker_pid = None
+        self.stats = {"pooled": 0, "inline": 0}
+
+    def begin(self):
+        with self.lock:
+            self.evaluations += 1
+            self.idle.clear()
+
+    def end(self):
+        with self.lock:
+            self.evaluations -= 1
+            if not self.evaluations:
+                self.idle.set()
+
+    def take(self, public_key, count, factor):
+        with self.lock:
+            # Threads do not survive gunicorn's fork after --preload, so every worker starts its own refill thread
+            if self.size and self.worker_pid != os.getpid():
+                self.worker_pid = os.getpid()
+                threading.Thread(target=self._refill, daemon=True).start()
+            if self.public_key is None or self.public_key.n != public_key.n:
+                self.public_key = public_key
+                self.factor = factor
+                self.factors.clear()
+            taken = [self.factors.popleft() for _ in range(min(count, len(self.factors)))]
+            self.stats["pooled"] += len(taken)
+            self.stats["inline"] += count - len(taken)
+            self.refill_needed.set()
+        return taken + [factor(public_key) for _ in range(count - len(taken))]
+
+    def _refill(self):
+        while True:
+            self.refill_needed.wait()
+            self.idle.wait()
+            with self.lock:
+                public_key, factor = self.public_key, self.factor
+                if public_key is None or len(self.factors) >= self.size:
+                    self.refill_needed.clear()
+                    continue
+            value = factor(public_key)
+            with self.lock:
+                if self.public_key is public_key and len(self.factors) < self.size:
+                    self.factors.append(value)
+
+    def summary(self):
+        with self.lock:
+            total = self.stats["pooled"] + self.stats["inline"]
+            return {"capacity": self.size, "available": len(self.factors), **self.stats,
+                    "pooled_rate": self.stats["pooled"] / total if total else None}
+
+obfuscation_pool = ObfuscationPool(OBFUSCATION_POOL_SIZE)
+
+def keyed_engine(engine_class, public_key):
+    # An integer backend engine under the client's key, re-randomizing with factors from this worker's pool
+    return engine_class(public_key, obfuscators=lambda count: obfuscation_pool.take(public_key, count, engine_class.random_factor),
+                        checkpoint_chunk=DEADLINE_CHECK_CHUNK)
+
+def calculate_intermediate_haversine_values(engine, users, coefficients, deadline=None, scheme="prop"):
+    # One result batch per user, the pool's refill thread pauses while the evaluation runs
+    start = time.time()
+    obfuscation_pool.begin()
+    try:
+        batches = engine.evaluate_many(users, coefficients, lambda stage: check_deadline(deadline, stage), scheme)
+        end = time.time()
+        print(f"(Runtime Performance Experiment) Computation Runtime {SCHEME_NAMES[scheme]}:", round((end-start), 3), "s")
+    finally:
+        obfuscation_pool.end()
+    return batches
+
+RESULT_TOKEN = os.environ.get("RESULT_TOKEN") or None  # Sent in X-Result-Token with every result submission when set
+result_token_headers = {"X-Result-Token": RESULT_TOKEN} if RESULT_TOKEN else {}
+
+class KeyAuthorityRejected(Exception):
+    # The key authority refused the request itself (4xx, e.g. invalid radii or a ring within its decryption error),
+    # its status and JSON body go back to the client unchanged
+    def __init__(self, response):
+        super().__init__(f"Key authority answered {response.status_code}")
+        self.status_code = response.status_code
+        try:
+            self.body = response.json()
+        except ValueError:
+            self.body = {"status": "error", "message": response.text}
+
+def check_key_authority_response(response, deadline):
+    # A 504 means our deadline passed, a 4xx raises KeyAuthorityRejected and any other failure HTTPError
+    if response.status_code == 504:
+        check_deadline(deadline, "key_authority")
+    if 400 <= response.status_code < 500:
+        raise KeyAuthorityRejected(response)
+    response.raise_for_status()
+
+def submit_geofence_results_to_key_authority(public_key_n, encrypted_batch, endpoint, deadline, response_format="list", thresholds=None, ring_thresholds=None, groups=None, max_speed=None):
+    check_deadline(deadline, "key_authority")
+    try:
+        payload = {
+            "public_key_n": public_key_n,
+            "encrypted_batch": encrypted_batch,
+            "thresholds": thresholds,
+            "ring_thresholds": ring_thresholds,
+            "groups": groups,
+            "response_format": response_format,
+            "max_speed": max_speed
+        }
+        response = key_authority_pool.request(
+            "POST", endpoint,
+            json=payload,
+            headers={**deadline_headers(deadline), **result_token_headers},
+            timeout=remaining_budget(deadline)
+        )
+        check_key_authority_response(response, deadline)
+        return response.json()
+    except requests.exceptions.Timeout:
+        check_deadline(deadline, "key_authority")
+        print("Key authority timed out before the request deadline")
+        return None
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to post results to key authority: {e}")
+        return None
+
+SCHEME_NAMES = {"prop": "Proposed", "ref": "Reference"}
+LOCATION_RECEIVED = "Location data recieved"  # Spelling kept, clients match on it
+
+def current_engine(backend, client_key_n, deadline):
+    # The backend engine under the key authority's current key, None when it cannot be fetched. A client key other
+    # than the cached one refreshes it, the client may already use a rotated key.
+    for refresh in (False, True):
+        check_deadline(deadline, "key_authority")
+        public_key = current_key.get(backend.get_key_authority_public_key, remaining_budget(deadline), refresh)
+        if public_key is None:
+            return None
+        engine = backend.get_engine(public_key)
+        if engine.public_key.n == client_key_n:
+            break
+    return engine
+
+def serve_keyed_locations(backend, routes):
+    # Location routes of the integer backends, which evaluate under the key the client encrypted with. routes maps
+    # each path to its scheme and key authority endpoint, backend is the service module: its
+    # get_key_authority_public_key(timeout) (None when unavailable) and get_engine(public_key) are looked up per request.
+    backend_stats["obfuscation"] = obfuscation_pool.summary
+
+    @deadline_bounded
+    @admission_controlled
+    def submit_mobile_node_location():
+        scheme, key_authority_endpoint = routes[request.url_rule.rule]
+        data = request.get_json()
+        if not data:
+            return jsonify({
+                "status": "error",
+                "message": "Request data is missing"
+            }), 400
+        if 'user_encrypted_location' not in data or 'public_key_n' not in data:
+            return jsonify({
+                "status": "error",
+                "message": "Missing 'user_encrypted_location' or 'public_key_n' in request data"
+            }), 400
+        response_format = data.get("response_format", "list")
+        if response_format not in RESPONSE_FORMATS:
+            return jsonify({
+                "status": "error",
+                "message": f"Unknown response_format '{response_format}', expected one of: {', '.join(RESPONSE_FORMATS)}"
+            }), 400
+        request_catalog = catalog  # Read once, a concurrent reload does not change this request's version
+        try:
+            entries = request_catalog.select_entries(data.get('tags'))
+            circles, groups = request_catalog.plan_evaluation(entries, response_format)
+            ring_thresholds = request_catalog.get_ring_thresholds(data.get('radii'), circles) if response_format == "rings" else None
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        if GEOFENCE_SHARD_URLS:
+            return scatter_gather(request.path, data, g.deadline)
+        # The current key is checked before the result cache, so cached results under a rotated key stop once it is seen
+        engine = current_engine(backend, data['public_key_n'], g.deadline)
+        if engine is None:
+            check_deadline(g.deadline, "key_authority")
+            return jsonify({
+                "status": "error",
+                "message": "Failed to fetch the public key from the key authority"
+            }), 502
+        public_key_n = engine.public_key.n
+        result_cache.observe_key(public_key_n)
+        if data['public_key_n'] != public_key_n:
+            return jsonify({
+                "status": "error",
+                "message": "Public key mismatch. Encryption was not done with the correct public key."
+            }), 400
+        cache_key, cached = result_cache.lookup(public_key_n, request_catalog.version, data)
+        if cached is not None:
+            return jsonify({**cached, "cached": True}), 200
+        check_deadline(g.deadline, "deserialization")
+        try:
+            encrypted_values = engine.deserialize_terms(data['user_encrypted_location'], scheme)
+        except ValueError as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        if not circles:
+            return jsonify({**empty_decisions(response_format), **request_catalog.response_fields(entries), "message": LOCATION_RECEIVED}), 200
+        coefficients = request_catalog.scheme_coefficients(scheme, circles)
+        intermediate_values, = calculate_intermediate_haversine_values(engine, [encrypted_values], coefficients, deadline=g.deadline, scheme=scheme)
+        # Submit intermediate values to key authority and get result
+        thresholds = [request_catalog.thresholds[idx] for idx in circles]
+        try:
+            keyauth_response = submit_geofence_results_to_key_authority(public_key_n, engine.serialize_batch(intermediate_values), key_authority_endpoint, g.deadline, response_format, thresholds, ring_thresholds, groups, data.get('max_speed'))
+        except KeyAuthorityRejected as e:
+            return jsonify(e.body), e.status_code
+        if response_format == "any" and keyauth_response and keyauth_response.get("status") == "success":
+            keyauth_response = request_catalog.resolve_any_match(keyauth_response, circles, entries)
+        # Return the actual result from key authority (inside/outside/unknown) in the shape it was decided in
+        if keyauth_response and keyauth_response.get("status") == "success":
+            response = {**keyauth_response, **request_catalog.response_fields(entries), "message": LOCATION_RECEIVED}
+            result_cache.store(cache_key, response)
+            return jsonify(response), 200
+        else:
+            return jsonify({
+                "status": "error",
+                "message": "Failed to get geofence decision from key authority",
+                "results": keyauth_response.get("results") if keyauth_response else None
+            }), 500
+
+    for rule in routes:
+        app.add_url_rule(rule, "submit_mobile_node_location", submit_mobile_node_location, methods=['POST'])
@@ -0,0 +1,443 @@
+from flask import Flask, g, jsonify, request
+import json
+import math
+import numpy as np
+import time
+import os
+import threading
+from geofence_engine import KEY_PROFILES
+from service_common import (RESPONSE_FORMATS, DeadlineExceeded, admin_authorized, admission_controlled, admission_controller,
+                            check_deadline, deadline_bounded, deadline_lock, deadline_stats, encode_decisions)
+
+# The key authority of every backend: the key store, thresholds, rings, groups and the decision shapes, with the
+# admission control and deadlines of service_common.py. A backend's app.py adds its key routes and its result routes
+# (serve_keyed_results for the integer backends), decrypting with its engine.
+
+app = Flask(__name__)
+
+backend_stats = {}  # Sections a backend adds to /service-stats, name -> function returning the section
+
+@app.route("/service-stats", methods=['GET'])
+def get_service_stats():
+    with deadline_lock:
+        expired = dict(deadline_stats)
+    return jsonify({"admission": admission_controller.snapshot(), "deadline_expired": expired,
+                    **{name: section() for name, section in backend_stats.items()}})
+
+# Persisted key store: versioned key files in a protected directory, loaded in milliseconds at startup.
+# The next key is generated ahead of time in the background and only becomes active on an explicit rotation.
+KEY_STORE_DIR = os.environ.get("KEY_STORE_DIR")                 # Unset keeps keys in memory only
+KEY_RETENTION = int(os.environ.get("KEY_RETENTION", "2"))       # Versions still accepted for decryption after a rotation
+
+class KeyRotationUnavailable(Exception):
+    pass
+
+class KeyStore:
+    def __init__(self, directory, prefix, extension, generate, serialize, deserialize):
+        self.directory = directory
+        self.prefix = prefix
+        self.extension = extension
+        self.generate = generate
+        self.serialize = serialize
+        self.deserialize = deserialize
+        self.keys = {}  # key_id -> key material
+        self.active_id = None
+        self.active_mtime = None
+        self.lock = threading.RLock()
+        self.generator = None
+        self.owner_pid = None  # Process that loaded the keys, forked workers share its in-memory copy
+
+    @staticmethod
+    def version(key_id):
+        return int(key_id.rsplit("-v", 1)[1])
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _write_private(self, path, data):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+
+    def refresh(self):
+        # Picks up keys and rotations made by other workers or replicas sharing the directory
+        with self.lock:
+            for name in os.listdir(self.directory):
+                key_id = name[:-len(self.extension)]
+                if name.startswith(f"{self.prefix}-v") and name.endswith(self.extension) and key_id not in self.keys:
+                    with open(self._path(name), "rb") as f:
+                        self.keys[key_id] = self.deserialize(f.read())
+            try:
+                self.active_mtime = os.stat(self._path("active")).st_mtime_ns
+                with open(self._path("active")) as f:
+                    self.active_id = f.read().strip()
+            except FileNotFoundError:
+                pass
+
+    def load(self):
+        self.owner_pid = os.getpid()
+        if self.directory is None:
+            self.keys[f"{self.prefix}-v1"] = self.generate()
+            self.active_id = f"{self.prefix}-v1"
+            return
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.refresh()
+        if self.active_id is None:
+            if not self.keys:
+                self._store_new_key()
+            self._set_active(max(self.keys, key=self.version))
+        self.pregenerate()
+
+    def _store_new_key(self):
+        key = self.generate()
+        with self.lock:
+            self.refresh()
+            key_id = f"{self.prefix}-v{max(map(self.version, self.keys), default=0) + 1}"
+            temp_path = self._path(f".{key_id}.{os.getpid()}.tmp")
+            self._write_private(temp_path, self.serialize(key))
+            try:
+                # Linking fails if another replica stored this version first, in which case its key is kept
+                os.link(temp_path, self._path(key_id + self.extension))
+                self.keys[key_id] = key
+            except FileExistsError:
+                self.refresh()
+            finally:
+                os.remove(temp_path)
+        return key_id
+
+    def _set_active(self, key_id):
+        temp_path = self._path(f".active.{os.getpid()}.tmp")
+        with open(temp_path, "w") as f:
+            f.write(key_id)
+        os.replace(temp_path, self._path("active"))
+        self.active_id = key_id
+        self.active_mtime = os.stat(self._path("active")).st_mtime_ns
+
+    def pending_ids(self):
+        with self.lock:
+            return sorted((k for k in self.keys if self.version(k) > self.version(self.active_id)), key=self.version)
+
+    def pregenerate(self):
+        if self.directory is None or self.pending_ids() or (self.generator and self.generator.is_alive()):
+            return
+        self.generator = threading.Thread(target=self._store_new_key, daemon=True)
+        self.generator.start()
+
+    def rotate(self):
+        with self.lock:
+            if self.directory is None:
+                # Workers forked after --preload each hold a copy of the keys, rotating one would split them across keys
+                if os.getpid() != self.owner_pid:
+                    raise KeyRotationUnavailable("In-memory keys can only be rotated by the process that loaded them, set KEY_STORE_DIR to rotate keys across workers")
+                key_id = f"{self.prefix}-v{self.version(self.active_id) + 1}"
+                self.keys[key_id] = self.generate()
+                self.active_id = key_id
+                return key_id
+            self.refresh()
+            pending = self.pending_ids()
+            # Promoting a pre-generated key is instant, generating one here only happens if none is ready yet
+            key_id = pending[0] if pending else self._store_new_key()
+            self._set_active(key_id)
+        self.pregenerate()
+        return key_id
+
+    def active(self):
+        if self.directory is not None:
+            try:
+                if os.stat(self._path("active")).st_mtime_ns != self.active_mtime:
+                    self.refresh()
+            except FileNotFoundError:
+                pass
+        with self.lock:
+            return self.active_id, self.keys[self.active_id]
+
+    def retained(self):
+        # Active key first, then older versions that are still inside the retention window
+        active_id, _ = self.active()
+        with self.lock:
+            key_ids = [k for k in self.keys if 0 <= self.version(active_id) - self.version(k) < KEY_RETENTION]
+            return [(k, self.keys[k]) for k in sorted(key_ids, key=self.version, reverse=True)]
+
+    def find(self, match):
+        for key_id, key in self.retained():
+            if match(key_id, key):
+                return key_id, key
+        return None, None
+
+def load_cost_model(path):
+    # Per-profile costs measured by the backend's benchmark, reported with the key profile
+    if not path:
+        return {}
+    with open(path) as f:
+        return json.load(f)["profiles"]
+
+def key_profile(key_size, cost_model, tolerance=0):
+    # Keys in the store may predate a profile change, so the profile follows the key's actual size
+    name = next((name for name, profile in KEY_PROFILES.items() if abs(profile["key_size"] - key_size) <= tolerance), None)
+    return {
+        "name": name,
+        "key_size": key_size,
+        "security_bits": KEY_PROFILES[name]["security_bits"] if name else None,
+        "cost": cost_model.get(name)
+    }
+
+def serve_keyed_keys(backend, key_size_tolerance=0):
+    # Key routes of the integer backends, whose keys are (public key, private key) pairs with a modulus n. backend is
+    # the service module: its key_store, its cost_model and its public_key_fields(keypair, profile), the scheme's
+    # public parameters besides n, are looked up per request. key_size_tolerance is how far (in bits) the backend's
+    # key generation may land from a profile's size.
+    @app.route("/get-public-key", methods=['GET'])
+    def get_public_key():
+        key_id, keypair = backend.key_store.active()
+        profile = key_profile(keypair[0].n.bit_length(), backend.cost_model, key_size_tolerance)
+        return jsonify({
+            "public_key_n": keypair[0].n,
+            "key_id": key_id,
+            "key_profile": profile,
+            **backend.public_key_fields(keypair, profile)
+        })
+
+    @app.route("/rotate-key", methods=['POST'])
+    def rotate_key():
+        if not admin_authorized():
+            return jsonify({
+                "status": "error",
+                "message": "Invalid admin token"
+            }), 403
+        try:
+            key_id = backend.key_store.rotate()
+        except KeyRotationUnavailable as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 409
+        return jsonify({
+            "status": "success",
+            "key_id": key_id,
+            "public_key_n": backend.key_store.active()[1][0].n
+        }), 200
+
+# Per-geofence thresholds on the decrypted intermediate value 1 - cos(d/R), sent by the Geofencing service.
+# Requests without them fall back to one radius, so classification never needs trig per result.
+GEOFENCE_RADIUS = float(os.environ.get("GEOFENCE_RADIUS", "100"))  # Meters
+earth_radius = 6371000  # Approximate Earth radius in meters
+DEFAULT_THRESHOLD = 1 - math.cos(GEOFENCE_RADIUS / earth_radius)
+
+def get_thresholds(data, count):
+    thresholds = data.get("thresholds")
+    if thresholds is None:
+        return np.full(count, DEFAULT_THRESHOLD)
+    thresholds = np.asarray(thresholds, dtype=float)
+    if thresholds.shape != (count,):
+        raise ValueError("Expected one threshold per encrypted result")
+    return thresholds
+
+def get_ring_thresholds(data, count):
+    # Ring queries: one ascending threshold list shared by every geofence, or one list per geofence
+    rings = data.get("ring_thresholds")
+    if not rings:
+        raise ValueError("Ring queries need 'ring_thresholds'")
+    if isinstance(rings[0], list):
+        if len(rings) != count:
+            raise ValueError("Expected one ring threshold list per encrypted result")
+        # Shorter lists are padded with thresholds no value exceeds
+        ring_thresholds = np.full((count, max(len(ring) for ring in rings)), np.inf)
+        for idx, ring in enumerate(rings):
+            ring_thresholds[idx, :len(ring)] = np.sort(np.asarray(ring, dtype=float))
+        return ring_thresholds
+    return np.sort(np.asarray(rings, dtype=float))[np.newaxis, :]
+
+def classify_rings(values, ring_thresholds):
+    # Ring index per result: 0 within the smallest radius, len(radii) outside all of them
+    return np.sum(np.asarray(values, dtype=float)[:, np.newaxis] > ring_thresholds, axis=1)
+
+# Query interval hint: how long the device stays on its side of every evaluated boundary at its maximum speed,
+# rounded down to a few coarse buckets so the hint reveals little about the actual distance
+MAX_DEVICE_SPEED = float(os.environ.get("MAX_DEVICE_SPEED", "40"))  # m/s assumed when the request names none
+QUERY_INTERVAL_BUCKETS = sorted(float(bucket) for bucket in os.environ.get("QUERY_INTERVAL_BUCKETS", "0,10,30,60,300").split(","))
+
+def get_max_speed(data):
+    max_speed = data.get("max_speed")
+    if max_speed is None:
+        return MAX_DEVICE_SPEED
+    if not isinstance(max_speed, (int, float)) or max_speed <= 0:
+        raise ValueError("'max_speed' must be a positive speed in m/s")
+    return float(max_speed)
+
+def query_interval_hint(values, boundaries, max_speed):
+    # Distances follow from 1 - cos(d/R) for the device and from the thresholds for the boundaries (inf pads none)
+    distances = earth_radius * np.arccos(1 - np.clip(np.asarray(values, dtype=float), 0.0, 2.0))
+    boundaries = np.asarray(boundaries, dtype=float)
+    if boundaries.ndim == 1:
+        boundaries = boundaries[:, np.newaxis]
+    radii = np.where(np.isfinite(boundaries), earth_radius * np.arccos(1 - np.clip(boundaries, 0.0, 2.0)), np.inf)
+    margin = np.min(np.abs(distances[:, np.newaxis] - radii), initial=np.inf)
+    return max((bucket for bucket in QUERY_INTERVAL_BUCKETS if bucket <= margin / max_speed), default=0.0)
+
+def get_groups(data, count):
+    # Start offset of every catalog entry's results: a polygon's cover circles are one entry, inside when any circle is
+    groups = data.get("groups")
+    if groups is None:
+        return None
+    if (not isinstance(groups, list) or not groups or groups[0] != 0 or groups[-1] >= count
+            or not all(isinstance(start, int) for start in groups) or any(b <= a for a, b in zip(groups, groups[1:]))):
+        raise ValueError("'groups' must be increasing start offsets from 0 within the encrypted results")
+    return np.asarray(groups)
+
+ANY_MATCH_CHUNK = int(os.environ.get("ANY_MATCH_CHUNK", "8"))  # Results decrypted between checks for an inside decision
+
+def decision_parameters(data, result_count):
+    # The decision shape and the per-result parameters of a result request, ValueError (or TypeError) when invalid.
+    # result_count reads the number of results from the request in the backend's wire format.
+    response_format = data.get("response_format", "list")
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(f"Unknown response_format '{response_format}', expected one of: {', '.join(RESPONSE_FORMATS)}")
+    count = result_count(data)
+    thresholds = get_thresholds(data, count)
+    ring_thresholds = get_ring_thresholds(data, count) if response_format == "rings" else None
+    return response_format, thresholds, ring_thresholds, get_groups(data, count), get_max_speed(data)
+
+def decrypt_until_inside(results, decrypt_classify, thresholds, deadline=None):
+    # Any-match mode: results arrive most likely hit first, decryption stops at the chunk holding the first inside one.
+    # decrypt_classify(chunk, thresholds) returns the chunk's values and decisions, or None when it cannot decrypt.
+    # Returns the hit position, the number of decrypted results and their values.
+    decrypted_values = []
+    for start in range(0, len(results), ANY_MATCH_CHUNK):
+        check_deadline(deadline, "decryption")
+        chunk = results[start:start + ANY_MATCH_CHUNK]
+        outcome = decrypt_classify(chunk, thresholds[start:start + len(chunk)])
+        if outcome is None:
+            return None
+        values, decisions = outcome
+        decrypted_values.extend(values)
+        hits = np.flatnonzero(decisions)
+        if hits.size:
+            return start + int(hits[0]), start + len(chunk), decrypted_values
+    return None, len(results), decrypted_values
+
+def any_match_response(count, outcome, thresholds, max_speed, **fields):
+    hit_position, decrypted, values = outcome
+    return jsonify({
+        "status": "success",
+        **fields,
+        "format": "any",
+        "count": count,
+        "match": hit_position is not None,
+        "hit_position": hit_position,
+        "decrypted": decrypted,
+        # Undecrypted results may lie close by, so only a miss over every result earns a longer interval
+        "next_query_in": query_interval_hint(values, thresholds, max_speed) if hit_position is None else QUERY_INTERVAL_BUCKETS[0]
+    }), 200
+
+def decision_response(values, inside, thresholds, ring_thresholds, groups, response_format, max_speed, with_values=False, **fields):
+    # The decisions in the requested shape, fields are added to every response (e.g. its message)
+    if ring_thresholds is not None:
+        rings = classify_rings(values, ring_thresholds)
+        if groups is not None:
+            rings = np.minimum.reduceat(rings, groups)
+        return jsonify({"status": "success", **fields, "format": "rings", "count": len(rings), "rings": rings.tolist(),
+                        "next_query_in": query_interval_hint(values, ring_thresholds, max_speed)}), 200
+    inside = np.asarray(inside)
+    next_query_in = query_interval_hint(values, thresholds, max_speed)
+    if groups is not None:
+        # A polygon's decrypted values belong to different cover circles, so only its decision is returned
+        inside = np.logical_or.reduceat(inside, groups)
+        values = [None] * len(inside)
+    if response_format != "list":
+        return jsonify({"status": "success", **fields, **encode_decisions(np.flatnonzero(inside).tolist(), len(inside), response_format), "next_query_in": next_query_in}), 200
+    # Return a list of results for each geofence
+    results = [{"value": value, "status": "inside" if hit else "outside"} if with_values else {"status": "inside" if hit else "outside"}
+               for value, hit in zip(values, inside)]
+    return jsonify({"status": "success", **fields, "results": results, "next_query_in": next_query_in}), 200
+
+# Results of the integer backends (AdditiveEngine) are decrypted and classified by the backend engine,
+# which reads both the "encrypted_batch" format and the legacy "encrypted_results" format with one exponent per result
+def encrypted_result_count(data):
+    batch = data.get('encrypted_batch')
+    if batch is None:
+        return len(data['encrypted_results'])
+    if not isinstance(batch, dict) or not isinstance(batch.get('ciphertexts'), list):
+        raise ValueError("'encrypted_batch' must hold a 'ciphertexts' list and an 'exponent'")
+    return len(batch['ciphertexts'])
+
+def parse_encrypted_results(data, engine):
+    try:
+        return engine.deserialize_batch(data)
+    except Exception as e:
+        print(f"Error parsing encrypted results: {e}")
+        return None
+
+def decrypt_encrypted_results(encrypted_result_list, engine, thresholds, deadline=None):
+    # Decrypted values and their inside decisions
+    try:
+        return engine.decrypt_classify_batch(encrypted_result_list, thresholds, lambda stage: check_deadline(deadline, stage))
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        print(f"Error decrypting encrypted results: {e}")
+        return None
+
+RESULT_PROCESSED = "Geofence result processed successfully"
+# The result routes decrypt whatever they are sent, so a deployment can restrict them to its Geofencing service
+RESULT_TOKEN = os.environ.get("RESULT_TOKEN") or None  # Required in X-Result-Token on result submissions when set
+
+def serve_keyed_results(backend, routes):
+    # Result routes of the integer backends, decrypted under the key the client encrypted with. routes maps each path
+    # to its scheme name, backend is the service module: its key_store of (public key, private key) pairs and its
+    # get_engine(keypair) are looked up per request.
+    @deadline_bounded
+    @admission_controlled
+    def submit_geofence_result():
+        if RESULT_TOKEN is not None and request.headers.get("X-Result-Token") != RESULT_TOKEN:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid result token"
+            }), 403
+        data = request.get_json()
+        if not data or ('encrypted_results' not in data and 'encrypted_batch' not in data) or 'public_key_n' not in data:
+            return jsonify({
+                "status": "error",
+                "message": "Missing 'encrypted_results' or 'public_key_n' in request data"
+            }), 400
+        try:
+            response_format, thresholds, ring_thresholds, groups, max_speed = decision_parameters(data, encrypted_result_count)
+        except (TypeError, ValueError) as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 400
+        # Keys inside the retention window still decrypt requests that were in flight during a rotation
+        _, keypair = backend.key_store.find(lambda key_id, keypair: keypair[0].n == data['public_key_n'])
+        if keypair is None:
+            return jsonify({
+                "status": "error",
+                "message": "Public key mismatch. Encryption was not done with the correct public key."
+            }), 400
+        check_deadline(g.deadline, "deserialization")
+        engine = backend.get_engine(keypair)
+        encrypted_result_list = parse_encrypted_results(data, engine)
+        if encrypted_result_list is None:
+            return jsonify({
+                "status": "error",
+                "message": "Invalid encrypted results"
+            }), 400
+        start_decryption = time.time()
+        if response_format == "any":
+            outcome = decrypt_until_inside(encrypted_result_list, lambda chunk, chunk_thresholds: decrypt_encrypted_results(chunk, engine, chunk_thresholds, g.deadline),
+                                           thresholds, g.deadline)
+        else:
+            outcome = decrypt_encrypted_results(encrypted_result_list, engine, thresholds, g.deadline)
+        if outcome is None:
+            return jsonify({
+                "status": "error",
+                "message": "Couldn't decrypt encrypted results",
+            }), 500
+        if response_format == "any":
+            return any_match_response(len(encrypted_result_list), outcome, thresholds, max_speed, message=RESULT_PROCESSED)
+        end_decryption = time.time()
+        print(f"(Runtime Performance Experiment) Decryption & Evaluation Runtime {routes[request.url_rule.rule]}:", round((end_decryption-start_decryption), 3), "s")
+        haversine_intermediate_values, results = outcome
+        return decision_response(haversine_intermediate_values, results, thresholds, ring_thresholds, groups, response_format, max_speed, message=RESULT_PROCESSED)
+
+    for rule in routes:
+        app.add_url_rule(rule, "submit_geofence_result", submit_geofence_result, methods=['POST'])
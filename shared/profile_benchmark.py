@@ -0,0 +1,90 @@
+import argparse
+import json
+import math
+import random
+import statistics
+import time
+from geofence_engine import KEY_PROFILES, location_terms
+
+# Measure every key profile of an integer backend through the prop pipeline (client encryption, per-geofence evaluation
+# and re-randomization, key authority decryption, wire sizes) and write the results as a cost model the key authority
+# reports per profile. PAILLIER/paillier_benchmark.py and OKAMOTO-UCHIYAMA/ou_benchmark.py run it with their engine.
+def evaluate(engine, terms, coefficients):
+    # The Geofencing service's evaluation (AdditiveEngine.evaluate_many) for one user
+    batch, = engine.evaluate_many([terms], coefficients)
+    return batch
+
+def benchmark(engine_class, generate_keypair, profile, samples, geofences, extra_stages=None):
+    # extra_stages(public_key, profile) returns fields added to the profile's result and further client stages,
+    # each timed per sample on the sampled (lat, lon)
+    public_key, private_key = generate_keypair(profile["key_size"])
+    fields, stages = extra_stages(public_key, profile) if extra_stages else ({}, {})
+    client = engine_class(public_key)
+    # The benchmark times re-randomization on its own, so the evaluation engine leaves its results unobfuscated
+    engine = engine_class(public_key, private_key, obfuscators=lambda count: [1] * count)
+    coefficients = [location_terms(math.radians(random.uniform(-60, 60)), math.radians(random.uniform(-180, 180))) for _ in range(geofences)]
+
+    timings = {"encryption": [], **{stage: [] for stage in stages}, "evaluation": [], "obfuscation": [], "decryption": []}
+    for _ in range(samples):
+        lat, lon = math.radians(random.uniform(-60, 60)), math.radians(random.uniform(-180, 180))
+        start = time.perf_counter()
+        terms = client.encrypt_terms(lat, lon)
+        timings["encryption"].append(time.perf_counter() - start)
+
+        for stage, run in stages.items():
+            start = time.perf_counter()
+            run(lat, lon)
+            timings[stage].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        batch = evaluate(engine, terms, coefficients)
+        timings["evaluation"].append((time.perf_counter() - start) / geofences)
+
+        # Paid once per result, by the obfuscation pool between requests or inline when it runs dry
+        start = time.perf_counter()
+        engine_class.random_factor(public_key)
+        timings["obfuscation"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        engine.decrypt_batch(batch)
+        timings["decryption"].append((time.perf_counter() - start) / geofences)
+
+    upload = engine.serialize_terms(terms)
+    result_batch = engine.serialize_batch(batch)
+    stage_ms = {stage: round(statistics.median(values) * 1000, 3) for stage, values in timings.items()}
+    return {
+        **profile,
+        **fields,
+        "stage_ms": stage_ms,
+        # Client encryption plus everything paid per geofence, with the obfuscation factor taken from the pool
+        "request_ms": round(stage_ms["encryption"] + geofences * (stage_ms["evaluation"] + stage_ms["decryption"]), 3),
+        "upload_bytes": len(json.dumps(upload)),
+        "result_bytes_per_geofence": round(len(json.dumps(result_batch)) / geofences, 1)
+    }
+
+def main(scheme, engine_class, generate_keypair, output, extra_stages=None):
+    parser = argparse.ArgumentParser(description=f"Measure the cost of every {scheme} key profile")
+    parser.add_argument("--profiles", default=",".join(KEY_PROFILES), help="profiles to measure")
+    parser.add_argument("--geofences", type=int, default=20, help="geofences evaluated per request")
+    parser.add_argument("--samples", type=int, default=10, help="requests measured per profile")
+    parser.add_argument("--min-security", type=int, default=128, help="smallest security level in bits the policy allows")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the sampled positions")
+    parser.add_argument("--output", default=output, help="cost model file for the key authority")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = {}
+    for name in args.profiles.split(","):
+        result = benchmark(engine_class, generate_keypair, KEY_PROFILES[name], args.samples, args.geofences, extra_stages)
+        results[name] = result
+        print(f"{name} ({result['key_size']} bits, {result['security_bits']}-bit security): {result['request_ms']} ms per request, "
+              f"stages {result['stage_ms']}, {result['upload_bytes']} B up, {result['result_bytes_per_geofence']} B per geofence")
+
+    meeting_policy = [name for name, result in results.items() if result["security_bits"] >= args.min_security]
+    selected = min(meeting_policy, key=lambda name: results[name]["request_ms"]) if meeting_policy else None
+    with open(args.output, "w") as f:
+        json.dump({"geofences": args.geofences, "min_security": args.min_security, "selected": selected, "profiles": results}, f, indent=2)
+    if selected is None:
+        print(f"No measured profile reaches {args.min_security}-bit security")
+    else:
+        print(f"Smallest profile meeting {args.min_security}-bit security: {selected}, cost model written to {args.output}")
@@ -0,0 +1,178 @@
+from flask import g, jsonify, request
+import base64
+import time
+from functools import wraps
+import os
+import threading
+
+# The request handling shared by the Geofencing service and the key authority of every backend: deadline propagation,
+# admission control, the admin token and the compact decision shapes. Each process runs one service, so it holds one admission controller.
+
+# Deadline propagation: callers send their remaining time budget, every hop reduces it before forwarding
+DEADLINE_HEADER = "X-Deadline-Ms"
+DEFAULT_REQUEST_BUDGET = float(os.environ.get("DEFAULT_REQUEST_BUDGET", "30"))  # Seconds, used when no deadline is sent
+DEADLINE_HOP_MARGIN = float(os.environ.get("DEADLINE_HOP_MARGIN", "0.05"))      # Seconds kept back for the response to return
+DEADLINE_CHECK_CHUNK = int(os.environ.get("DEADLINE_CHECK_CHUNK", "50"))        # Values processed between deadline checks
+
+class DeadlineExceeded(Exception):
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage}")
+        self.stage = stage
+
+deadline_lock = threading.Lock()
+deadline_stats = {}  # Number of requests abandoned per stage
+
+def get_request_deadline():
+    try:
+        budget = float(request.headers[DEADLINE_HEADER]) / 1000
+    except (KeyError, ValueError):
+        budget = DEFAULT_REQUEST_BUDGET
+    return time.monotonic() + budget
+
+def remaining_budget(deadline):
+    return deadline - time.monotonic()
+
+def check_deadline(deadline, stage):
+    if deadline is not None and remaining_budget(deadline) <= 0:
+        with deadline_lock:
+            deadline_stats[stage] = deadline_stats.get(stage, 0) + 1
+        raise DeadlineExceeded(stage)
+
+def deadline_headers(deadline):
+    # Budget forwarded to the next hop, minus the time needed to get the answer back to our caller
+    budget_ms = max(int((remaining_budget(deadline) - DEADLINE_HOP_MARGIN) * 1000), 0)
+    return {DEADLINE_HEADER: str(budget_ms)}
+
+def deadline_bounded(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.deadline = get_request_deadline()
+        try:
+            check_deadline(g.deadline, "arrival")
+            return view(*args, **kwargs)
+        except DeadlineExceeded as e:
+            return jsonify({
+                "status": "error",
+                "message": str(e)
+            }), 504
+    return wrapper
+
+# Admission control: bounded concurrency and bounded queue per worker (configurable via environment)
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS", "2"))
+MAX_QUEUED_REQUESTS = int(os.environ.get("MAX_QUEUED_REQUESTS", "8"))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", "5"))  # Max seconds a request waits for a free slot
+RETRY_AFTER = int(os.environ.get("RETRY_AFTER", "1"))        # Seconds suggested to clients that were shed
+# Share of the queue each priority class may occupy, lower classes are shed first
+PRIORITY_QUEUE_SHARE = {"high": 1.0, "normal": 0.75, "low": 0.25}
+PRIORITY_ORDER = ["high", "normal", "low"]
+
+class AdmissionController:
+    def __init__(self, max_concurrent, max_queued):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.active = 0
+        self.waiting = {priority: 0 for priority in PRIORITY_ORDER}
+        self.condition = threading.Condition()
+        self.stats = {"admitted": 0, "shed_priority": 0, "shed_queue_full": 0, "shed_timeout": 0}
+
+    def _can_run(self, priority):
+        # A request only takes a free slot if no higher priority request is waiting for it
+        higher = PRIORITY_ORDER[:PRIORITY_ORDER.index(priority)]
+        return self.active < self.max_concurrent and not any(self.waiting[p] for p in higher)
+
+    def acquire(self, priority, timeout):
+        # Returns None when admitted, otherwise the reason the request was shed
+        with self.condition:
+            if self._can_run(priority) and self.waiting[priority] == 0:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return None
+            queued = sum(self.waiting.values())
+            if queued >= self.max_queued:
+                self.stats["shed_queue_full"] += 1
+                return "queue_full"
+            if queued >= int(self.max_queued * PRIORITY_QUEUE_SHARE[priority]):
+                self.stats["shed_priority"] += 1
+                return "priority"
+            self.waiting[priority] += 1
+            try:
+                admitted = self.condition.wait_for(lambda: self._can_run(priority), timeout=timeout)
+            finally:
+                self.waiting[priority] -= 1
+            if not admitted:
+                self.stats["shed_timeout"] += 1
+                self.condition.notify_all()
+                return "timeout"
+            self.active += 1
+            self.stats["admitted"] += 1
+            return None
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+    def snapshot(self):
+        with self.condition:
+            return {
+                "active": self.active,
+                "queued": sum(self.waiting.values()),
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                **self.stats
+            }
+
+admission_controller = AdmissionController(MAX_CONCURRENT_REQUESTS, MAX_QUEUED_REQUESTS)
+
+def get_request_priority():
+    priority = request.headers.get("X-Priority", "normal").lower()
+    return priority if priority in PRIORITY_QUEUE_SHARE else "normal"
+
+def overload_response(reason):
+    # Priority shedding means this client should back off (429), a full queue means the service is saturated (503)
+    status_code = 429 if reason == "priority" else 503
+    response = jsonify({
+        "status": "error",
+        "message": f"Service overloaded ({reason}), retry later"
+    })
+    response.headers["Retry-After"] = str(RETRY_AFTER)
+    return response, status_code
+
+def admission_controlled(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        deadline = g.get("deadline")
+        queue_timeout = QUEUE_TIMEOUT if deadline is None else max(min(QUEUE_TIMEOUT, remaining_budget(deadline)), 0)
+        rejection = admission_controller.acquire(get_request_priority(), queue_timeout)
+        if rejection is not None:
+            if rejection == "timeout":
+                check_deadline(deadline, "admission")
+            return overload_response(rejection)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            admission_controller.release()
+    return wrapper
+
+# Admin routes (key rotation, catalog reloads) need the operator's token in X-Admin-Token
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+
+def admin_authorized():
+    # Fails closed: without a configured token nobody may use the admin routes
+    return ADMIN_TOKEN is not None and request.headers.get("X-Admin-Token") == ADMIN_TOKEN
+
+# Compact decision shapes selected with "response_format": a packed bitmap (bit i set when geofence i is inside,
+# most significant bit first), the sorted inside indices, or only the first inside index
+RESPONSE_FORMATS = ("list", "bitmap", "indices", "first", "any", "rings")
+
+def encode_decisions(inside_indices, count, response_format):
+    if response_format == "bitmap":
+        bitmap = bytearray((count + 7) // 8)
+        for idx in inside_indices:
+            bitmap[idx >> 3] |= 0x80 >> (idx & 7)
+        return {"format": "bitmap", "count": count, "bitmap": base64.b64encode(bytes(bitmap)).decode("ascii")}
+    if response_format == "indices":
+        return {"format": "indices", "count": count, "inside": list(inside_indices)}
+    if response_format == "any":
+        return {"format": "any", "count": count, "match": bool(inside_indices), "first_match": inside_indices[0] if inside_indices else None}
+    return {"format": "first", "count": count, "first_inside": inside_indices[0] if inside_indices else None}